@@ -0,0 +1,294 @@
+#!/usr/bin/python
+
+from seecrdeps import includeParentAndDeps         #DO_NOT_DISTRIBUTE
+includeParentAndDeps(__file__)                     #DO_NOT_DISTRIBUTE
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from os.path import join
+from random import Random
+from shutil import rmtree
+from subprocess import Popen, check_call
+from tempfile import mkdtemp
+from time import time, sleep
+import platform
+import sys
+
+from simplejson import dump, load
+from MySQLdb import Connect
+
+from moatley.db import Json, Mysql, Sqlite, DbObject
+from moatley.db.fields import StrField, IntField, DecimalField, DateField, ReferenceField, CollectionField
+
+class Author(DbObject):
+    name = StrField("name", index=True)
+
+class Page(DbObject):
+    number = IntField("number")
+    text = StrField("text")
+
+class Book(DbObject):
+    title = StrField("title", index=True)
+    year = IntField("year")
+    price = DecimalField("price", fractionLength=2)
+    published = DateField("published")
+    author = ReferenceField("author")
+    pages = CollectionField("pages")
+
+CLASSES = [Author, Page, Book]
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(len(sortedValues) - 1, int(round(fraction * (len(sortedValues) - 1))))]
+
+class Timer(object):
+    def __init__(self):
+        self.latencies = []
+        self.operations = 0
+
+    @contextmanager
+    def measure(self, operations=1):
+        start = time()
+        yield
+        self.latencies.append(time() - start)
+        self.operations += operations
+
+    def result(self):
+        latencies = sorted(self.latencies)
+        total = sum(latencies)
+        return dict(
+            operations=self.operations,
+            seconds=total,
+            opsPerSec=self.operations / total if total else 0.0,
+            p50=percentile(latencies, 0.50),
+            p99=percentile(latencies, 0.99))
+
+class Workload(object):
+    def __init__(self, count, pagesPerBook, seed):
+        self._count = count
+        self._pagesPerBook = pagesPerBook
+        self._seed = seed
+
+    def authors(self):
+        return [Author(name="Author {}".format(i)) for i in range(max(1, self._count / 10))]
+
+    def books(self, authors, pages=0):
+        random = Random(self._seed)
+        return [Book(
+                title="Book {}".format(random.randint(0, self._count)),
+                year=random.randint(1900, 2020),
+                price=Decimal(random.randint(100, 10000)) / 100,
+                author=random.choice(authors),
+                pages=[Page(number=n, text="page {}".format(n)) for n in range(pages)])
+            for i in range(self._count)]
+
+    def scenarios(self):
+        return [
+            ('construct', self._construct),
+            ('store', self._store),
+            ('storeMany', self._storeMany),
+            ('get', self._get),
+            ('listFiltered', self._listFiltered),
+            ('graphStore', self._graphStore),
+            ('graphGet', self._graphGet),
+        ]
+
+    def _construct(self, db, timer):
+        for i in range(self._count):
+            with timer.measure():
+                Book(title="Book {}".format(i), year=i, price=Decimal("1.00"))
+
+    def _store(self, db, timer):
+        authors = self.authors()
+        db.storeMany(authors)
+        for book in self.books(authors):
+            with timer.measure():
+                db.store(book)
+
+    def _storeMany(self, db, timer):
+        authors = self.authors()
+        db.storeMany(authors)
+        books = self.books(authors)
+        with timer.measure(operations=len(books)):
+            db.storeMany(books)
+
+    def _get(self, db, timer):
+        authors = self.authors()
+        books = self.books(authors)
+        db.storeMany(authors + books)
+        for book in books:
+            with timer.measure():
+                db.get(Book, book.ID)
+
+    def _listFiltered(self, db, timer):
+        authors = self.authors()
+        books = self.books(authors)
+        db.storeMany(authors + books)
+        for book in books[:max(1, self._count / 10)]:
+            with timer.measure():
+                list(db.list(Book, title=book.title))
+
+    def _graphStore(self, db, timer):
+        authors = self.authors()
+        db.storeMany(authors)
+        for book in self.books(authors, pages=self._pagesPerBook)[:max(1, self._count / 10)]:
+            with timer.measure():
+                db.store(book)
+
+    def _graphGet(self, db, timer):
+        authors = self.authors()
+        books = self.books(authors, pages=self._pagesPerBook)[:max(1, self._count / 10)]
+        db.storeMany(authors + books)
+        for book in books:
+            with timer.measure():
+                db.get(Book, book.ID).pages
+
+@contextmanager
+def throwawayMysqld(mysqld):
+    dataDir = mkdtemp(prefix='moatley-bench-mysql-')
+    socket = join(dataDir, 'mysqld.sock')
+    process = None
+    try:
+        check_call([mysqld, '--no-defaults', '--initialize-insecure', '--datadir={}'.format(join(dataDir, 'data'))])
+        process = Popen([mysqld, '--no-defaults', '--datadir={}'.format(join(dataDir, 'data')), '--socket={}'.format(socket), '--skip-networking', '--pid-file={}'.format(join(dataDir, 'mysqld.pid'))])
+        for _ in range(300):
+            try:
+                connection = Connect(user='root', unix_socket=socket)
+                connection.cursor().execute("CREATE DATABASE IF NOT EXISTS `bench`")
+                connection.close()
+                break
+            except Exception:
+                sleep(0.1)
+        else:
+            raise RuntimeError("mysqld did not start within 30 seconds")
+        yield socket
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        rmtree(dataDir, ignore_errors=True)
+
+@contextmanager
+def jsonBackend(options):
+    root = mkdtemp(prefix='moatley-bench-json-')
+    try:
+        def _create():
+            rmtree(root)
+            db = Json(root=root)
+            db.registerClass(*CLASSES)
+            for objectType in CLASSES:
+                db.define(objectType)
+            return db
+        yield _create
+    finally:
+        rmtree(root, ignore_errors=True)
+
+@contextmanager
+def sqliteBackend(options):
+    root = mkdtemp(prefix='moatley-bench-sqlite-')
+    try:
+        def _create():
+            db = Sqlite(join(root, 'bench.sqlite'))
+            db.registerClass(*CLASSES)
+            for objectType in CLASSES:
+                db.define(objectType, dropIfExists=True)
+            return db
+        yield _create
+    finally:
+        rmtree(root, ignore_errors=True)
+
+@contextmanager
+def mysqlBackend(options):
+    @contextmanager
+    def _server():
+        if options.mysqlUser:
+            yield None
+        else:
+            with throwawayMysqld(options.mysqld) as socket:
+                yield socket
+
+    with _server() as socket:
+        def _create():
+            if socket is None:
+                db = Mysql(options.mysqlUser, options.mysqlPassword, options.mysqlDatabase)
+            else:
+                db = Mysql('root', '', 'bench', unixSocket=socket)
+            db.registerClass(*CLASSES)
+            for objectType in CLASSES:
+                db.define(objectType, dropIfExists=True)
+            return db
+        yield _create
+
+BACKENDS = dict(json=jsonBackend, sqlite=sqliteBackend, mysql=mysqlBackend)
+
+def run(options):
+    results = {}
+    workload = Workload(options.count, options.pages, options.seed)
+    for backendName in options.backends:
+        with BACKENDS[backendName](options) as createDb:
+            for scenarioName, scenario in workload.scenarios():
+                if options.scenarios and scenarioName not in options.scenarios:
+                    continue
+                timer = Timer()
+                for _ in range(options.repeat):
+                    scenario(createDb(), timer)
+                results['{}.{}'.format(backendName, scenarioName)] = timer.result()
+                print "{:<24} {opsPerSec:>12.1f} ops/s  p50 {p50:.6f}s  p99 {p99:.6f}s".format('{}.{}'.format(backendName, scenarioName), **results['{}.{}'.format(backendName, scenarioName)])
+    return dict(
+        meta=dict(
+            timestamp=datetime.now().isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            count=options.count,
+            pages=options.pages,
+            repeat=options.repeat,
+            seed=options.seed),
+        results=results)
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in sorted(results['results'].items()):
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        if current['opsPerSec'] < previous['opsPerSec'] * (1 - threshold):
+            regressions.append("{}: {:.1f} ops/s, baseline {:.1f} ops/s".format(name, current['opsPerSec'], previous['opsPerSec']))
+        if current['p99'] > previous['p99'] * (1 + threshold):
+            regressions.append("{}: p99 {:.6f}s, baseline {:.6f}s".format(name, current['p99'], previous['p99']))
+    return regressions
+
+def main(args=None):
+    parser = ArgumentParser(description="Measure store/get/list throughput of the moatley-db backends")
+    parser.add_argument('--backend', dest='backends', action='append', choices=sorted(BACKENDS), help="Backend to measure, may be repeated (default: all)")
+    parser.add_argument('--scenario', dest='scenarios', action='append', help="Scenario to run, may be repeated (default: all)")
+    parser.add_argument('--count', type=int, default=1000, help="Objects per scenario")
+    parser.add_argument('--pages', type=int, default=50, help="Pages per book in the graph scenarios")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per scenario")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against results previously written with --output")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Allowed relative regression against the baseline")
+    parser.add_argument('--mysqld', default='mysqld', help="mysqld binary for the throwaway server")
+    parser.add_argument('--mysql-user', dest='mysqlUser', help="Use an existing server instead of a throwaway mysqld")
+    parser.add_argument('--mysql-password', dest='mysqlPassword', default='')
+    parser.add_argument('--mysql-database', dest='mysqlDatabase', default='bench')
+    options = parser.parse_args(args)
+    options.backends = options.backends or sorted(BACKENDS)
+
+    results = run(options)
+    if options.output:
+        with open(options.output, 'w') as fp:
+            dump(results, fp, indent=4, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as fp:
+            regressions = compare(results, load(fp), options.threshold)
+        for regression in regressions:
+            print "REGRESSION", regression
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,8 @@
 
 from mysql import Mysql
+from sqlite import Sqlite
 from json import Json
+from segments import Segments
 from dbobject import DbObject
+from index import Index
+from asyncdb import AsyncDB
@@ -0,0 +1,130 @@
+from Queue import Queue
+from threading import Thread, Condition
+from sys import exc_info
+from time import time
+
+class FutureTimeout(Exception):
+    pass
+
+class Future(object):
+    def __init__(self):
+        self._condition = Condition()
+        self._done = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        with self._condition:
+            return self._done
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return None if self._error is None else self._error[1]
+
+    def addDoneCallback(self, callback):
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _wait(self, timeout):
+        deadline = None if timeout is None else time() + timeout
+        with self._condition:
+            while not self._done:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    raise FutureTimeout("Result not available within {} seconds".format(timeout))
+                self._condition.wait(remaining)
+
+    def _resolve(self, result=None, error=None):
+        with self._condition:
+            self._result = result
+            self._error = error
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for callback in callbacks:
+            callback(self)
+
+class AsyncDB(object):
+    def __init__(self, db, workers=4, queueSize=0):
+        if workers < 1:
+            raise ValueError("An AsyncDB needs at least one worker")
+        self._db = db
+        self._queue = Queue(maxsize=queueSize)
+        self._workers = []
+        for _ in range(workers):
+            worker = Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def db(self):
+        return self._db
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, function, args, kwargs))
+        return future
+
+    def get(self, objectType, identifier, **kwargs):
+        return self.submit(self._db.get, objectType, identifier, **kwargs)
+
+    def store(self, anObject):
+        return self.submit(self._db.store, anObject)
+
+    def storeMany(self, objects, batchSize=1000):
+        return self.submit(self._db.storeMany, objects, batchSize=batchSize)
+
+    def delete(self, objectType, identifier):
+        return self.submit(self._db.delete, objectType, identifier)
+
+    def deleteMany(self, objectType, identifiers):
+        return self.submit(self._db.deleteMany, objectType, identifiers)
+
+    def deleteWhere(self, objectType, **filters):
+        return self.submit(self._db.deleteWhere, objectType, **filters)
+
+    def exists(self, objectType, identifier):
+        return self.submit(self._db.exists, objectType, identifier)
+
+    def list(self, objectType, **kwargs):
+        return self.submit(lambda: list(self._db.list(objectType, **kwargs)))
+
+    def all(self, query):
+        return self.submit(lambda: list(query))
+
+    def count(self, objectType, **filters):
+        return self.submit(self._db.count, objectType, **filters)
+
+    def aggregate(self, objectType, function, fieldName=None, groupBy=None, **filters):
+        return self.submit(self._db.aggregate, objectType, function, fieldName, groupBy=groupBy, **filters)
+
+    def close(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, function, args, kwargs = task
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                future._resolve(error=exc_info())
+            else:
+                future._resolve(result=result)
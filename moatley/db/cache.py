@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+class ObjectCache(object):
+    def __init__(self, maxSize=10000, ttl=None):
+        self._maxSize = maxSize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._owners = {}
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, qualifiedId):
+        with self._lock:
+            entry = self._entries.pop(qualifiedId, None)
+            if entry is not None and self._ttl is not None and time() - entry[1] > self._ttl:
+                self._expirations += 1
+                self._forget(qualifiedId, entry)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries[qualifiedId] = entry
+            self._hits += 1
+        return entry[0]._copy({})
+
+    def put(self, anObject):
+        copies = {}
+        snapshot = anObject._copy(copies)
+        members = set(copied.qualifiedId for key, copied in copies.items() if type(key) is not tuple)
+        members.discard(snapshot.qualifiedId)
+        with self._lock:
+            self._remove(snapshot.qualifiedId)
+            self._entries[snapshot.qualifiedId] = (snapshot, time(), members)
+            for member in members:
+                self._owners.setdefault(member, set()).add(snapshot.qualifiedId)
+            while len(self._entries) > self._maxSize:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate(self, qualifiedId):
+        with self._lock:
+            self._invalidate(qualifiedId)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+
+    def _invalidate(self, qualifiedId):
+        self._remove(qualifiedId)
+        for owner in self._owners.pop(qualifiedId, ()):
+            self._invalidate(owner)
+
+    def _remove(self, qualifiedId):
+        entry = self._entries.pop(qualifiedId, None)
+        if entry is not None:
+            self._forget(qualifiedId, entry)
+
+    def _forget(self, qualifiedId, entry):
+        for member in entry[2]:
+            owners = self._owners.get(member)
+            if owners is not None:
+                owners.discard(qualifiedId)
+                if not owners:
+                    del self._owners[member]
+
+    def statistics(self):
+        with self._lock:
+            return dict(
+                size=len(self._entries),
+                maxSize=self._maxSize,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                expirations=self._expirations)
+
+
+class RecordCache(object):
+    def __init__(self, maxSize=10000):
+        self._maxSize = maxSize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, signature):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] != signature:
+                self._misses += 1
+                return None
+            self._entries[key] = entry
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key, signature, record):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (signature, record)
+            while len(self._entries) > self._maxSize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def statistics(self):
+        with self._lock:
+            return dict(
+                size=len(self._entries),
+                maxSize=self._maxSize,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions)
@@ -1,15 +1,23 @@
+from sys import exc_info
+
 class Cursor(object):
-    def __init__(self, db):
-        self._db = db
+    def __init__(self, pool, cursorClass=None, exclusive=False):
+        self._checkout = pool.connection(exclusive=exclusive)
+        self._cursorClass = cursorClass
         self._cursor = None
 
     def __enter__(self):
-        self._db.ping(True)
-        self._cursor = self._db.cursor()
+        db = self._checkout.__enter__()
+        try:
+            self._cursor = db.cursor() if self._cursorClass is None else db.cursor(self._cursorClass)
+        except:
+            self._checkout.__exit__(*exc_info())
+            raise
         return self._cursor
 
     def __exit__(self, type, value, traceback):
-        self._db.commit()
-        self._cursor.close()
-
+        try:
+            self._cursor.close()
+        finally:
+            self._checkout.__exit__(type, value, traceback)
 
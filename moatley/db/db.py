@@ -1,6 +1,68 @@
+from .query import Query, Pages, aggregate
+from .fields import ReferenceField
+from .instrumentation import Instrumentation, instrumented
+
+from contextlib import contextmanager
+from collections import OrderedDict
+
+MAX_DELETED = 10000
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def byType(qualifiedIds):
+    identifiersByType = OrderedDict()
+    for qualifiedId in qualifiedIds:
+        objectTypeName, identifier = qualifiedId.split(":", 1)
+        identifiersByType.setdefault(objectTypeName, []).append(identifier)
+    return identifiersByType
+
 class DB(object):
-    def __init__(self):
+    def __init__(self, objectCache=None, lazy=False, instrumentation=None):
         self._registry = {}
+        self._objectCache = objectCache
+        self._lazy = lazy
+        self._instrumentation = instrumentation or Instrumentation()
+        self._storeToken = object()
+        self._deleted = set()
+
+    @property
+    def instrumentation(self):
+        return self._instrumentation
+
+    def addObserver(self, observer):
+        self._instrumentation.addObserver(observer)
+
+    def _objectType(self, objectType):
+        if type(objectType) is str:
+            errorText = "No class named '{}' registered".format(objectType)
+            objectType = self.findClass(objectType)
+            if objectType is None:
+                raise ValueError(errorText)
+        return objectType
+
+    def cacheStatistics(self):
+        return None if self._objectCache is None else self._objectCache.statistics()
+
+    def _cachedObject(self, objectType, identifier):
+        if self._objectCache is None:
+            return None
+        return self._objectCache.get("{}:{}".format(objectType.__name__, identifier))
+
+    def _cacheObject(self, anObject):
+        if self._objectCache is not None and anObject is not None:
+            self._objectCache.put(anObject)
+
+    def _uncacheObject(self, objectType, identifier):
+        if self._objectCache is not None:
+            self._objectCache.invalidate("{}:{}".format(objectType.__name__, identifier))
 
     def registerClass(self, *objClasses):
         for objClass in objClasses:
@@ -9,22 +71,127 @@ class DB(object):
     def findClass(self, objClassName):
         return self._registry.get(objClassName, None)
 
+    @contextmanager
+    def transaction(self):
+        yield
+
     def define(self, objectType, dropIfExists=False):
         raise NotImplementedError()
 
     def store(self, anObject):
         raise NotImplementedError()
 
+    def storeMany(self, objects, batchSize=1000):
+        for anObject in objects:
+            self.store(anObject)
+
+    def _isStored(self, anObject):
+        return anObject._isStoredIn(self) and anObject.qualifiedId not in self._deleted
+
+    def _isClean(self, anObject):
+        return self._isStored(anObject) and not anObject._isDirty()
+
+    def _markStored(self, anObject):
+        self._deleted.discard(anObject.qualifiedId)
+        anObject._markClean(self)
+
+    def _markDeleted(self, objectType, identifiers):
+        self._deleted.update("{}:{}".format(objectType.__name__, identifier) for identifier in identifiers)
+        if len(self._deleted) > MAX_DELETED:
+            self._markAllDeleted()
+
+    def _markAllDeleted(self):
+        self._storeToken = object()
+        self._deleted.clear()
+
+    def _storeMembers(self, anObject):
+        schema = anObject.schema()
+        for field in schema.referenceFields:
+            if field.deferred(anObject) is None and getattr(anObject, field.name) is not None:
+                self.store(getattr(anObject, field.name))
+        for field in schema.collectionFields:
+            if field.deferred(anObject) is None:
+                for item in getattr(anObject, field.name):
+                    self.store(item)
+
+    def query(self, objectType):
+        return Query(self, self._objectType(objectType))
+
+    def iterate(self, objectType, pageSize=1000, resumeToken=None, prefetch=True, **filters):
+        return Pages(self.query(objectType).where(**filters), pageSize, resumeToken=resumeToken, prefetch=prefetch)
+
+    @instrumented('count')
+    def count(self, objectType, **filters):
+        return self.query(objectType).where(**filters).count()
+
+    @instrumented('existsWhere')
+    def existsWhere(self, objectType, **filters):
+        return self.query(objectType).where(**filters).exists()
+
+    @instrumented('aggregate')
+    def aggregate(self, objectType, function, fieldName=None, groupBy=None, **filters):
+        return self.query(objectType).where(**filters).aggregate(function, fieldName, groupBy=groupBy)
+
+    @instrumented('deleteWhere')
+    def deleteWhere(self, objectType, **filters):
+        return self.query(objectType).where(**filters).delete()
+
+    @instrumented('deleteMany')
+    def deleteMany(self, objectType, identifiers):
+        objectType = self._objectType(objectType)
+        contained = []
+        deleted = 0
+        for identifier in identifiers:
+            anObject = self.get(objectType, identifier)
+            if anObject is None:
+                continue
+            for field in objectType.schema().collectionFields:
+                if field.isContained:
+                    contained.extend(item.qualifiedId for item in getattr(anObject, field.name) if item is not None)
+            self.delete(objectType, identifier)
+            deleted += 1
+        self._deleteContained(contained)
+        return deleted
+
+    def _deleteContained(self, qualifiedIds):
+        for objectTypeName, identifiers in byType(qualifiedIds).items():
+            self.deleteMany(objectTypeName, identifiers)
+
+    def _containedItems(self, objectType, record):
+        return [qualifiedId for field in objectType.schema().collectionFields if field.isContained
+            for qualifiedId in record.get(field.name) or []]
+
+    def _executeQuery(self, query):
+        equalities = dict((condition.field.name, condition.value) for condition in query.conditions if condition.operator == '=')
+        return query.apply(self.list(query.objectType, **equalities))
+
+    def _countQuery(self, query):
+        return sum(1 for _ in self._executeQuery(query))
+
+    def _existsQuery(self, query):
+        return any(True for _ in self._executeQuery(query.limit(1)))
+
+    def _deleteQuery(self, query):
+        return self.deleteMany(query.objectType, [anObject.ID for anObject in self._executeQuery(query)])
+
+    def _aggregateQuery(self, query, function, field, groupBy):
+        def _groupKey(anObject):
+            if groupBy is None:
+                return None
+            value = getattr(anObject, groupBy.name)
+            return value and value.qualifiedId if type(groupBy) is ReferenceField else value
+        return aggregate(function, ((_groupKey(anObject), None if field is None else getattr(anObject, field.name)) for anObject in self._executeQuery(query)), grouped=groupBy is not None)
+
     def delete(self, objectType, identifier):
         raise NotImplementedError()
 
     def exists(self, objectType, identifier):
         raise NotImplementedError()
 
-    def get(self, objectType, identifier):
+    def get(self, objectType, identifier, prefetch=None):
         raise NotImplementedError()
 
-    def list(self, objectType, **kwargs):
+    def list(self, objectType, prefetch=None, **kwargs):
         raise NotImplementedError()
 
     def drop(self, objectType):
@@ -1,16 +1,66 @@
-from .fields import IDField, findFields
+from .fields import IDField, CollectionField
+from .schema import Schema
+
+_MISSING = object()
+
+class SlotValues(list):
+    __slots__ = ()
+    _positions = {}
+
+    @classmethod
+    def forSchema(cls, schema):
+        return type('SlotValues', (cls,), {'__slots__': (), '_positions': schema.positions})
+
+    def __init__(self):
+        super(SlotValues, self).__init__([_MISSING] * len(self._positions))
+
+    def __contains__(self, name):
+        return list.__getitem__(self, self._positions[name]) is not _MISSING
+
+    def __getitem__(self, name):
+        value = list.__getitem__(self, self._positions[name])
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        list.__setitem__(self, self._positions[name], value)
+
+    def get(self, name, default=None):
+        value = list.__getitem__(self, self._positions[name])
+        return default if value is _MISSING else value
+
+class DbObjectType(type):
+    def __new__(mcs, name, bases, namespace):
+        compact = namespace.get('_compact', any(getattr(base, '_compact', False) for base in bases))
+        if compact and '__slots__' not in namespace:
+            namespace['__slots__'] = ()
+        return super(DbObjectType, mcs).__new__(mcs, name, bases, namespace)
+
+    def __init__(cls, name, bases, namespace):
+        super(DbObjectType, cls).__init__(name, bases, namespace)
+        cls._schema = Schema(cls)
+        cls._valuesType = SlotValues.forSchema(cls._schema) if cls._compact else dict
 
 class DbObject(object):
+    __metaclass__ = DbObjectType
+    __slots__ = ('_values', '_dirty', '_storedIn')
+    _compact = False
+
     ID=IDField("ID")
 
     @classmethod
     def fields(self):
-        return findFields(self)
+        return list(self._schema.fields)
+
+    @classmethod
+    def schema(self):
+        return self._schema
 
     @classmethod
     def fromWeb(self, **kwargs):
         values = {}
-        for field in findFields(self):
+        for field in self._schema.fields:
             if field.name in kwargs:
                 values[field.name] = field.fromWeb(kwargs[field.name])
         return self(**values)
@@ -20,17 +70,64 @@ class DbObject(object):
         return "{}:{}".format(self.__class__.__name__, self.ID)
 
     def __init__(self, **kwargs):
-        self._values = {}
-        fields = findFields(self.__class__)
-        for field in fields:
+        self._values = self._valuesType()
+        self._dirty = None
+        self._storedIn = None
+        for field in self._schema.fields:
             value = kwargs[field.name] if field.name in kwargs else field._defaultValue(self, self.__class__)
             setattr(self, field.name, value)
 
+    def _markDirty(self, name):
+        if self._dirty is None:
+            self._dirty = set()
+        self._dirty.add(name)
+
+    def _markClean(self, db):
+        self._dirty = None
+        self._storedIn = None if db is None else db._storeToken
+
+    def _isStoredIn(self, db):
+        return self._storedIn is db._storeToken
+
+    def _isDirty(self, name=None):
+        if self._dirty is None:
+            return False
+        return bool(self._dirty) if name is None else name in self._dirty
+
+    def _copy(self, copies):
+        copied = copies.get(id(self))
+        if copied is None:
+            objectType = self.__class__
+            copied = copies[id(self)] = objectType.__new__(objectType)
+            copied._values = self._valuesType()
+            for field in self._schema.fields:
+                if field.name in self._values:
+                    copied._values[field.name] = field._copy(copied, self._values[field.name], copies)
+            copied._dirty = None if self._dirty is None else set(self._dirty)
+            copied._storedIn = self._storedIn
+        return copied
+
+    def __getstate__(self):
+        values = {}
+        for field in self._schema.fields:
+            value = getattr(self, field.name)
+            values[field.name] = list(value) if type(field) is CollectionField else value
+        return values, sorted(self._dirty or ())
+
+    def __setstate__(self, state):
+        values, dirty = state
+        self._values = self._valuesType()
+        self._dirty = None
+        self._storedIn = None
+        for name, value in values.items():
+            setattr(self, name, value)
+        self._dirty = set(dirty) or None
+
     def keys(self):
-        return [field.name for field in findFields(self.__class__)]
+        return list(self._schema.names)
 
     def __getitem__(self, name):
-        if name in self.keys():
+        if name in self._schema.byName:
             return getattr(self, name) 
         raise KeyError(name)
 
@@ -38,17 +135,27 @@ class DbObject(object):
         if name == "ID":
             raise KeyError("Cannot set ID")
 
-        if name in self.keys():
+        if name in self._schema.byName:
             setattr(self, name, value)
 
     def __eq__(self, other): 
+        if self._compact:
+            return type(self) is type(other) and all(self._equalValue(other, field) for field in self._schema.fields)
         return type(self) == type(other) and dict(self) == dict(other)
 
+    def _equalValue(self, other, field):
+        mine, theirs = field.deferred(self), field.deferred(other)
+        if mine is not None and theirs is not None:
+            return mine.stored == theirs.stored
+        return getattr(self, field.name) == getattr(other, field.name)
+
     def __repr__(self):
         return "{}: {}".format(self.__class__.__name__, ', '.join('{k}={v}'.format(k=i[0], v=repr(i[1])) for i in sorted(dict(self).items())))
 
     def __hash__(self):
+        if self._compact:
+            return hash((self.__class__.__name__, self.ID))
         return hash(repr(self))
 
     def toWeb(self, **kwargs):
-        return {field.name:field.toWeb(getattr(self, field.name)) if field.name not in kwargs else kwargs[field.name](getattr(self,field.name)) for field in findFields(self.__class__)}
+        return {field.name:field.toWeb(getattr(self, field.name)) if field.name not in kwargs else kwargs[field.name](getattr(self,field.name)) for field in self._schema.fields}
@@ -1,4 +1,7 @@
-from field import Field
+from collections import OrderedDict
+
+from field import Field, Deferred
+from condition import Condition
 
 from strfield import StrField
 from intfield import IntField
@@ -14,9 +17,10 @@ def findFields(oType):
     def _findFields(oType, results):
         if oType == object:
             return
-        results.extend([v for _,v in oType.__dict__.items() if isinstance(v, Field)])
         for sType in oType.__bases__:
             _findFields(sType, results)
-    results = []
+        for field in sorted((v for v in oType.__dict__.values() if isinstance(v, Field)), key=lambda f: f._order):
+            results[field.name] = field
+    results = OrderedDict()
     _findFields(oType, results)
-    return results
+    return results.values()
@@ -1,8 +1,8 @@
 from .field import Field
 
 class BooleanField(Field):
-    def __init__(self, name):
-        super(BooleanField, self).__init__(name, bool)
+    def __init__(self, name, index=False):
+        super(BooleanField, self).__init__(name, bool, index=index)
 
     def fromWeb(self, value):
         return value == "True" or value == "1"
@@ -1,9 +1,49 @@
-from .field import Field
+from .field import Field, Deferred
 
 class _Container(list):
-    pass
+    _owner = None
+    _name = None
+
+    def _changed(self):
+        if self._owner is not None:
+            self._owner._markDirty(self._name)
+
+def _mutator(name):
+    method = getattr(list, name)
+    def mutate(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._changed()
+        return result
+    mutate.__name__ = name
+    return mutate
+
+for _name in ['append', 'extend', 'insert', 'remove', 'pop', 'sort', 'reverse',
+        '__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__']:
+    setattr(_Container, _name, _mutator(_name))
 
 class CollectionField(Field):
     def __init__(self, name, contained=True):
         super(CollectionField, self).__init__(name, _Container)
         self.isContained = contained
+
+    def _bind(self, owner, items):
+        container = _Container(items)
+        container._owner = owner
+        container._name = self.name
+        return container
+
+    def _defaultValue(self, owner, ownerType):
+        return self._bind(owner, [])
+
+    def _resolve(self, owner, deferred):
+        return self._bind(owner, deferred.resolve())
+
+    def _copy(self, owner, value, copies):
+        if isinstance(value, Deferred):
+            return value.copy(copies)
+        return self._bind(owner, [item._copy(copies) for item in value])
+
+    def __set__(self, owner, value):
+        if not isinstance(value, Deferred):
+            value = self._bind(owner, value)
+        super(CollectionField, self).__set__(owner, value)
@@ -0,0 +1,25 @@
+from operator import eq, ne, lt, le, gt, ge
+
+OPERATORS = {
+    '=': eq,
+    '!=': ne,
+    '<': lt,
+    '<=': le,
+    '>': gt,
+    '>=': ge,
+    'IN': lambda value, values: value in values,
+}
+
+class Condition(object):
+    def __init__(self, field, operator, value):
+        if operator not in OPERATORS:
+            raise ValueError("Unsupported operator '{}'".format(operator))
+        self.field = field
+        self.operator = operator
+        self.value = tuple(value) if operator == 'IN' else value
+
+    def matches(self, anObject):
+        return OPERATORS[self.operator](getattr(anObject, self.field.name), self.value)
+
+    def __repr__(self):
+        return "Condition({} {} {!r})".format(self.field.name, self.operator, self.value)
@@ -2,8 +2,8 @@ from datetime import datetime
 from .field import Field
 
 class DateField(Field):
-    def __init__(self, name):
-        super(DateField, self).__init__(name, lambda: datetime.now().date())
+    def __init__(self, name, index=False):
+        super(DateField, self).__init__(name, lambda: datetime.now().date(), index=index)
 
     def fromWeb(self, value):
         return datetime.strptime(value, "%Y-%m-%d").date()
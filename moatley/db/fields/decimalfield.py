@@ -2,8 +2,8 @@ from .field import Field
 from decimal import Decimal
 
 class DecimalField(Field):
-    def __init__(self, name, fractionLength=10):
-        super(DecimalField, self).__init__(name, Decimal)
+    def __init__(self, name, fractionLength=10, index=False):
+        super(DecimalField, self).__init__(name, Decimal, index=index)
         self._fractionLength = fractionLength
 
     @property
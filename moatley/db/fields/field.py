@@ -1,22 +1,84 @@
+from .condition import Condition
+
+class Deferred(object):
+    def __init__(self, load, stored=None, cache=None):
+        self._load = load
+        self.stored = stored
+        self._cache = cache
+
+    def resolve(self):
+        return self._load() if self._cache is None else self._load(self._cache)
+
+    def copy(self, copies):
+        if self._cache is None:
+            return self
+        return Deferred(self._load, self.stored, copies.setdefault(('cache', id(self._cache)), {}))
+
 class Field(object):
-    def __init__(self, name, type):
+    _creationCounter = 0
+
+    def __init__(self, name, type, index=False):
         self._name = name
         self._type = type
+        self._index = index
+        self._order = Field._creationCounter
+        Field._creationCounter += 1
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def index(self):
+        return self._index
+
     def _defaultValue(self, owner, ownerType):
         return self._type()
 
+    def _resolve(self, owner, deferred):
+        return deferred.resolve()
+
+    def _copy(self, owner, value, copies):
+        return value.copy(copies) if isinstance(value, Deferred) else value
+
+    def deferred(self, owner):
+        value = owner._values.get(self._name)
+        return value if isinstance(value, Deferred) else None
+
     def __get__(self, owner, ownerType):
+        if owner is None:
+            return self
         if not self._name in owner._values:
             owner._values[self._name] = self._defaultValue(owner, ownerType)
-        return owner._values[self._name]
+        value = owner._values[self._name]
+        if isinstance(value, Deferred):
+            value = owner._values[self._name] = self._resolve(owner, value)
+        return value
 
     def __set__(self, owner, value):
         owner._values[self._name] = value
+        owner._markDirty(self._name)
+
+    def eq(self, value):
+        return Condition(self, '=', value)
+
+    def ne(self, value):
+        return Condition(self, '!=', value)
+
+    def isIn(self, values):
+        return Condition(self, 'IN', values)
+
+    def __lt__(self, value):
+        return Condition(self, '<', value)
+
+    def __le__(self, value):
+        return Condition(self, '<=', value)
+
+    def __gt__(self, value):
+        return Condition(self, '>', value)
+
+    def __ge__(self, value):
+        return Condition(self, '>=', value)
 
     def toWeb(self, value):
         return str(value)
@@ -1,8 +1,8 @@
 from .field import Field
 
 class IntField(Field):
-    def __init__(self, name):
-        super(IntField, self).__init__(name, int)
+    def __init__(self, name, index=False):
+        super(IntField, self).__init__(name, int, index=index)
 
     def fromWeb(self, value):
         return int(value)
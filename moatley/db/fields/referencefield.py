@@ -1,9 +1,14 @@
 
-from .field import Field
+from .field import Field, Deferred
 
 class ReferenceField(Field):
-    def __init__(self, name):
-        super(ReferenceField, self).__init__(name, lambda: None)
+    def __init__(self, name, index=False):
+        super(ReferenceField, self).__init__(name, lambda: None, index=index)
+
+    def _copy(self, owner, value, copies):
+        if isinstance(value, Deferred):
+            return value.copy(copies)
+        return value if value is None else value._copy(copies)
 
     def toWeb(self, value):
         return None if value is None else value.qualifiedId
@@ -1,8 +1,8 @@
 from .field import Field
 
 class StrField(Field):
-    def __init__(self, name):
-        super(StrField, self).__init__(name, str)
+    def __init__(self, name, index=False):
+        super(StrField, self).__init__(name, str, index=index)
 
     def fromWeb(self, value):
         return str(value)
@@ -1,8 +1,8 @@
 from .field import Field
 
 class TextField(Field):
-    def __init__(self, name):
-        super(TextField, self).__init__(name, str)
+    def __init__(self, name, index=False):
+        super(TextField, self).__init__(name, str, index=index)
 
     def fromWeb(self, value):
         return str(value)
@@ -0,0 +1,27 @@
+from hashlib import sha1
+
+MAX_NAME_LENGTH = 64
+
+class Index(object):
+    def __init__(self, *columns, **kwargs):
+        if not columns:
+            raise ValueError("An index needs at least one column")
+        self.columns = columns
+        self.unique = kwargs.pop('unique', False)
+        self._name = kwargs.pop('name', None)
+        if kwargs:
+            raise TypeError("Unexpected arguments: {}".format(', '.join(sorted(kwargs))))
+
+    def nameFor(self, tableName):
+        if self._name is not None:
+            return self._name
+        name = '{}_{}{}'.format(tableName, 'uniq_' if self.unique else '', '_'.join(self.columns))
+        if len(name) > MAX_NAME_LENGTH:
+            name = '{}_{}'.format(name[:MAX_NAME_LENGTH - 9], sha1(name).hexdigest()[:8])
+        return name
+
+    def __eq__(self, other):
+        return type(self) is type(other) and (self.columns, self.unique, self._name) == (other.columns, other.unique, other._name)
+
+    def __repr__(self):
+        return "Index({}{})".format(', '.join(repr(column) for column in self.columns), ', unique=True' if self.unique else '')
@@ -0,0 +1,171 @@
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from types import GeneratorType
+from collections import deque
+from time import time
+import sys
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class Event(object):
+    def __init__(self, backend, operation, statement, duration, rows=None, objectType=None, api=None):
+        self.backend = backend
+        self.operation = operation
+        self.statement = statement
+        self.duration = duration
+        self.rows = rows
+        self.objectType = objectType
+        self.api = api
+
+    def asDict(self):
+        return dict(
+            backend=self.backend,
+            operation=self.operation,
+            statement=self.statement,
+            duration=self.duration,
+            rows=self.rows,
+            objectType=self.objectType,
+            api=self.api)
+
+    def __repr__(self):
+        return "{}.{} {}/{} {:.6f}s rows={} {}".format(self.backend, self.operation, self.objectType, self.api, self.duration, self.rows, self.statement)
+
+class _Statistic(object):
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, event):
+        self.count += 1
+        self.rows += event.rows or 0
+        self.totalTime += event.duration
+        self.maxTime = max(self.maxTime, event.duration)
+        self.histogram[sum(1 for bound in BUCKETS if event.duration > bound)] += 1
+
+    def asDict(self):
+        return dict(
+            count=self.count,
+            rows=self.rows,
+            totalTime=self.totalTime,
+            maxTime=self.maxTime,
+            averageTime=self.totalTime / self.count if self.count else 0.0,
+            histogram=zip([str(bound) for bound in BUCKETS] + ['inf'], self.histogram))
+
+class Instrumentation(object):
+    def __init__(self, slowQueryThreshold=None, slowQueryLog=None, slowQueryHistory=100):
+        self._slowQueryThreshold = slowQueryThreshold
+        self._slowQueryLog = slowQueryLog
+        self._slowQueries = deque(maxlen=slowQueryHistory)
+        self._observers = []
+        self._statistics = {}
+        self._lock = Lock()
+        self._frames = local()
+
+    def addObserver(self, observer):
+        self._observers.append(observer)
+
+    def removeObserver(self, observer):
+        self._observers.remove(observer)
+
+    def statistics(self):
+        with self._lock:
+            return [dict(objectType=objectType, api=api, operation=operation, **statistic.asDict())
+                for (objectType, api, operation), statistic in sorted(self._statistics.items())]
+
+    def slowQueries(self):
+        with self._lock:
+            return list(self._slowQueries)
+
+    def reset(self):
+        with self._lock:
+            self._statistics.clear()
+            self._slowQueries.clear()
+
+    @contextmanager
+    def frame(self, api, objectType):
+        stack = self._stack()
+        stack.append((api, objectType))
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def wrapGenerator(self, api, objectType, generator):
+        while True:
+            with self.frame(api, objectType):
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+            yield item
+
+    @contextmanager
+    def measure(self, backend, operation, statement):
+        measurement = _Measurement()
+        start = time()
+        try:
+            yield measurement
+        finally:
+            measurement.duration += time() - start
+            self.report(backend, operation, statement, measurement.duration, measurement.rows)
+
+    def report(self, backend, operation, statement, duration, rows=None):
+        stack = self._stack()
+        api, objectType = stack[-1] if stack else (None, None)
+        event = Event(backend, operation, statement, duration, rows=rows, objectType=objectType, api=api)
+        slow = self._slowQueryThreshold is not None and duration >= self._slowQueryThreshold
+        with self._lock:
+            key = (objectType, api, operation)
+            if key not in self._statistics:
+                self._statistics[key] = _Statistic()
+            self._statistics[key].add(event)
+            if slow:
+                self._slowQueries.append(event)
+        if slow:
+            log = self._slowQueryLog or sys.stderr
+            log.write("SLOW {!r}\n".format(event))
+        for observer in self._observers:
+            observer(event)
+        return event
+
+    def _stack(self):
+        if not hasattr(self._frames, 'stack'):
+            self._frames.stack = []
+        return self._frames.stack
+
+class _Measurement(object):
+    def __init__(self):
+        self.rows = None
+        self.duration = 0.0
+
+def _objectTypeName(args):
+    if not args:
+        return None
+    first = args[0]
+    if isinstance(first, basestring):
+        return first
+    if isinstance(first, type):
+        return first.__name__
+    if hasattr(first, 'qualifiedId'):
+        return first.__class__.__name__
+    return None
+
+def instrumented(api):
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            objectType = _objectTypeName(args)
+            with self._instrumentation.frame(api, objectType):
+                result = method(self, *args, **kwargs)
+            if isinstance(result, GeneratorType):
+                return self._instrumentation.wrapGenerator(api, objectType, result)
+            return result
+        return wrapper
+    return decorate
+
+def printStatement(event):
+    print event.statement
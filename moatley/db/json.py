@@ -1,14 +1,23 @@
-from .fields import Field, IntField, StrField, DateField, IDField, CollectionField, findFields, ReferenceField, DecimalField
-from .db import DB
+from .fields import Field, Deferred, IntField, StrField, DateField, IDField, CollectionField, ReferenceField, DecimalField
+from .db import DB, batches
+from .cache import RecordCache
+from .query import aggregate
+from .fields.condition import OPERATORS
+from .instrumentation import instrumented
 
 from os.path import isdir, join, abspath, isfile
 from shutil import rmtree
-from os import makedirs, listdir, remove
+from os import makedirs, listdir, remove, rename, stat
+from errno import ENOENT, EEXIST
+from hashlib import sha1
 from seecr.tools import atomic_write
-from simplejson import dump, load
+from simplejson import dump, dumps, load
 from datetime import datetime
+from functools import partial
+from heapq import heapify, heappop
 import sys
 from uuid import UUID
+from decimal import Decimal
 
 db_transformations = {
     IDField : {
@@ -22,77 +31,278 @@ db_transformations = {
         "from": lambda v, db: [db.get(objType, identifier) for objType, identifier in (i.split(":",1) for i in v)]},
     ReferenceField: {
         "to": lambda v, db: db.store(v),
-        "from": lambda v, db: db.get(*v.split(":", 1))},
+        "from": lambda v, db: v and db.get(*v.split(":", 1))},
     DecimalField: {
         "to": lambda v, db: float(v),
         "from": lambda v, db: v 
         }
 }
 
+store_transformations = dict((fieldType, transformation["to"]) for fieldType, transformation in db_transformations.items())
+
+record_transformations = {
+    IDField: db_transformations[IDField]["to"],
+    DateField: db_transformations[DateField]["to"],
+    CollectionField: lambda v, db: [o.qualifiedId for o in v],
+    ReferenceField: lambda v, db: v and v.qualifiedId,
+    DecimalField: db_transformations[DecimalField]["to"],
+}
+
+INDEXES = '_indexes'
 
 class Json(DB):
-    def __init__(self, root):
-        super(Json, self).__init__()
+    def __init__(self, root, objectCache=None, recordCacheSize=10000, lazy=False, instrumentation=None):
+        super(Json, self).__init__(objectCache=objectCache, lazy=lazy, instrumentation=instrumentation)
         self._root = abspath(root)
+        self._records = RecordCache(maxSize=recordCacheSize)
 
+    def recordCacheStatistics(self):
+        return self._records.statistics()
+
+    @instrumented('define')
     def define(self, objectType, dropIfExists=False):
         objectDir = join(self._root, objectType.__name__)
         if isdir(objectDir) and dropIfExists:
             self.drop(objectType)
         makedirs(objectDir)
+        for field in objectType.schema().indexedFields:
+            makedirs(self._indexDir(objectType, field))
+
+    @instrumented('reindex')
+    def reindex(self, objectType):
+        indexRoot = join(self._root, INDEXES, objectType.__name__)
+        building = indexRoot + '.building'
+        if isdir(building):
+            rmtree(building)
+        makedirs(building)
+        indexedFields = objectType.schema().indexedFields
+        for field in indexedFields:
+            makedirs(join(building, field.name))
+        for identifier in listdir(join(self._root, objectType.__name__)):
+            record = self._readRecord(objectType, identifier)
+            for field in indexedFields:
+                self._addIndexEntry(join(building, field.name), record.get(field.name), identifier)
+        if isdir(indexRoot):
+            rmtree(indexRoot)
+        rename(building, indexRoot)
 
+    @instrumented('store')
     def store(self, anObject):
-        objectDir = join(self._root, anObject.__class__.__name__)
-        itemsToDelete = []
-        if self.exists(anObject.__class__, anObject.ID):
-            storedObject = self.get(anObject.__class__, anObject.ID)
-            collectionFields = [f for f in findFields(anObject.__class__) if type(f) is CollectionField]
-            for collectionField in collectionFields:
-                storedItems = getattr(storedObject, collectionField.name)
-                currentItems = getattr(anObject, collectionField.name)
-                if collectionField.isContained:
-                    itemsToDelete.extend(set(storedItems).difference(currentItems))
-
-        with atomic_write(join(objectDir, str(anObject.ID))) as fp:
-            dump({field.name:db_transformations[type(field)]['to'](getattr(anObject, field.name), self) if type(field) in db_transformations else getattr(anObject, field.name) for field in findFields(anObject.__class__)}, fp)
-
-        if len(itemsToDelete) > 0:
-            for item in itemsToDelete:
-                self.delete(item.__class__, item.ID)
+        if self._isClean(anObject):
+            self._storeMembers(anObject)
+            return anObject.qualifiedId
+        objectType = anObject.__class__
+        storedRecord = self._readRecord(objectType, anObject.ID)
+        record = {field.name:self._fieldRecord(anObject, field, store_transformations) for field in anObject.schema().fields}
+        self._writeRecord(anObject, storedRecord, record, self._activeIndexes(objectType))
+        self._markStored(anObject)
+
+        self._deleteContained(self._removedContainedItems(anObject, storedRecord))
+        self._uncacheObject(objectType, anObject.ID)
         return anObject.qualifiedId
 
+    @instrumented('storeMany')
+    def storeMany(self, objects, batchSize=1000):
+        for batch in batches((anObject for anObject in self._reachableObjects(objects) if not self._isClean(anObject)), batchSize):
+            activeIndexes = {}
+            removed = []
+            for anObject in batch:
+                objectType = anObject.__class__
+                if objectType not in activeIndexes:
+                    activeIndexes[objectType] = self._activeIndexes(objectType)
+                storedRecord = self._readRecord(objectType, anObject.ID)
+                self._uncacheObject(objectType, anObject.ID)
+                self._writeRecord(anObject, storedRecord, self._record(anObject), activeIndexes[objectType])
+                self._markStored(anObject)
+                removed.extend(self._removedContainedItems(anObject, storedRecord))
+            self._deleteContained(removed)
+
+    def _reachableObjects(self, objects):
+        seen, result = set(), []
+        def _visit(anObject):
+            if anObject is None or anObject.qualifiedId in seen:
+                return
+            seen.add(anObject.qualifiedId)
+            schema = anObject.schema()
+            for field in schema.referenceFields:
+                if field.deferred(anObject) is None:
+                    _visit(getattr(anObject, field.name))
+            for field in schema.collectionFields:
+                if field.deferred(anObject) is None:
+                    for item in getattr(anObject, field.name):
+                        _visit(item)
+            result.append(anObject)
+        for anObject in objects:
+            _visit(anObject)
+        return result
+
+    def _removedContainedItems(self, anObject, storedRecord):
+        if storedRecord is None:
+            return []
+        itemsToDelete = []
+        for collectionField in anObject.schema().collectionFields:
+            if collectionField.isContained and collectionField.deferred(anObject) is None:
+                currentItems = set(item.qualifiedId for item in getattr(anObject, collectionField.name))
+                itemsToDelete.extend(item for item in storedRecord.get(collectionField.name, []) if item not in currentItems)
+        return itemsToDelete
+
+    def _record(self, anObject):
+        return {field.name:self._fieldRecord(anObject, field, record_transformations) for field in anObject.schema().fields}
+
+    def _fieldRecord(self, anObject, field, transformations):
+        deferred = field.deferred(anObject)
+        if deferred is not None:
+            return deferred.stored
+        value = getattr(anObject, field.name)
+        return transformations[type(field)](value, self) if type(field) in transformations else value
+
+    def _readRecord(self, objectType, identifier):
+        path = join(self._root, objectType.__name__, str(identifier))
+        try:
+            status = stat(path)
+            signature = (status.st_ino, status.st_size, status.st_mtime)
+            record = self._records.get(path, signature)
+            if record is None:
+                with self._instrumentation.measure('json', 'read', path) as measurement:
+                    with open(path) as fp:
+                        record = load(fp)
+                    measurement.rows = 1
+                self._records.put(path, signature, record)
+            return record
+        except EnvironmentError, e:
+            if e.errno == ENOENT:
+                return None
+            raise
+
+    def _writeRecord(self, anObject, storedRecord, record, activeIndexes):
+        objectType = anObject.__class__
+        identifier = str(anObject.ID)
+        indexChanges = [(field, storedRecord.get(field.name) if storedRecord else None, record.get(field.name))
+            for field in activeIndexes]
+        indexChanges = [(field, old, new) for (field, old, new) in indexChanges if storedRecord is None or self._indexKey(old) != self._indexKey(new)]
+
+        for field, _, new in indexChanges:
+            self._addIndexEntry(self._indexDir(objectType, field), new, identifier)
+        path = join(self._root, objectType.__name__, identifier)
+        with self._instrumentation.measure('json', 'write', path) as measurement:
+            with atomic_write(path) as fp:
+                dump(record, fp)
+            measurement.rows = 1
+        self._records.invalidate(path)
+        if storedRecord is not None:
+            for field, old, _ in indexChanges:
+                self._removeIndexEntry(self._indexDir(objectType, field), old, identifier)
+
+    def _indexDir(self, objectType, field):
+        return join(self._root, INDEXES, objectType.__name__, field.name)
+
+    def _activeIndexes(self, objectType):
+        return [field for field in objectType.schema().indexedFields if isdir(self._indexDir(objectType, field))]
+
+    def _indexKey(self, value):
+        return sha1(dumps(value, sort_keys=True)).hexdigest()
+
+    def _addIndexEntry(self, indexDir, value, identifier):
+        valueDir = join(indexDir, self._indexKey(value))
+        if not isdir(valueDir):
+            try:
+                makedirs(valueDir)
+            except OSError, e:
+                if e.errno != EEXIST:
+                    raise
+        open(join(valueDir, identifier), 'w').close()
+
+    def _removeIndexEntry(self, indexDir, value, identifier):
+        try:
+            remove(join(indexDir, self._indexKey(value), identifier))
+        except OSError, e:
+            if e.errno != ENOENT:
+                raise
+
+    def _indexedIdentifiers(self, objectType, valuesByName):
+        candidates = None
+        for field in self._activeIndexes(objectType):
+            if field.name not in valuesByName:
+                continue
+            identifiers = set()
+            for value in valuesByName[field.name]:
+                value = record_transformations[type(field)](value, self) if type(field) in record_transformations else value
+                valueDir = join(self._indexDir(objectType, field), self._indexKey(value))
+                if isdir(valueDir):
+                    identifiers.update(listdir(valueDir))
+            candidates = identifiers if candidates is None else candidates.intersection(identifiers)
+        return candidates
+
+    @instrumented('delete')
     def delete(self, objectType, identifier):
-        if self.exists(objectType, identifier):
-            remove(join(self._root, objectType.__name__, str(identifier)))
+        objectType = self._objectType(objectType)
+        storedRecord = self._readRecord(objectType, identifier)
+        if storedRecord is not None:
+            self._removeRecord(objectType, identifier, storedRecord, self._activeIndexes(objectType))
+        self._uncacheObject(objectType, identifier)
+
+    @instrumented('deleteMany')
+    def deleteMany(self, objectType, identifiers):
+        objectType = self._objectType(objectType)
+        activeIndexes = self._activeIndexes(objectType)
+        contained = []
+        deleted = 0
+        for identifier in identifiers:
+            storedRecord = self._readRecord(objectType, identifier)
+            if storedRecord is not None:
+                self._removeRecord(objectType, identifier, storedRecord, activeIndexes)
+                contained.extend(self._containedItems(objectType, storedRecord))
+                deleted += 1
+            self._uncacheObject(objectType, identifier)
+        self._deleteContained(contained)
+        return deleted
+
+    def _removeRecord(self, objectType, identifier, storedRecord, activeIndexes):
+        path = join(self._root, objectType.__name__, str(identifier))
+        with self._instrumentation.measure('json', 'remove', path) as measurement:
+            remove(path)
+            measurement.rows = 1
+        self._records.invalidate(path)
+        for field in activeIndexes:
+            self._removeIndexEntry(self._indexDir(objectType, field), storedRecord.get(field.name), str(identifier))
+        self._markDeleted(objectType, [identifier])
 
+    @instrumented('exists')
     def exists(self, objectType, identifier):
         return isfile(join(self._root, objectType.__name__, str(identifier)))
 
-    def get(self, objectType, identifier):
-        if type(objectType) is str:
-            errorText = "No class named '{}' registered".format(objectType)
-            objectType = self.findClass(objectType)
-            if objectType is None:
-                raise ValueError(errorText)
-        result = self._loadJsonFile(objectType, identifier) if self.exists(objectType, str(identifier)) else None
+    @instrumented('get')
+    def get(self, objectType, identifier, prefetch=None):
+        objectType = self._objectType(objectType)
+        result = self._cachedObject(objectType, identifier)
+        if result is None:
+            result = self._loadJsonFile(objectType, identifier)
+            if result is not None:
+                self._cacheObject(result)
         return result
 
     def _loadJsonFile(self, objectType, identifier):
-        objectDir = join(self._root, objectType.__name__)
-        values = load(open(join(objectDir, str(identifier))))
-        fields = {f.name:f for f in findFields(objectType)}
+        values = self._readRecord(objectType, identifier)
+        return None if values is None else self._fromRecord(objectType, values)
+
+    def _fromRecord(self, objectType, values):
+        fields = objectType.schema().byName
         obj = objectType()
         for name in values:
             fieldType = type(fields[name])
-            value = db_transformations[fieldType]["from"](values[name], self) if fieldType in db_transformations else values[name]
+            if self._lazy and fieldType in (ReferenceField, CollectionField):
+                value = Deferred(partial(db_transformations[fieldType]["from"], values[name], self), values[name])
+            else:
+                value = db_transformations[fieldType]["from"](values[name], self) if fieldType in db_transformations else values[name]
             setattr(obj, name, value)
+        obj._markClean(self)
         return obj
 
 
-    def list(self, objectType, **kwargs):
-        objectDir = join(self._root, objectType.__name__)
-        for fname in listdir(objectDir):
-            obj = self._loadJsonFile(objectType, fname)
+    @instrumented('list')
+    def list(self, objectType, prefetch=None, **kwargs):
+        identifiers = self._indexedIdentifiers(objectType, dict((name, [value]) for name, value in kwargs.items()))
+        for obj in self._loadCandidates(objectType, identifiers):
             match = True
             for name, value in kwargs.items():
                 if getattr(obj, name) != value:
@@ -101,7 +311,97 @@ class Json(DB):
             if match:
                 yield obj
 
+    @instrumented('query')
+    def _executeQuery(self, query):
+        objectType = query.objectType
+        if query.ordering == ((objectType.schema().idField, False),):
+            return (self._fromRecord(objectType, record) for record in self._recordsInOrder(query))
+        return query.apply(self._fromRecord(objectType, record) for record in self._matchingRecords(query))
+
+    def _recordsInOrder(self, query):
+        objectType = query.objectType
+        idField = objectType.schema().idField
+        conditions = self._recordConditions(query)
+        identifiers = self._queryCandidates(query)
+        names = [name
+            for name in (listdir(join(self._root, objectType.__name__)) if identifiers is None else identifiers)
+            if all(operator(name, value) for fieldName, operator, value in conditions if fieldName == idField.name)]
+        conditions = [condition for condition in conditions if condition[0] != idField.name]
+        heapify(names)
+        found = 0
+        while names and (query.maxResults is None or found < query.maxResults):
+            record = self._readRecord(objectType, heappop(names))
+            if record is None or not all(operator(record.get(fieldName), value) for fieldName, operator, value in conditions):
+                continue
+            found += 1
+            yield record
+
+    def _queryCandidates(self, query):
+        valuesByName = {}
+        for condition in query.conditions:
+            if condition.operator in ('=', 'IN'):
+                values = [condition.value] if condition.operator == '=' else list(condition.value)
+                name = condition.field.name
+                valuesByName[name] = values if name not in valuesByName else [value for value in valuesByName[name] if value in values]
+        return self._indexedIdentifiers(query.objectType, valuesByName)
+
+    def _countQuery(self, query):
+        return sum(1 for _ in self._matchingRecords(query))
+
+    def _existsQuery(self, query):
+        return any(True for _ in self._matchingRecords(query))
+
+    def _aggregateQuery(self, query, function, field, groupBy):
+        def _groupKey(record):
+            if groupBy is None:
+                return None
+            value = record.get(groupBy.name)
+            if type(groupBy) in db_transformations and type(groupBy) is not ReferenceField and value is not None:
+                return db_transformations[type(groupBy)]["from"](value, self)
+            return value
+        def _value(record):
+            value = None if field is None else record.get(field.name)
+            return Decimal(repr(value)) if type(field) is DecimalField and value is not None else value
+        return aggregate(function, ((_groupKey(record), _value(record)) for record in self._matchingRecords(query)), grouped=groupBy is not None)
+
+    def _deleteQuery(self, query):
+        if query.ordering or query.maxResults is not None:
+            return super(Json, self)._deleteQuery(query)
+        return self.deleteMany(query.objectType, [record['ID'] for record in self._matchingRecords(query)])
+
+    def _matchingRecords(self, query):
+        objectType = query.objectType
+        conditions = self._recordConditions(query)
+        identifiers = self._queryCandidates(query)
+        for identifier in (listdir(join(self._root, objectType.__name__)) if identifiers is None else sorted(identifiers)):
+            record = self._readRecord(objectType, identifier)
+            if record is not None and all(operator(record.get(name), value) for name, operator, value in conditions):
+                yield record
+
+    def _recordConditions(self, query):
+        return [(condition.field.name, OPERATORS[condition.operator], self._recordValue(condition)) for condition in query.conditions]
+
+    def _recordValue(self, condition):
+        transform = record_transformations.get(type(condition.field))
+        if transform is None:
+            return condition.value
+        if condition.operator == 'IN':
+            return tuple(transform(value, self) for value in condition.value)
+        return transform(condition.value, self)
+
+    def _loadCandidates(self, objectType, identifiers):
+        objectDir = join(self._root, objectType.__name__)
+        for fname in (listdir(objectDir) if identifiers is None else sorted(identifiers)):
+            obj = self._loadJsonFile(objectType, fname)
+            if obj is not None:
+                yield obj
+
+    @instrumented('drop')
     def drop(self, objectType):
+        self._markAllDeleted()
         objectDir = join(self._root, objectType.__name__)
         if isdir(objectDir):
             rmtree(objectDir)
+        indexRoot = join(self._root, INDEXES, objectType.__name__)
+        if isdir(indexRoot):
+            rmtree(indexRoot)
@@ -0,0 +1,164 @@
+from .fields import IDField, ReferenceField
+from .query import Query
+
+from time import sleep
+from uuid import UUID
+
+from mysql import Statements
+
+SHADOW = '{}__binary'
+BACKUP = '{}__text'
+
+class BinaryIdMigration(object):
+    def __init__(self, db, batchSize=1000, pause=0.0, maxPasses=10):
+        if not db.binaryIds:
+            raise ValueError("Migrating to binary ids needs a db created with binaryIds=True")
+        self._db = db
+        self._batchSize = batchSize
+        self._pause = pause
+        self._maxPasses = maxPasses
+
+    def migrate(self, objectType, keepSource=True):
+        changes = self.copy(objectType)
+        self.swap(objectType, keepSource=keepSource)
+        return changes
+
+    def copy(self, objectType):
+        source, shadow = self._prepare(objectType)
+        changes = []
+        while len(changes) < self._maxPasses:
+            changes.append(self._pass(objectType, source, shadow))
+            if changes[-1] == 0:
+                break
+        return changes
+
+    def swap(self, objectType, keepSource=True):
+        db = self._db
+        source, shadow = self._prepare(objectType)
+        self._pass(objectType, source, shadow)
+
+        tables = [(source.tableName, shadow.tableName)] + [(sourceLink.tableName, shadowLink.tableName) for sourceLink, shadowLink in zip(source.linkTables, shadow.linkTables)]
+        renames = []
+        for tableName, shadowName in tables:
+            renames.extend([(tableName, BACKUP.format(tableName)), (shadowName, tableName)])
+        db._renameTables(renames)
+
+        for tableName, _ in tables:
+            backup = BACKUP.format(tableName)
+            if keepSource:
+                for name in db._existingIndexes(backup):
+                    if name != 'PRIMARY' and not name.startswith('sqlite_'):
+                        db._dropIndex(backup, name)
+            else:
+                db._execute("DROP TABLE `{}`".format(backup))
+        db.sync(objectType)
+
+    def _prepare(self, objectType):
+        db = self._db
+        tableName = objectType.__name__
+        source = Statements(objectType)
+        shadow = db._statementsType(objectType, db._toDb, tableName=SHADOW.format(tableName))
+        tables = db._tables()
+        if tableName not in tables:
+            raise ValueError("No table '{}' to migrate".format(tableName))
+        db._defineClasses()
+        if shadow.tableName not in tables:
+            db._createTable(shadow, db._engine)
+        for linkTable in shadow.linkTables:
+            if linkTable.tableName not in tables:
+                linkTable.create(db, db._engine)
+        return source, shadow
+
+    def _pass(self, objectType, source, shadow):
+        changes = self._copyRows(objectType, source, shadow)
+        for sourceLink, shadowLink in zip(source.linkTables, shadow.linkTables):
+            changes += self._copyLinks(sourceLink.tableName, shadowLink.tableName)
+        return changes
+
+    def _copyRows(self, objectType, source, shadow):
+        db = self._db
+        idField = source.idField
+        idIndex = list(source.fields).index(idField)
+        query = Query(db, objectType)
+        changes, lower = 0, None
+        while True:
+            page = query.orderBy(idField.name).limit(self._batchSize)
+            if lower is not None:
+                page = page.where(idField > lower)
+            rows = [self._convertRow(source.fields, row) for row in db._sql(*source.selectQuery(page))]
+            upper = UUID(bytes=rows[-1][idIndex]) if len(rows) == self._batchSize else None
+
+            bounds = ([] if lower is None else [idField > lower]) + ([] if upper is None else [idField <= upper])
+            existing = dict((row[idIndex], tuple(row)) for row in db._sql(*shadow.selectQuery(query.where(*bounds))))
+            converted = dict((row[idIndex], row) for row in rows)
+            changed = [row for key, row in converted.items() if existing.get(key) != row]
+            removed = [key for key in existing if key not in converted]
+            if changed:
+                db._executeMany(shadow.upsert(1), changed)
+            if removed:
+                db._execute(shadow.deleteIn(len(removed)), removed)
+            changes += len(changed) + len(removed)
+
+            if upper is None:
+                return changes
+            lower = upper
+            sleep(self._pause)
+
+    def _copyLinks(self, sourceName, shadowName):
+        db = self._db
+        changes, lower = 0, None
+        while True:
+            owners = [row[0] for row in db._sql(*self._ownersAfter(sourceName, lower))]
+            upper = owners[-1] if len(owners) == self._batchSize else None
+
+            converted = {}
+            if owners:
+                for owner, item in db._sql("SELECT `owner`, `item` FROM `{}` WHERE `owner` IN ({})".format(sourceName, ','.join(['%s'] * len(owners))), owners):
+                    converted.setdefault(db._encodeQualifiedId(owner), set()).add(db._encodeQualifiedId(item))
+            existing = {}
+            for owner, item in db._sql(*self._linksBetween(shadowName, lower, upper)):
+                existing.setdefault(str(owner), set()).add(str(item))
+
+            stale = [owner for owner in existing if existing[owner] != converted.get(owner)]
+            stale.extend(owner for owner in converted if owner not in existing)
+            if stale:
+                db._execute("DELETE FROM `{}` WHERE `owner` IN ({})".format(shadowName, ','.join(['%s'] * len(stale))), stale)
+                rows = [(owner, item) for owner in stale for item in sorted(converted.get(owner, ()))]
+                if rows:
+                    db._executeMany("INSERT INTO `{}` (`owner`, `item`) VALUES (%s, %s)".format(shadowName), rows)
+            changes += len(stale)
+
+            if upper is None:
+                return changes
+            lower = upper
+            sleep(self._pause)
+
+    def _ownersAfter(self, tableName, lower):
+        statement = "SELECT DISTINCT `owner` FROM `{}`".format(tableName)
+        args = []
+        if lower is not None:
+            statement += " WHERE `owner` > %s"
+            args.append(lower)
+        return statement + " ORDER BY `owner` LIMIT {:d}".format(self._batchSize), args
+
+    def _linksBetween(self, tableName, lower, upper):
+        conditions, args = [], []
+        if lower is not None:
+            conditions.append("`owner` > %s")
+            args.append(self._db._encodeQualifiedId(lower))
+        if upper is not None:
+            conditions.append("`owner` <= %s")
+            args.append(self._db._encodeQualifiedId(upper))
+        where = " WHERE {}".format(' AND '.join(conditions)) if conditions else ""
+        return "SELECT `owner`, `item` FROM `{}`{}".format(tableName, where), args
+
+    def _convertRow(self, fields, row):
+        db = self._db
+        values = []
+        for field, value in zip(fields, row):
+            if isinstance(field, IDField):
+                value = db._toDb(field, UUID(value))
+            elif isinstance(field, ReferenceField):
+                value = db._encodeQualifiedId(value)
+            values.append(value)
+        return tuple(values)
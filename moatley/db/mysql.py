@@ -1,11 +1,26 @@
-from MySQLdb import Connect, OperationalError, escape_string
-from .fields import Field, IntField, StrField, DateField, IDField, CollectionField, ReferenceField, findFields, DecimalField, BooleanField, TextField
+from MySQLdb import Connect, OperationalError
+from MySQLdb.cursors import SSCursor
+from MySQLdb.constants import CLIENT
+from .fields import Field, Deferred, IntField, StrField, DateField, IDField, CollectionField, ReferenceField, DecimalField, BooleanField, TextField
 from .cursor import Cursor
+from .pool import ConnectionPool
+from .index import Index
+from .instrumentation import instrumented, printStatement
 
 from datetime import datetime
+from decimal import Decimal
+from contextlib import contextmanager
+from functools import partial
+from threading import local
+from time import time
 from uuid import UUID
+from collections import OrderedDict
+from struct import Struct
 
-from db import DB
+from db import DB, batches
+
+CLASS_ID = Struct('>H')
+CLASSES = '_classes'
 
 def reference_from_db(value, db, cache):
     if not value:
@@ -15,24 +30,27 @@ def reference_from_db(value, db, cache):
         cache[value] = db.get(*value.split(":",1), cache=cache)
     return cache[value]
 
+def binary_reference_from_db(value, db, cache):
+    return reference_from_db(db._decodeQualifiedId(value), db, cache)
+
 db_transformations = {
     IntField: {
         "to": lambda v, *args: v,
         "from": lambda v, *args, **kwargs: v},
     StrField: {
-        "to": lambda v, *args: escapeIfNeeded(v),
+        "to": lambda v, *args: v,
         "from": lambda v, *args, **kwargs: v},
     TextField: {
-        "to": lambda v, *args: escapeIfNeeded(v),
+        "to": lambda v, *args: v,
         "from": lambda v, *args, **kwargs: v},
     IDField: {
-        "to": lambda v, *args: escapeIfNeeded(str(v)),
+        "to": lambda v, *args: str(v),
         "from": lambda v, *args, **kwargs: UUID(v)},
     DateField: {
-        "to": lambda v, *args: escapeIfNeeded(str(v)),
+        "to": lambda v, *args: str(v),
         "from": lambda v, *args, **kwargs: v},
     ReferenceField: {
-        "to": lambda v, *args: escapeIfNeeded(v and v.qualifiedId or ''),
+        "to": lambda v, *args: v and v.qualifiedId or '',
         "from": reference_from_db},
     DecimalField: {
         "to": lambda v, *args: float(v),
@@ -42,6 +60,16 @@ db_transformations = {
         "from": lambda v, *args, **kwargs: bool(v)}
 }
 
+binary_transformations = dict(db_transformations)
+binary_transformations.update({
+    IDField: {
+        "to": lambda v, *args: UUID(str(v)).bytes,
+        "from": lambda v, *args, **kwargs: UUID(bytes=v)},
+    ReferenceField: {
+        "to": lambda v, db: db._encodeQualifiedId(v and v.qualifiedId or ''),
+        "from": binary_reference_from_db},
+})
+
 db_types = {
     IntField: "INT(11)",
     StrField: "VARCHAR(255)",
@@ -54,246 +82,806 @@ db_types = {
 
 }
 
-def getDbType(field):
-    r = db_types.get(field.__class__)
+binary_types = dict(db_types)
+binary_types.update({
+    IDField: "BINARY(16)",
+    ReferenceField: "VARBINARY(18)",
+})
+
+def getDbType(field, types=db_types):
+    r = types.get(field.__class__)
     if callable(r):
         r = r(field)
     return r
 
-def escapeIfNeeded(value):
-    return '"{}"'.format(escape_string(value)) if type(value) == str else value
+def to_db(field, value, db=None, transformations=db_transformations):
+    return transformations[field.__class__]['to'](value, db) if field.__class__ in transformations else value
+
+def from_db(field, value, db=None, cache=None, transformations=db_transformations):
+    return transformations[field.__class__]['from'](value, db, cache=cache) if field.__class__ in transformations else value
+
+
+class Statements(object):
+    def __init__(self, objectType, toDb=to_db, tableName=None):
+        schema = objectType.schema()
+        self._tableName = tableName or objectType.__name__
+        self._toDb = toDb
+        self.fields = schema.dbFields
+        self.idField = schema.idField
+        self.valueFields = tuple(field for field in self.fields if field is not self.idField)
+        self.linkTables = tuple(LinkTable(objectType, field, '{}_{}'.format(self._tableName, field.name)) for field in schema.collectionFields)
+
+        byId = self._byId = "WHERE `{}`=%s".format(self.idField.name)
+        self._insertInto = "INSERT INTO `{tableName}` ({columns})".format(
+            tableName=self._tableName,
+            columns=','.join('`{}`'.format(field.name) for field in self.fields))
+        self._rowValues = "({})".format(','.join(['%s'] * len(self.fields)))
+        self._onDuplicateKey = "ON DUPLICATE KEY UPDATE {}".format(
+            ','.join('`{name}`=VALUES(`{name}`)'.format(name=field.name) for field in (self.valueFields or [self.idField])))
+
+        self.insert = "{insertInto} VALUES {rowValues}".format(insertInto=self._insertInto, rowValues=self._rowValues)
+        self.select = "SELECT {columns} FROM `{tableName}`".format(
+            columns=','.join('`{}`'.format(field.name) for field in self.fields),
+            tableName=self._tableName)
+        self.selectIds = "SELECT `{idField}` FROM `{tableName}`".format(idField=self.idField.name, tableName=self._tableName)
+        self.get = "{select} {byId}".format(select=self.select, byId=byId)
+        self.exists = "SELECT COUNT(*) FROM `{tableName}` {byId}".format(tableName=self._tableName, byId=byId)
+        self.delete = "DELETE FROM `{tableName}` {byId}".format(tableName=self._tableName, byId=byId)
+        self._upserts = {}
+        self._updates = {}
+        self._selectWhere = {}
+        self._selectIn = {}
+        self._deleteIn = {}
 
-def to_db(field, value, *args):
-    return db_transformations[field.__class__]['to'](value, *args) if field.__class__ in db_transformations else value
+    @property
+    def tableName(self):
+        return self._tableName
+
+    def upsert(self, rowCount):
+        if rowCount not in self._upserts:
+            self._upserts[rowCount] = "{insertInto} VALUES {rows} {onDuplicateKey}".format(
+                insertInto=self._insertInto,
+                rows=','.join([self._rowValues] * rowCount),
+                onDuplicateKey=self._onDuplicateKey)
+        return self._upserts[rowCount]
+
+    def updateFields(self, fieldNames):
+        if fieldNames not in self._updates:
+            self._updates[fieldNames] = "UPDATE `{tableName}` SET {fields} {byId}".format(
+                tableName=self._tableName,
+                fields=','.join('`{}`=%s'.format(name) for name in fieldNames),
+                byId=self._byId)
+        return self._updates[fieldNames]
+
+    def selectIn(self, identifierCount):
+        if identifierCount not in self._selectIn:
+            self._selectIn[identifierCount] = "{select} WHERE `{idField}` IN ({identifiers})".format(
+                select=self.select,
+                idField=self.idField.name,
+                identifiers=','.join(['%s'] * identifierCount))
+        return self._selectIn[identifierCount]
+
+    def deleteIn(self, identifierCount):
+        if identifierCount not in self._deleteIn:
+            self._deleteIn[identifierCount] = "DELETE FROM `{tableName}` WHERE `{idField}` IN ({identifiers})".format(
+                tableName=self._tableName,
+                idField=self.idField.name,
+                identifiers=','.join(['%s'] * identifierCount))
+        return self._deleteIn[identifierCount]
+
+    def selectQuery(self, query, select=None):
+        where, args = self._where(query)
+        statement = (select or self.select) + where
+        if query.ordering:
+            statement += " ORDER BY {}".format(','.join('`{}` {}'.format(field.name, 'DESC' if descending else 'ASC') for field, descending in query.ordering))
+        if query.maxResults is not None:
+            statement += " LIMIT {:d}".format(query.maxResults)
+        return statement, args
+
+    def countQuery(self, query):
+        where, args = self._where(query)
+        return "SELECT COUNT(*) FROM `{}`{}".format(self._tableName, where), args
+
+    def deleteQuery(self, query):
+        where, args = self._where(query)
+        return "DELETE FROM `{}`{}".format(self._tableName, where), args
+
+    def existsQuery(self, query):
+        where, args = self._where(query)
+        return "SELECT 1 FROM `{}`{} LIMIT 1".format(self._tableName, where), args
+
+    def aggregateQuery(self, query, function, field, groupBy):
+        where, args = self._where(query)
+        column = "COUNT(*)" if field is None else "{}(`{}`)".format(function.upper(), field.name)
+        if groupBy is None:
+            return "SELECT {} FROM `{}`{}".format(column, self._tableName, where), args
+        return "SELECT `{group}`, {column} FROM `{tableName}`{where} GROUP BY `{group}`".format(
+            group=groupBy.name,
+            column=column,
+            tableName=self._tableName,
+            where=where), args
+
+    def _where(self, query):
+        conditions, args = [], []
+        for condition in query.conditions:
+            column = '`{}`'.format(condition.field.name)
+            if condition.operator == 'IN':
+                if not condition.value:
+                    conditions.append('0=1')
+                    continue
+                conditions.append('{} IN ({})'.format(column, ','.join(['%s'] * len(condition.value))))
+                args.extend(self._toDb(condition.field, value) for value in condition.value)
+            else:
+                conditions.append('{} {} %s'.format(column, condition.operator))
+                args.append(self._toDb(condition.field, condition.value))
+        return (" WHERE {}".format(' AND '.join(conditions)) if conditions else ""), args
 
-def from_db(field, value, *args, **kwargs):
-    return db_transformations[field.__class__]['from'](value, *args, **kwargs) if field.__class__ in db_transformations else value
+    def selectWhere(self, fieldNames):
+        if fieldNames not in self._selectWhere:
+            self._selectWhere[fieldNames] = "{select} WHERE {conditions}".format(
+                select=self.select,
+                conditions=' AND '.join('`{}`=%s'.format(name) for name in fieldNames))
+        return self._selectWhere[fieldNames]
 
 
 class Mysql(DB):
-    def __init__(self, username, password, database, verbose=False):
-        super(Mysql, self).__init__()
+    _statementsType = Statements
+    _registerClass = "INSERT IGNORE INTO `{classes}` (`id`, `name`) SELECT COALESCE(MAX(`id`), 0) + 1, %s FROM `{classes}`".format(classes=CLASSES)
+
+    def __init__(self, username, password, database, verbose=False, streaming=False, fetchSize=1000, minConnections=1, maxConnections=10, idleCheckInterval=30.0, connectTimeout=None, engine="MyISAM", objectCache=None, lazy=False, instrumentation=None, binaryIds=False, unixSocket=None):
+        if streaming and maxConnections < 2:
+            raise ValueError("Streaming needs maxConnections >= 2, hydrating streamed rows queries a second connection")
+        super(Mysql, self).__init__(objectCache=objectCache, lazy=lazy, instrumentation=instrumentation)
         self._username = username
         self._password = password
         self._database = database
-        self._db = None
-        self._verbose = verbose
+        self._unixSocket = unixSocket
+        self._minConnections = minConnections
+        self._maxConnections = maxConnections
+        self._idleCheckInterval = idleCheckInterval
+        self._connectTimeout = connectTimeout
+        self._engine = engine
+        self._pool = None
+        self._transactions = local()
+        if verbose:
+            self._instrumentation.addObserver(printStatement)
+        self._streaming = streaming
+        self._fetchSize = fetchSize
+        self._statements = {}
+        self._binaryIds = binaryIds
+        self._transformations = binary_transformations if binaryIds else db_transformations
+        self._types = binary_types if binaryIds else db_types
+        self._linkColumnType = "VARBINARY(18)" if binaryIds else "VARCHAR(128)"
+        self._classIds = {}
+        self._classNames = {}
+        self._prefetchBatchSize = 1000
+        self._linkBatchSize = 1000
 
         self.connect()
 
     def connect(self):
-        if self._db is None or self._db.cqlstate != "000000":
-            self._db = Connect(user=self._username, passwd=self._password, db=self._database)
+        if self._pool is not None:
+            self._pool.close()
+        self._pool = ConnectionPool(self._connect,
+            minSize=self._minConnections,
+            maxSize=self._maxConnections,
+            idleCheckInterval=self._idleCheckInterval,
+            timeout=self._connectTimeout,
+            discardOn=(OperationalError,))
+
+    def _connect(self):
+        # FOUND_ROWS makes an UPDATE report the rows it matched, which store relies on to notice a missing row.
+        socket = {} if self._unixSocket is None else dict(unix_socket=self._unixSocket)
+        connection = Connect(user=self._username, passwd=self._password, db=self._database, client_flag=CLIENT.FOUND_ROWS, **socket)
+        connection.autocommit(True)
+        return connection
+
+    def poolStatistics(self):
+        return self._pool.statistics()
 
-    def define(self, objectType, dropIfExists=False):
-        tables = [each[0] for each in self._sql("show tables")]
+    @property
+    def binaryIds(self):
+        return self._binaryIds
+
+    def _toDb(self, field, value):
+        return to_db(field, value, self, self._transformations)
+
+    def _fromDb(self, field, value, cache):
+        return from_db(field, value, self, cache, self._transformations)
+
+    def _encodeQualifiedId(self, qualifiedId):
+        if not self._binaryIds or not qualifiedId:
+            return qualifiedId
+        objectTypeName, identifier = qualifiedId.split(":", 1)
+        return CLASS_ID.pack(self._classId(objectTypeName)) + UUID(identifier).bytes
+
+    def _decodeQualifiedId(self, value):
+        if not self._binaryIds or not value:
+            return value
+        value = str(value)
+        return "{}:{}".format(self._className(CLASS_ID.unpack(value[:CLASS_ID.size])[0]), UUID(bytes=value[CLASS_ID.size:]))
+
+    def _classId(self, objectTypeName):
+        if objectTypeName not in self._classIds:
+            self._loadClasses()
+            while objectTypeName not in self._classIds:
+                self._execute(self._registerClass, [objectTypeName])
+                self._loadClasses()
+        return self._classIds[objectTypeName]
+
+    def _className(self, classId):
+        if classId not in self._classNames:
+            self._loadClasses()
+        return self._classNames[classId]
+
+    def _loadClasses(self):
+        for classId, objectTypeName in self._sql("SELECT `id`, `name` FROM `{}`".format(CLASSES)):
+            self._classIds[objectTypeName] = classId
+            self._classNames[classId] = objectTypeName
+
+    def _defineClasses(self, engine=None):
+        if CLASSES not in self._tables():
+            self._execute("CREATE TABLE `{}` (`id` SMALLINT NOT NULL, `name` VARCHAR(255) NOT NULL, PRIMARY KEY(`id`)){}".format(CLASSES, self._tableOptions(engine or self._engine)))
+            self._createIndex(CLASSES, Index('name', unique=True))
+
+    @contextmanager
+    def transaction(self):
+        if getattr(self._transactions, 'active', False):
+            yield
+            return
+
+        with self._pool.connection() as connection:
+            self._execute("START TRANSACTION")
+            self._transactions.active = True
+            try:
+                yield
+            except:
+                connection.rollback()
+                raise
+            else:
+                connection.commit()
+            finally:
+                self._transactions.active = False
+
+    @instrumented('define')
+    def define(self, objectType, dropIfExists=False, engine=None):
+        tables = self._tables()
         if objectType.__name__ in tables:
             if dropIfExists:
                 self.drop(objectType)
             else:
                 return
 
-        fields = [field for field in findFields(objectType) if type(field) in db_types]
-        idFields = [field for field in fields if type(field) is IDField]
+        if self._binaryIds:
+            self._defineClasses(engine)
 
-        stmt = """
-        CREATE TABLE `{tableName}` ({fields}, PRIMARY KEY({idFields})) ENGINE=MyISAM""".format(
-            tableName=objectType.__name__,
-            fields=','.join('`{name}` {sqlType}'.format(name=field.name, sqlType=getDbType(field))
-                for field in fields),
-            idFields=','.join('`{}`'.format(field._name)
-                for field in idFields))
+        schema = objectType.schema()
+        self._createTable(self._statementsFor(objectType), engine or self._engine)
+        for index in schema.indexes:
+            self._createIndex(objectType.__name__, index, schema.byName)
 
-        for result in self._sql(stmt):
-            pass
+        for linkTable in self._linkTablesFor(objectType):
+            linkTable.define(self, engine or self._engine)
 
+    @instrumented('sync')
+    def sync(self, objectType, engine=None):
+        tables = self._tables()
+        if objectType.__name__ not in tables:
+            self.define(objectType, engine=engine)
+            return []
+
+        schema = objectType.schema()
+        created = self._createMissingIndexes(objectType.__name__, schema.indexes, schema.byName)
         for linkTable in self._linkTablesFor(objectType):
-            linkTable.define(self)
+            if linkTable.tableName in tables:
+                created.extend(self._createMissingIndexes(linkTable.tableName, linkTable.indexes))
+            else:
+                linkTable.define(self, engine or self._engine)
+        return created
+
+    def _createTable(self, statements, engine):
+        self._execute("""
+        CREATE TABLE `{tableName}` ({fields}, PRIMARY KEY(`{idField}`)){options}""".format(
+            tableName=statements.tableName,
+            options=self._tableOptions(engine),
+            fields=','.join('`{name}` {sqlType}'.format(name=field.name, sqlType=getDbType(field, self._types))
+                for field in statements.fields),
+            idField=statements.idField.name))
+
+    def _tables(self):
+        return [each[0] for each in self._sql("show tables")]
+
+    def _tableOptions(self, engine):
+        return " ENGINE={}".format(engine)
+
+    def _existingIndexes(self, tableName):
+        return set(row[2] for row in self._sql("SHOW INDEX FROM `{}`".format(tableName)))
+
+    def _createMissingIndexes(self, tableName, indexes, fields=None):
+        existing = self._existingIndexes(tableName)
+        created = []
+        for index in indexes:
+            if index.nameFor(tableName) not in existing:
+                self._createIndex(tableName, index, fields)
+                created.append(index.nameFor(tableName))
+        return created
+
+    def _createIndex(self, tableName, index, fields=None):
+        self._execute("CREATE {unique}INDEX `{name}` ON `{tableName}` ({columns})".format(
+            unique='UNIQUE ' if index.unique else '',
+            name=index.nameFor(tableName),
+            tableName=tableName,
+            columns=','.join(self._indexColumn(name, fields) for name in index.columns)))
+
+    def _dropIndex(self, tableName, name):
+        self._execute("DROP INDEX `{}` ON `{}`".format(name, tableName))
+
+    def _renameTables(self, renames):
+        self._execute("RENAME TABLE {}".format(', '.join("`{}` TO `{}`".format(old, new) for old, new in renames)))
+
+    def _indexColumn(self, name, fields):
+        if fields is not None and type(fields.get(name)) is TextField:
+            return '`{}`(255)'.format(name)
+        return '`{}`'.format(name)
+
+    def _statementsFor(self, objectType):
+        statements = self._statements.get(objectType)
+        if statements is None:
+            statements = self._statements[objectType] = self._statementsType(objectType, self._toDb)
+        return statements
 
     def _linkTablesFor(self, objectType):
-        return [LinkTable(objectType, field)
-            for field in findFields(objectType) if type(field) is CollectionField]
+        return self._statementsFor(objectType).linkTables
 
-    def store(self, anObject):
+    @instrumented('store')
+    def store(self, anObject, storeMembers=True):
         objectType = anObject.__class__
-
-        allFields = findFields(objectType)
-        fields = [field for field in allFields if type(field) in db_types]
+        statements = self._statementsFor(objectType)
         identifier = anObject.ID
+        storedHere = self._isStored(anObject) and not anObject._isDirty('ID')
 
-        fieldStatement = ','.join('`{name}`={value}'.format(
-            name=field.name,
-            value=to_db(field, getattr(anObject, field.name), self)) for field in fields)
-
-        if not self.exists(objectType, identifier):
-            stmt = "INSERT INTO `{tableName}` SET {fields}".format(
-                tableName=objectType.__name__,
-                fields=fieldStatement)
+        if not storedHere and not self.exists(objectType, identifier):
+            self._execute(statements.insert, [self._columnValue(anObject, field) for field in statements.fields])
         else:
-            idFields = [field for field in fields if type(field) == IDField]
-            fields = [field for field in fields if type(field) != IDField]
-            stmt = "UPDATE `{tableName}` SET {fields} WHERE {idField}={identifier}".format(
-                tableName=objectType.__name__,
-                fields=fieldStatement,
-                idField=idFields[0].name,
-                identifier=to_db(idFields[0], identifier))
-
-        for result in self._sql(stmt):
-            pass
-
-        for linkTable in self._linkTablesFor(objectType):
-            linkTable.store(self, anObject)
-
+            changedFields = [field for field in statements.valueFields if not storedHere or anObject._isDirty(field.name)]
+            if changedFields:
+                values = [self._columnValue(anObject, field) for field in changedFields]
+                values.append(self._toDb(statements.idField, identifier))
+                if self._execute(statements.updateFields(tuple(field.name for field in changedFields)), values) == 0:
+                    self._upsert(statements, [anObject])
+                    storedHere = False
+
+        for linkTable in statements.linkTables:
+            if linkTable.isLoaded(anObject):
+                linkTable.store(self, anObject, syncMembership=not storedHere or anObject._isDirty(linkTable.fieldName), storeItems=storeMembers)
+        if not storedHere or anObject._isDirty():
+            self._uncacheObject(objectType, identifier)
+        self._markStored(anObject)
+
+    def _isSettled(self, anObject):
+        return self._isClean(anObject) and not any(linkTable.isLoaded(anObject) for linkTable in self._linkTablesFor(anObject.__class__))
+
+    def _columnValue(self, anObject, field):
+        deferred = field.deferred(anObject)
+        if deferred is not None:
+            return deferred.stored
+        return self._toDb(field, getattr(anObject, field.name))
+
+    @instrumented('storeMany')
+    def storeMany(self, objects, batchSize=1000):
+        self._storeMany(objects, batchSize, set())
+
+    def _storeMany(self, objects, batchSize, seen):
+        byType = OrderedDict()
+        for anObject in objects:
+            if anObject.qualifiedId not in seen:
+                seen.add(anObject.qualifiedId)
+                byType.setdefault(anObject.__class__, []).append(anObject)
+
+        for objectType, group in byType.items():
+            statements = self._statementsFor(objectType)
+            for batch in batches([anObject for anObject in group if not self._isClean(anObject)], batchSize):
+                self._upsert(statements, batch)
+                for anObject in batch:
+                    self._uncacheObject(objectType, anObject.ID)
+
+            for linkTable in statements.linkTables:
+                owners = [anObject for anObject in group if linkTable.isLoaded(anObject)]
+                self._storeMany((item for anObject in owners for item in getattr(anObject, linkTable.fieldName)), batchSize, seen)
+                linkTable.storeMany(self, [anObject for anObject in owners if not self._isStored(anObject) or anObject._isDirty(linkTable.fieldName)], batchSize)
+
+            for anObject in group:
+                self._markStored(anObject)
+
+    def _upsert(self, statements, objects):
+        values = []
+        for anObject in objects:
+            values.extend(self._columnValue(anObject, field) for field in statements.fields)
+        self._execute(statements.upsert(len(objects)), values)
+
+    @instrumented('delete')
     def delete(self, objectType, identifier):
-        if type(objectType) is str:
-            errorText = "No class named '{}' registered".format(objectType)
-            objectType = self.findClass(objectType)
-            if objectType is None:
-                raise ValueError(errorText)
-
-        fields = findFields(objectType)
-        idFields = [field for field in fields if type(field) == IDField]
-        stmt = "DELETE FROM `{tableName}` WHERE {idField}={identifier}".format(
-            tableName=objectType.__name__,
-            idField=idFields[0].name,
-            identifier=to_db(idFields[0], identifier))
-        for result in self._sql(stmt):
-            pass
-
+        objectType = self._objectType(objectType)
+
+        statements = self._statementsFor(objectType)
+        self._execute(statements.delete, [self._toDb(statements.idField, identifier)])
+        self._uncacheObject(objectType, identifier)
+        self._markDeleted(objectType, [identifier])
+
+    @instrumented('deleteMany')
+    def deleteMany(self, objectType, identifiers, batchSize=1000):
+        objectType = self._objectType(objectType)
+        statements = self._statementsFor(objectType)
+        deleted = 0
+        with self.transaction():
+            for batch in batches(list(identifiers), batchSize):
+                for linkTable in statements.linkTables:
+                    linkTable.deleteOwners(self, ['{}:{}'.format(objectType.__name__, identifier) for identifier in batch])
+                deleted += self._execute(statements.deleteIn(len(batch)), [self._toDb(statements.idField, identifier) for identifier in batch])
+                for identifier in batch:
+                    self._uncacheObject(objectType, identifier)
+                self._markDeleted(objectType, batch)
+        return deleted
+
+    @instrumented('exists')
     def exists(self, objectType, identifier):
-        fields = findFields(objectType)
-        idFields = [field for field in fields if type(field) == IDField]
-        stmt = "SELECT COUNT(*) from `{tableName}` WHERE {idField}={identifier}".format(
-            tableName=objectType.__name__,
-            idField=idFields[0].name,
-            identifier=to_db(idFields[0], identifier))
-        for result in self._sql(stmt):
+        statements = self._statementsFor(objectType)
+        for result in self._sql(statements.exists, [self._toDb(statements.idField, identifier)]):
             return result[0] > 0
 
-    def get(self, objectType, identifier, cache=None):
-        if type(objectType) is str:
-            errorText = "No class named '{}' registered".format(objectType)
-            objectType = self.findClass(objectType)
-            if objectType is None:
-                raise ValueError(errorText)
-
-        allFields = findFields(objectType)
-        fields = [field for field in allFields if type(field) in db_types]
-        idFields = [field for field in fields if type(field) == IDField]
-        stmt = "SELECT {fieldNames} FROM `{tableName}` WHERE {idField}={identifier}".format(
-            fieldNames=','.join('`{}`'.format(field.name) for field in fields),
-            tableName=objectType.__name__,
-            idField=idFields[0].name,
-            identifier=to_db(idFields[0], identifier))
-
-        for obj in self._loadFromSelect(stmt, objectType, fields, cache or {}):
+    @instrumented('get')
+    def get(self, objectType, identifier, cache=None, prefetch=None):
+        objectType = self._objectType(objectType)
+
+        obj = self._cachedObject(objectType, identifier)
+        if obj is not None:
             return obj
 
-    def list(self, objectType, **kwargs):
-        allFields = findFields(objectType)
-        fields = [field for field in allFields if type(field) in db_types]
-        stmt = "SELECT {fieldNames} FROM `{tableName}`".format(
-            fieldNames=','.join('`{}`'.format(field.name) for field in fields),
-            tableName=objectType.__name__)
-
-        if kwargs:
-            fieldNames = {f.name:f for f in findFields(objectType)}
-            queryFields = [(fieldNames[k], v) for k,v in kwargs.items() if k in fieldNames]
-            stmt = "{stmt} WHERE {fields}".format(
-                stmt=stmt,
-                fields=' AND '.join('`{name}`={value}'.format(
-                    name=field.name,
-                    value=to_db(field, value)) for (field, value) in queryFields))
+        statements = self._statementsFor(objectType)
+        for obj in self._loadFromSelect(statements.get, [self._toDb(statements.idField, identifier)], objectType, cache or {}, prefetch):
+            self._cacheObject(obj)
+            return obj
+
+    @instrumented('list')
+    def list(self, objectType, prefetch=None, **kwargs):
+        statements = self._statementsFor(objectType)
+        stmt, args = statements.select, None
+
+        fieldNames = objectType.schema().byName
+        queryFields = sorted(((fieldNames[k], v) for k,v in kwargs.items() if k in fieldNames), key=lambda item: item[0].name)
+        if queryFields:
+            stmt = statements.selectWhere(tuple(field.name for field, _ in queryFields))
+            args = [self._toDb(field, value) for (field, value) in queryFields]
 
         cache = {}
-        for obj in self._loadFromSelect(stmt, objectType, fields, cache):
+        for obj in self._loadFromSelect(stmt, args, objectType, cache, prefetch, stream=self._streaming):
             yield obj
 
-    def _loadFromSelect(self, stmt, objectType, fields, cache):
-        for result in self._sql(stmt):
+    @instrumented('query')
+    def _executeQuery(self, query):
+        statement, args = self._statementsFor(query.objectType).selectQuery(query)
+        return self._loadFromSelect(statement, args, query.objectType, {}, stream=self._streaming)
+
+    def _deleteQuery(self, query):
+        statements = self._statementsFor(query.objectType)
+        if statements.linkTables or self._objectCache is not None or query.ordering or query.maxResults is not None:
+            statement, args = statements.selectQuery(query, select=statements.selectIds)
+            return self.deleteMany(query.objectType, [self._fromDb(statements.idField, result[0], {}) for result in self._sql(statement, args)])
+        statement, args = statements.deleteQuery(query)
+        self._markAllDeleted()
+        return self._execute(statement, args)
+
+    def _countQuery(self, query):
+        statement, args = self._statementsFor(query.objectType).countQuery(query)
+        for result in self._sql(statement, args):
+            return int(result[0])
+
+    def _existsQuery(self, query):
+        statement, args = self._statementsFor(query.objectType).existsQuery(query)
+        return len(self._sql(statement, args)) > 0
+
+    def _aggregateQuery(self, query, function, field, groupBy):
+        statement, args = self._statementsFor(query.objectType).aggregateQuery(query, function, field, groupBy)
+        def _value(value):
+            if value is None or function == 'count':
+                return None if value is None else int(value)
+            if type(field) is IntField:
+                return float(value) if function == 'avg' else int(value)
+            return value if isinstance(value, Decimal) else Decimal(repr(value))
+        def _groupKey(value):
+            if type(groupBy) is ReferenceField:
+                return self._decodeQualifiedId(value) or None
+            return self._fromDb(groupBy, value, {})
+        results = self._sql(statement, args)
+        if groupBy is None:
+            return _value(results[0][0])
+        return dict((_groupKey(key), _value(value)) for key, value in results)
+
+    def _loadFromSelect(self, stmt, args, objectType, cache, prefetch=None, stream=False):
+        results = self._stream(stmt, args) if stream else self._sql(stmt, args)
+        if prefetch:
+            prefetchTree = self._prefetchTree(objectType, prefetch)
+            for rows in batches(results, self._prefetchBatchSize):
+                for obj in self._hydrate(objectType, rows, prefetchTree, {} if stream else cache):
+                    yield obj
+            return
+
+        statements = self._statementsFor(objectType)
+        fields = statements.fields
+        for result in results:
             obj = objectType()
             for n, field in enumerate(fields):
-                setattr(obj, field.name, from_db(field, result[n], self, cache=cache))
+                setattr(obj, field.name, self._loadValue(field, result[n], cache))
 
-            for linkTable in self._linkTablesFor(objectType):
-                value = linkTable.load(self, obj)
-                setattr(obj, linkTable.fieldName, value)
+            for linkTable in statements.linkTables:
+                setattr(obj, linkTable.fieldName, self._loadItems(linkTable, obj))
 
+            obj._markClean(self)
             yield obj
 
+    def _loadValue(self, field, value, cache):
+        if self._lazy and type(field) is ReferenceField:
+            return Deferred(partial(self._fromDb, field, value), value, cache)
+        return self._fromDb(field, value, cache)
+
+    def _loadItems(self, linkTable, anObject):
+        if self._lazy:
+            return Deferred(partial(linkTable.load, self, anObject))
+        return linkTable.load(self, anObject)
+
+    def _prefetchTree(self, objectType, paths):
+        tree = {}
+        for path in paths:
+            node = tree
+            for name in path.split('.'):
+                node = node.setdefault(name, {})
+        self._checkPrefetchTree(objectType, tree)
+        return tree
+
+    def _checkPrefetchTree(self, objectType, tree):
+        schema = objectType.schema()
+        for name in tree:
+            if type(schema.byName.get(name)) not in (ReferenceField, CollectionField):
+                raise ValueError("Cannot prefetch '{}' of {}, it is not a reference or collection".format(name, objectType.__name__))
+
+    def _hydrate(self, objectType, rows, prefetchTree, cache):
+        statements = self._statementsFor(objectType)
+        fields = statements.fields
+        objects = []
+        references = {}
+        for result in rows:
+            obj = objectType()
+            for n, field in enumerate(fields):
+                if field.name in prefetchTree:
+                    references.setdefault(field.name, []).append((obj, self._decodeQualifiedId(result[n])))
+                else:
+                    setattr(obj, field.name, self._loadValue(field, result[n], cache))
+
+            for linkTable in statements.linkTables:
+                if linkTable.fieldName not in prefetchTree:
+                    setattr(obj, linkTable.fieldName, self._loadItems(linkTable, obj))
+
+            cache[obj.qualifiedId] = obj
+            objects.append(obj)
+
+        for fieldName, pairs in references.items():
+            self._prefetch([qualifiedId for _, qualifiedId in pairs if qualifiedId], prefetchTree[fieldName], cache)
+            for obj, qualifiedId in pairs:
+                setattr(obj, fieldName, cache.get(qualifiedId) if qualifiedId else None)
+
+        for linkTable in statements.linkTables:
+            if linkTable.fieldName in prefetchTree:
+                itemsByOwner = linkTable.loadMany(self, objects, self._prefetchBatchSize)
+                self._prefetch([item for items in itemsByOwner.values() for item in items], prefetchTree[linkTable.fieldName], cache)
+                for obj in objects:
+                    setattr(obj, linkTable.fieldName, [cache.get(item) for item in itemsByOwner.get(obj.qualifiedId, [])])
+
+        for obj in objects:
+            obj._markClean(self)
+        return objects
+
+    def _prefetch(self, qualifiedIds, prefetchTree, cache):
+        identifiersByType = OrderedDict()
+        for qualifiedId in qualifiedIds:
+            if qualifiedId in cache:
+                continue
+            objectTypeName, identifier = qualifiedId.split(":", 1)
+            objectType = self.findClass(objectTypeName)
+            cached = None if objectType is None else self._cachedObject(objectType, identifier)
+            if cached is not None:
+                cache[qualifiedId] = cached
+            else:
+                identifiersByType.setdefault(objectTypeName, set()).add(identifier)
+
+        for objectTypeName, identifiers in identifiersByType.items():
+            objectType = self.findClass(objectTypeName)
+            if objectType is None:
+                raise ValueError("No class named '{}' registered".format(objectTypeName))
+            self._checkPrefetchTree(objectType, prefetchTree)
+            statements = self._statementsFor(objectType)
+            for batch in batches(sorted(identifiers), self._prefetchBatchSize):
+                identifiers = [self._toDb(statements.idField, identifier) for identifier in batch]
+                for obj in self._hydrate(objectType, list(self._sql(statements.selectIn(len(batch)), identifiers)), prefetchTree, cache):
+                    self._cacheObject(obj)
+
+    @instrumented('drop')
     def drop(self, objectType):
+        self._markAllDeleted()
         def _dropTable(tableName):
-            for i in self._sql("DROP TABLE IF EXISTS `{}`".format(tableName)):
-                pass
+            self._execute("DROP TABLE IF EXISTS `{}`".format(tableName))
         _dropTable(objectType.__name__)
         map(_dropTable, ['{}_{}'.format(objectType.__name__, field.name)
-            for field in findFields(objectType) if type(field) is CollectionField])
+            for field in objectType.schema().collectionFields])
 
     def display(self, objectType):
-        fields = {f.name:f for f in findFields(objectType)}
+        fields = objectType.schema().byName
         for i in self._sql("DESCRIBE `{}`".format(objectType.__name__)):
             name, dbType, mayBeNull, key, default, _ = i
             yield name, fields[name].__class__
 
-    def _sql(self, statement):
-        if self._verbose:
-            print statement
-        with Cursor(self._db) as cursor:
-            result = cursor.execute(statement)
-            for n in range(result):
-                yield cursor.fetchone()
+    def _execute(self, statement, args=None):
+        with self._instrumentation.measure('mysql', 'execute', statement) as measurement:
+            with Cursor(self._pool) as cursor:
+                measurement.rows = cursor.execute(statement, args)
+                return measurement.rows
+
+    def _executeMany(self, statement, argsList):
+        with self._instrumentation.measure('mysql', 'executemany', statement) as measurement:
+            measurement.rows = len(argsList)
+            with Cursor(self._pool) as cursor:
+                cursor.executemany(statement, argsList)
+
+    def _sql(self, statement, args=None):
+        with self._instrumentation.measure('mysql', 'select', statement) as measurement:
+            with Cursor(self._pool) as cursor:
+                cursor.execute(statement, args)
+                results = cursor.fetchall()
+                measurement.rows = len(results)
+                return results
+
+    def _stream(self, statement, args=None):
+        duration, rowCount = 0.0, 0
+        # An unbuffered result blocks its connection until it is read completely,
+        # so it gets a connection of its own while hydrating the rows queries the pool.
+        try:
+            start = time()
+            with Cursor(self._pool, cursorClass=SSCursor, exclusive=True) as cursor:
+                cursor.execute(statement, args)
+                rows = cursor.fetchmany(self._fetchSize)
+                duration += time() - start
+                while rows:
+                    rowCount += len(rows)
+                    for row in rows:
+                        yield row
+                    start = time()
+                    rows = cursor.fetchmany(self._fetchSize)
+                    duration += time() - start
+        finally:
+            self._instrumentation.report('mysql', 'stream', statement, duration, rowCount)
 
 
 class LinkTable(object):
-    def __init__(self, objectType, field):
+    def __init__(self, objectType, field, tableName=None):
         self._objectType = objectType
         self._field = field
-        self._tableName = '{}_{}'.format(self._objectType.__name__, field.name)
+        self._tableName = tableName or '{}_{}'.format(self._objectType.__name__, field.name)
+        self.indexes = (Index('item'),)
+        self._selectItems = "SELECT `item` FROM `{}` WHERE `owner`=%s".format(self._tableName)
 
     @property
     def fieldName(self):
         return self._field.name
 
-    def define(self, db):
-        for result in db._sql("""
+    @property
+    def tableName(self):
+        return self._tableName
+
+    def define(self, db, engine):
+        self.create(db, engine)
+        for index in self.indexes:
+            db._createIndex(self._tableName, index)
+
+    def create(self, db, engine):
+        db._execute("""
             CREATE TABLE `{linkTable}` (
-                `owner` VARCHAR(128),
-                `item` VARCHAR(128),
+                `owner` {columnType},
+                `item` {columnType},
                 PRIMARY KEY(`owner`, `item`)
-            ) ENGINE=MyISAM""".format(
-                linkTable=self._tableName)):
-            pass
+            ){options}""".format(
+                linkTable=self._tableName,
+                columnType=db._linkColumnType,
+                options=db._tableOptions(engine)))
+
+    def isLoaded(self, anObject):
+        return self._field.deferred(anObject) is None
 
     def _storedItems(self, db, anObject):
-        return [result[0] for result in db._sql("SELECT `item` FROM `{linkTable}` where `owner` = '{ownerID}'".format(
-            linkTable=self._tableName,
-            ownerID=anObject.qualifiedId))]
+        return [result[0] for result in self._select(db, self._selectItems, [anObject.qualifiedId])]
 
-    def store(self, db, anObject):
+    def store(self, db, anObject, syncMembership=True, storeItems=True):
         items = getattr(anObject, self._field.name)
-        map(db.store, items)
+        if storeItems:
+            db._storeMany([item for item in items if not db._isSettled(item)], db._linkBatchSize, set())
+        if not syncMembership:
+            return
 
         ownerQualifiedId = anObject.qualifiedId
-        qualifiedItemIds = set([item.qualifiedId for item in items])
-        storedQualifiedIds = set(self._storedItems(db, anObject))
+        qualifiedItemIds = set(item.qualifiedId for item in items)
+        with db.transaction():
+            storedQualifiedIds = set(self._storedItems(db, anObject))
+            itemsToAdd = sorted(qualifiedItemIds.difference(storedQualifiedIds))
+            itemsToRemove = sorted(storedQualifiedIds.difference(qualifiedItemIds))
+            for rows in batches(itemsToAdd, db._linkBatchSize):
+                self._execute(db, self._insertItems(len(rows)), [value for item in rows for value in (ownerQualifiedId, item)])
+            self._removeItems(db, ownerQualifiedId, itemsToRemove)
+            if self._field.isContained:
+                db._deleteContained(itemsToRemove)
+
+    def storeMany(self, db, owners, batchSize):
+        for batch in batches(owners, batchSize):
+            storedItems = {}
+            for owner, item in self._select(db, self._selectItemsOf(len(batch)), [anObject.qualifiedId for anObject in batch]):
+                storedItems.setdefault(owner, set()).add(item)
+
+            itemsToAdd, itemsToRemove = [], OrderedDict()
+            for anObject in batch:
+                ownerQualifiedId = anObject.qualifiedId
+                qualifiedItemIds = set(item.qualifiedId for item in getattr(anObject, self._field.name))
+                storedQualifiedIds = storedItems.get(ownerQualifiedId, set())
+                itemsToAdd.extend((ownerQualifiedId, item) for item in qualifiedItemIds.difference(storedQualifiedIds))
+                removed = sorted(storedQualifiedIds.difference(qualifiedItemIds))
+                if removed:
+                    itemsToRemove[ownerQualifiedId] = removed
+
+            for rows in batches(itemsToAdd, batchSize):
+                self._execute(db, self._insertItems(len(rows)), [value for row in rows for value in row])
+
+            for ownerQualifiedId, items in itemsToRemove.items():
+                self._removeItems(db, ownerQualifiedId, items)
+            if self._field.isContained:
+                db._deleteContained([item for items in itemsToRemove.values() for item in items])
 
-        itemsToAdd = qualifiedItemIds.difference(storedQualifiedIds)
-        itemsToRemove = storedQualifiedIds.difference(qualifiedItemIds)
-        for item in itemsToAdd:
-            for _ in db._sql("INSERT INTO `{linkTable}` SET `owner`='{ownerQualifiedId}', `item`='{itemQualifiedId}'".format(
-                linkTable=self._tableName,
-                ownerQualifiedId=ownerQualifiedId,
-                itemQualifiedId=item)):
-                pass
+    def _removeItems(self, db, ownerQualifiedId, items):
+        for batch in batches(items, db._linkBatchSize):
+            self._execute(db, self._deleteItems(len(batch)), [ownerQualifiedId] + batch)
 
-        for item in itemsToRemove:
-            if self._field.isContained:
-                db.delete(*item.split(":", 1))
-            for _ in db._sql("DELETE FROM `{linkTable}` WHERE `owner`='{ownerQualifiedId}' AND `item`='{itemQualifiedId}'".format(
-                linkTable=self._tableName,
-                ownerQualifiedId=ownerQualifiedId,
-                itemQualifiedId=item)):
-                pass
+    def deleteOwners(self, db, ownerQualifiedIds):
+        if self._field.isContained:
+            db._deleteContained([item for _, item in self._select(db, self._selectItemsOf(len(ownerQualifiedIds)), ownerQualifiedIds)])
+        self._execute(db, self._deleteOwners(len(ownerQualifiedIds)), ownerQualifiedIds)
+
+    def _select(self, db, statement, qualifiedIds):
+        return [tuple(db._decodeQualifiedId(value) for value in row) for row in db._sql(statement, [db._encodeQualifiedId(qualifiedId) for qualifiedId in qualifiedIds])]
+
+    def _execute(self, db, statement, qualifiedIds):
+        return db._execute(statement, [db._encodeQualifiedId(qualifiedId) for qualifiedId in qualifiedIds])
+
+    def _deleteItems(self, itemCount):
+        return "DELETE FROM `{linkTable}` WHERE `owner`=%s AND `item` IN ({items})".format(
+            linkTable=self._tableName,
+            items=','.join(['%s'] * itemCount))
+
+    def _deleteOwners(self, ownerCount):
+        return "DELETE FROM `{linkTable}` WHERE `owner` IN ({owners})".format(
+            linkTable=self._tableName,
+            owners=','.join(['%s'] * ownerCount))
+
+    def _selectItemsOf(self, ownerCount):
+        return "SELECT `owner`, `item` FROM `{linkTable}` WHERE `owner` IN ({owners})".format(
+            linkTable=self._tableName,
+            owners=','.join(['%s'] * ownerCount))
+
+    def _insertItems(self, rowCount):
+        return "INSERT INTO `{linkTable}` (`owner`, `item`) VALUES {rows}".format(
+            linkTable=self._tableName,
+            rows=','.join(['(%s, %s)'] * rowCount))
+
+    def loadMany(self, db, owners, batchSize):
+        itemsByOwner = {}
+        for batch in batches(owners, batchSize):
+            for owner, item in self._select(db, self._selectItemsOf(len(batch)), [anObject.qualifiedId for anObject in batch]):
+                itemsByOwner.setdefault(owner, []).append(item)
+        return itemsByOwner
 
     def load(self, db, anObject):
         return [db.get(*item.split(":", 1)) for item in self._storedItems(db, anObject)]
@@ -0,0 +1,156 @@
+from threading import Condition, local
+from time import time
+
+class PoolExhausted(Exception):
+    pass
+
+class ConnectionPool(object):
+    def __init__(self, connect, minSize=1, maxSize=10, idleCheckInterval=30.0, timeout=None, discardOn=()):
+        if not 0 <= minSize <= maxSize or maxSize < 1:
+            raise ValueError("Pool sizes should satisfy 0 <= minSize <= maxSize and maxSize >= 1")
+        self._connect = connect
+        self._minSize = minSize
+        self._maxSize = maxSize
+        self._idleCheckInterval = idleCheckInterval
+        self._timeout = timeout
+        self._discardOn = discardOn
+        self._condition = Condition()
+        self._local = local()
+        self._idle = []
+        self._size = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._totalWaitTime = 0.0
+        self._maxWaitTime = 0.0
+        self._timeouts = 0
+        self._healthChecks = 0
+        self._replaced = 0
+
+        for _ in range(minSize):
+            self._idle.append((connect(), time()))
+            self._size += 1
+
+    def connection(self, exclusive=False):
+        return _Checkout(self, exclusive)
+
+    def statistics(self):
+        with self._condition:
+            return dict(
+                size=self._size,
+                idle=len(self._idle),
+                inUse=self._size - len(self._idle),
+                checkouts=self._checkouts,
+                waits=self._waits,
+                totalWaitTime=self._totalWaitTime,
+                maxWaitTime=self._maxWaitTime,
+                averageWaitTime=self._totalWaitTime / self._waits if self._waits else 0.0,
+                timeouts=self._timeouts,
+                healthChecks=self._healthChecks,
+                replaced=self._replaced)
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection, _ in idle:
+            connection.close()
+
+    def _checkout(self):
+        start = time()
+        with self._condition:
+            waited = False
+            while not self._idle and self._size >= self._maxSize:
+                waited = True
+                remaining = None if self._timeout is None else self._timeout - (time() - start)
+                if remaining is not None and remaining <= 0:
+                    self._timeouts += 1
+                    self._recordWait(start)
+                    raise PoolExhausted("No connection available within {} seconds".format(self._timeout))
+                self._condition.wait(remaining)
+            self._checkouts += 1
+            if waited:
+                self._recordWait(start)
+            if self._idle:
+                connection, lastUsed = self._idle.pop()
+            else:
+                connection, lastUsed = None, None
+                self._size += 1
+
+        try:
+            if connection is None:
+                return self._connect()
+            if time() - lastUsed > self._idleCheckInterval:
+                return self._checkHealth(connection)
+            return connection
+        except:
+            self._discard(None)
+            raise
+
+    def _recordWait(self, start):
+        waitTime = time() - start
+        self._waits += 1
+        self._totalWaitTime += waitTime
+        self._maxWaitTime = max(self._maxWaitTime, waitTime)
+
+    def _checkHealth(self, connection):
+        with self._condition:
+            self._healthChecks += 1
+        try:
+            connection.ping()
+            return connection
+        except Exception:
+            try:
+                connection.close()
+            except Exception:
+                pass
+            with self._condition:
+                self._replaced += 1
+            return self._connect()
+
+    def _checkin(self, connection):
+        with self._condition:
+            self._idle.append((connection, time()))
+            self._condition.notify()
+
+    def _discard(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+
+class _Checkout(object):
+    def __init__(self, pool, exclusive):
+        self._pool = pool
+        self._exclusive = exclusive
+        self._connection = None
+
+    def __enter__(self):
+        state = self._pool._local
+        if not self._exclusive and getattr(state, 'connection', None) is not None:
+            state.depth += 1
+            self._connection = state.connection
+            return self._connection
+
+        self._connection = self._pool._checkout()
+        if not self._exclusive:
+            state.connection, state.depth = self._connection, 1
+        return self._connection
+
+    def __exit__(self, type, value, traceback):
+        state = self._pool._local
+        if not self._exclusive:
+            state.depth -= 1
+            if state.depth > 0:
+                return
+            state.connection = None
+        if type is not None and issubclass(type, self._pool._discardOn):
+            self._pool._discard(self._connection)
+        else:
+            self._pool._checkin(self._connection)
+
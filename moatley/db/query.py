@@ -0,0 +1,207 @@
+from .fields import Condition, CollectionField, IntField, DecimalField
+
+from heapq import nsmallest, nlargest
+from itertools import islice
+from threading import Thread
+from sys import exc_info
+from uuid import UUID
+from decimal import Decimal
+
+AGGREGATES = ('count', 'min', 'max', 'sum', 'avg')
+
+class _Accumulator(object):
+    def __init__(self):
+        self.count = 0
+        self.total = None
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        if value is None:
+            return
+        self.total = value if self.total is None else self.total + value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def result(self, function):
+        if function == 'count':
+            return self.count
+        if function == 'avg':
+            if self.total is None:
+                return None
+            return self.total / self.count if isinstance(self.total, Decimal) else float(self.total) / self.count
+        return dict(min=self.minimum, max=self.maximum, sum=self.total)[function]
+
+def aggregate(function, pairs, grouped=False):
+    accumulators = {}
+    for key, value in pairs:
+        if key not in accumulators:
+            accumulators[key] = _Accumulator()
+        accumulators[key].add(value)
+    if grouped:
+        return dict((key, accumulator.result(function)) for key, accumulator in accumulators.items())
+    return accumulators.get(None, _Accumulator()).result(function)
+
+class Query(object):
+    def __init__(self, db, objectType, conditions=(), ordering=(), maxResults=None):
+        self._db = db
+        self._objectType = objectType
+        self._conditions = conditions
+        self._ordering = ordering
+        self._maxResults = maxResults
+
+    @property
+    def objectType(self):
+        return self._objectType
+
+    @property
+    def conditions(self):
+        return self._conditions
+
+    @property
+    def ordering(self):
+        return self._ordering
+
+    @property
+    def maxResults(self):
+        return self._maxResults
+
+    def where(self, *conditions, **equalities):
+        schema = self._objectType.schema()
+        conditions = list(conditions) + [schema.field(name).eq(value) for name, value in sorted(equalities.items())]
+        for condition in conditions:
+            if not isinstance(condition, Condition):
+                raise ValueError("Expected a condition, got {!r}".format(condition))
+            if schema.byName.get(condition.field.name) is not condition.field or type(condition.field) is CollectionField:
+                raise ValueError("Cannot query {} on '{}'".format(self._objectType.__name__, condition.field.name))
+        return self._copy(conditions=self._conditions + tuple(conditions))
+
+    def orderBy(self, *names):
+        schema = self._objectType.schema()
+        ordering = []
+        for name in names:
+            descending = name.startswith('-')
+            field = schema.field(name.lstrip('-'))
+            if type(field) is CollectionField:
+                raise ValueError("Cannot order {} by '{}'".format(self._objectType.__name__, field.name))
+            ordering.append((field, descending))
+        return self._copy(ordering=self._ordering + tuple(ordering))
+
+    def limit(self, maxResults):
+        if maxResults < 0:
+            raise ValueError("Limit should not be negative")
+        return self._copy(maxResults=maxResults)
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        for anObject in self.limit(1):
+            return anObject
+
+    def count(self):
+        return self._db._countQuery(self._unordered())
+
+    def exists(self):
+        return self._db._existsQuery(self._unordered())
+
+    def aggregate(self, function, fieldName=None, groupBy=None):
+        schema = self._objectType.schema()
+        if function not in AGGREGATES:
+            raise ValueError("Unsupported aggregate '{}', expected one of {}".format(function, ', '.join(AGGREGATES)))
+        field = None
+        if function != 'count':
+            field = schema.field(fieldName)
+            if type(field) not in (IntField, DecimalField):
+                raise ValueError("Cannot compute {} over '{}', it is not an int or decimal field".format(function, fieldName))
+        groupField = None
+        if groupBy is not None:
+            groupField = schema.field(groupBy)
+            if type(groupField) is CollectionField:
+                raise ValueError("Cannot group {} by '{}'".format(self._objectType.__name__, groupBy))
+        return self._db._aggregateQuery(self._unordered(), function, field, groupField)
+
+    def delete(self):
+        return self._db._deleteQuery(self)
+
+    def __iter__(self):
+        return iter(self._db._executeQuery(self))
+
+    def matches(self, anObject):
+        return all(condition.matches(anObject) for condition in self._conditions)
+
+    def apply(self, objects):
+        objects = (anObject for anObject in objects if self.matches(anObject))
+        if not self._ordering:
+            return objects if self._maxResults is None else islice(objects, self._maxResults)
+
+        directions = set(descending for _, descending in self._ordering)
+        if self._maxResults is not None and len(directions) == 1:
+            key = lambda anObject: tuple(getattr(anObject, field.name) for field, _ in self._ordering)
+            select = nlargest if directions.pop() else nsmallest
+            return iter(select(self._maxResults, objects, key=key))
+
+        objects = list(objects)
+        for field, descending in reversed(self._ordering):
+            objects.sort(key=lambda anObject: getattr(anObject, field.name), reverse=descending)
+        return iter(objects if self._maxResults is None else objects[:self._maxResults])
+
+    def _unordered(self):
+        return self._copy(ordering=(), maxResults=None)
+
+    def _copy(self, **kwargs):
+        values = dict(conditions=self._conditions, ordering=self._ordering, maxResults=self._maxResults)
+        values.update(kwargs)
+        return Query(self._db, self._objectType, **values)
+
+class Pages(object):
+    def __init__(self, query, pageSize, resumeToken=None, prefetch=True):
+        if pageSize < 1:
+            raise ValueError("Page size should be at least 1")
+        self._query = query
+        self._idField = query.objectType.schema().idField
+        self._pageSize = pageSize
+        self._resumeToken = resumeToken
+        self._prefetch = prefetch
+
+    @property
+    def resumeToken(self):
+        return self._resumeToken
+
+    def __iter__(self):
+        page = self._fetch(self._resumeToken and UUID(self._resumeToken))
+        while page:
+            nextPage = None
+            if self._prefetch and len(page) == self._pageSize:
+                nextPage = _Background(self._fetch, page[-1].ID)
+            for anObject in page:
+                yield anObject
+                self._resumeToken = str(anObject.ID)
+            if len(page) < self._pageSize:
+                return
+            page = self._fetch(page[-1].ID) if nextPage is None else nextPage.result()
+
+    def _fetch(self, after):
+        query = self._query if after is None else self._query.where(self._idField > after)
+        return list(query.orderBy(self._idField.name).limit(self._pageSize))
+
+class _Background(object):
+    def __init__(self, function, *args):
+        self._result = None
+        self._error = None
+        self._thread = Thread(target=self._run, args=(function, args))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, function, args):
+        try:
+            self._result = function(*args)
+        except Exception:
+            self._error = exc_info()
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
@@ -0,0 +1,68 @@
+from .fields import IDField, CollectionField, ReferenceField, findFields
+from .index import Index
+
+class Schema(object):
+    def __init__(self, objectType):
+        self._objectType = objectType
+        self._fields = tuple(findFields(objectType))
+        self._names = tuple(field.name for field in self._fields)
+        self._byName = dict(zip(self._names, self._fields))
+        self._positions = dict((name, position) for position, name in enumerate(self._names))
+        self._dbFields = tuple(field for field in self._fields if type(field) is not CollectionField)
+        self._collectionFields = tuple(field for field in self._fields if type(field) is CollectionField)
+        self._referenceFields = tuple(field for field in self._fields if type(field) is ReferenceField)
+        self._indexedFields = tuple(field for field in self._fields if field.index)
+        self._indexes = tuple(Index(field.name) for field in self._indexedFields) + tuple(getattr(objectType, '_indexes', ()))
+        for index in self._indexes:
+            for name in index.columns:
+                if type(self._byName.get(name)) in (type(None), CollectionField):
+                    raise ValueError("Cannot index {} on '{}'".format(objectType.__name__, name))
+        idFields = [field for field in self._fields if type(field) is IDField]
+        self._idField = idFields[0] if idFields else None
+
+    @property
+    def objectType(self):
+        return self._objectType
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def byName(self):
+        return self._byName
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @property
+    def indexes(self):
+        return self._indexes
+
+    @property
+    def idField(self):
+        return self._idField
+
+    @property
+    def dbFields(self):
+        return self._dbFields
+
+    @property
+    def collectionFields(self):
+        return self._collectionFields
+
+    @property
+    def referenceFields(self):
+        return self._referenceFields
+
+    @property
+    def indexedFields(self):
+        return self._indexedFields
+
+    def field(self, name):
+        return self._byName[name]
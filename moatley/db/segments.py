@@ -0,0 +1,311 @@
+from .db import DB
+from .json import db_transformations
+
+from os import listdir, makedirs, remove, rename, fsync
+from os.path import join, isdir, isfile, getsize, abspath
+from struct import Struct
+from zlib import crc32
+from threading import RLock, Lock, Thread, Event
+from simplejson import dumps, loads
+
+HEADER = Struct('>II')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT = 'checkpoint.json'
+
+class CorruptSegment(Exception):
+    pass
+
+class Segments(DB):
+    def __init__(self, root, segmentSize=64*1024*1024, syncWrites=False, compactionInterval=None, garbageRatio=0.5, objectCache=None, instrumentation=None):
+        super(Segments, self).__init__(objectCache=objectCache, instrumentation=instrumentation)
+        self._root = abspath(root)
+        self._segmentSize = segmentSize
+        self._syncWrites = syncWrites
+        self._garbageRatio = garbageRatio
+        self._lock = RLock()
+        self._compactionLock = Lock()
+        self._index = {}
+        self._readers = {}
+        self._active = None
+        self._activeSegment = None
+        self._activeSize = 0
+
+        if not isdir(self._root):
+            makedirs(self._root)
+        self._recover()
+        segments = self._segmentNumbers()
+        self._openActive(segments[-1] if segments else 1)
+
+        self._stopped = Event()
+        self._compactor = None
+        if compactionInterval is not None:
+            self._compactor = Thread(target=self._compactPeriodically, args=(compactionInterval,))
+            self._compactor.daemon = True
+            self._compactor.start()
+
+    def define(self, objectType, dropIfExists=False):
+        if dropIfExists:
+            self.drop(objectType)
+
+    def store(self, anObject):
+        if self._isClean(anObject):
+            self._storeMembers(anObject)
+            return anObject.qualifiedId
+        objectType = anObject.__class__
+        storedValues = self._storedValues(objectType.__name__, str(anObject.ID))
+        values = {field.name:self._toRecord(field, getattr(anObject, field.name)) for field in anObject.schema().fields}
+        self._put(objectType.__name__, str(anObject.ID), values)
+        self._markStored(anObject)
+
+        if storedValues is not None:
+            self._deleteContained(set(self._containedItems(objectType, storedValues)).difference(self._containedItems(objectType, values)))
+        self._uncacheObject(objectType, anObject.ID)
+        return anObject.qualifiedId
+
+    def delete(self, objectType, identifier):
+        objectType = self._objectType(objectType)
+        with self._lock:
+            if str(identifier) in self._index.get(objectType.__name__, {}):
+                self._append(dict(type=objectType.__name__, id=str(identifier), deleted=True))
+                del self._index[objectType.__name__][str(identifier)]
+        self._uncacheObject(objectType, identifier)
+        self._markDeleted(objectType, [identifier])
+
+    def deleteMany(self, objectType, identifiers):
+        objectType = self._objectType(objectType)
+        identifiers = [str(identifier) for identifier in identifiers]
+        contained = []
+        deleted = 0
+        with self._lock:
+            locations = self._index.get(objectType.__name__, {})
+            for identifier in identifiers:
+                storedValues = self._storedValues(objectType.__name__, identifier)
+                if storedValues is not None:
+                    self._append(dict(type=objectType.__name__, id=identifier, deleted=True))
+                    del locations[identifier]
+                    contained.extend(self._containedItems(objectType, storedValues))
+                    deleted += 1
+        for identifier in identifiers:
+            self._uncacheObject(objectType, identifier)
+        self._markDeleted(objectType, identifiers)
+        self._deleteContained(contained)
+        return deleted
+
+    def exists(self, objectType, identifier):
+        with self._lock:
+            return str(identifier) in self._index.get(objectType.__name__, {})
+
+    def get(self, objectType, identifier, prefetch=None):
+        objectType = self._objectType(objectType)
+        result = self._cachedObject(objectType, identifier)
+        if result is None:
+            values = self._storedValues(objectType.__name__, str(identifier))
+            if values is not None:
+                result = self._fromRecord(objectType, values)
+                self._cacheObject(result)
+        return result
+
+    def list(self, objectType, prefetch=None, **kwargs):
+        with self._lock:
+            locations = sorted(self._index.get(objectType.__name__, {}).items(), key=lambda item: item[1])
+        for identifier, location in locations:
+            values = self._storedValues(objectType.__name__, identifier)
+            if values is None:
+                continue
+            obj = self._fromRecord(objectType, values)
+            if all(getattr(obj, name) == value for name, value in kwargs.items()):
+                yield obj
+
+    def drop(self, objectType):
+        with self._lock:
+            identifiers = list(self._index.get(objectType.__name__, {}))
+        for identifier in identifiers:
+            self.delete(objectType, identifier)
+
+    def garbage(self):
+        with self._lock:
+            sealed = set(segment for segment in self._segmentNumbers() if segment < self._activeSegment)
+            total = sum(getsize(self._segmentPath(segment)) for segment in sealed)
+            live = sum(HEADER.size + location[2] for locations in self._index.values() for location in locations.values() if location[0] in sealed)
+        return 0.0 if total == 0 else 1.0 - float(live) / total
+
+    def compact(self):
+        with self._compactionLock:
+            with self._lock:
+                if self._activeSize > 0:
+                    self._openActive(self._activeSegment + 1)
+                sealed = set(segment for segment in self._segmentNumbers() if segment < self._activeSegment)
+                live = [(objectTypeName, identifier, location)
+                    for objectTypeName, locations in self._index.items()
+                    for identifier, location in locations.items() if location[0] in sealed]
+
+            for objectTypeName, identifier, location in sorted(live, key=lambda item: item[2]):
+                with self._lock:
+                    if self._index.get(objectTypeName, {}).get(identifier) == location:
+                        self._index[objectTypeName][identifier] = self._appendPayload(self._readPayload(location))
+
+            with self._lock:
+                self._sync()
+                self._writeCheckpoint()
+                for segment in sorted(sealed):
+                    reader = self._readers.pop(segment, None)
+                    if reader is not None:
+                        reader.close()
+                    remove(self._segmentPath(segment))
+
+    def checkpoint(self):
+        with self._lock:
+            self._sync()
+            self._writeCheckpoint()
+
+    def close(self):
+        self._stopped.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            self.checkpoint()
+            self._active.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+
+    def _compactPeriodically(self, interval):
+        while not self._stopped.wait(interval):
+            if self.garbage() >= self._garbageRatio:
+                self.compact()
+
+    def _toRecord(self, field, value):
+        if type(field) in db_transformations and value is not None:
+            return db_transformations[type(field)]['to'](value, self)
+        return value
+
+    def _fromRecord(self, objectType, values):
+        fields = objectType.schema().byName
+        obj = objectType()
+        for name, value in values.items():
+            fieldType = type(fields[name])
+            if fieldType in db_transformations and value is not None:
+                value = db_transformations[fieldType]["from"](value, self)
+            setattr(obj, name, value)
+        obj._markClean(self)
+        return obj
+
+    def _put(self, objectTypeName, identifier, values):
+        with self._lock:
+            self._index.setdefault(objectTypeName, {})[identifier] = self._append(dict(type=objectTypeName, id=identifier, values=values))
+
+    def _storedValues(self, objectTypeName, identifier):
+        with self._lock:
+            location = self._index.get(objectTypeName, {}).get(identifier)
+            if location is None:
+                return None
+            return loads(self._readPayload(location))['values']
+
+    def _append(self, record):
+        return self._appendPayload(dumps(record))
+
+    def _appendPayload(self, payload):
+        data = HEADER.pack(len(payload), crc32(payload) & 0xffffffff) + payload
+        if self._activeSize > 0 and self._activeSize + len(data) > self._segmentSize:
+            self._openActive(self._activeSegment + 1)
+        location = (self._activeSegment, self._activeSize + HEADER.size, len(payload))
+        self._active.write(data)
+        self._active.flush()
+        if self._syncWrites:
+            fsync(self._active.fileno())
+        self._activeSize += len(data)
+        return location
+
+    def _readPayload(self, location):
+        segment, offset, length = location
+        reader = self._readers.get(segment)
+        if reader is None:
+            reader = self._readers[segment] = open(self._segmentPath(segment), 'rb')
+        reader.seek(offset)
+        return reader.read(length)
+
+    def _openActive(self, segment):
+        if self._active is not None:
+            self._sync()
+            self._active.close()
+        self._activeSegment = segment
+        self._active = open(self._segmentPath(segment), 'ab')
+        self._activeSize = self._active.tell()
+
+    def _sync(self):
+        self._active.flush()
+        fsync(self._active.fileno())
+
+    def _segmentPath(self, segment):
+        return join(self._root, '{}{:08d}{}'.format(SEGMENT_PREFIX, segment, SEGMENT_SUFFIX))
+
+    def _segmentNumbers(self):
+        return sorted(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in listdir(self._root)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+    def _recover(self):
+        segments = self._segmentNumbers()
+        if not segments:
+            return
+        startSegment, startOffset = segments[0], 0
+        checkpoint = self._readCheckpoint(segments)
+        if checkpoint is not None:
+            self._index = {objectTypeName: {identifier: tuple(location) for identifier, location in locations.items()}
+                for objectTypeName, locations in checkpoint['index'].items()}
+            startSegment, startOffset = checkpoint['segment'], checkpoint['offset']
+
+        for segment in segments:
+            if segment >= startSegment:
+                self._replay(segment, startOffset if segment == startSegment else 0, segment == segments[-1])
+
+    def _replay(self, segment, offset, isLast):
+        path = self._segmentPath(segment)
+        with open(path, 'rb') as fp:
+            fp.seek(offset)
+            while True:
+                position = fp.tell()
+                header = fp.read(HEADER.size)
+                if not header:
+                    return
+                payload = None
+                if len(header) == HEADER.size:
+                    length, checksum = HEADER.unpack(header)
+                    payload = fp.read(length)
+                    if len(payload) != length or crc32(payload) & 0xffffffff != checksum:
+                        payload = None
+                if payload is None:
+                    break
+                record = loads(payload)
+                if record.get('deleted'):
+                    self._index.get(record['type'], {}).pop(record['id'], None)
+                else:
+                    self._index.setdefault(record['type'], {})[record['id']] = (segment, position + HEADER.size, length)
+
+        if not isLast:
+            raise CorruptSegment("Corrupt record in {} at offset {}".format(path, position))
+        with open(path, 'r+b') as fp:
+            fp.truncate(position)
+
+    def _readCheckpoint(self, segments):
+        path = join(self._root, CHECKPOINT)
+        if not isfile(path):
+            return None
+        try:
+            with open(path) as fp:
+                checkpoint = loads(fp.read())
+        except ValueError:
+            return None
+        existing = set(segments)
+        referenced = set(location[0] for locations in checkpoint['index'].values() for location in locations.values())
+        if checkpoint['segment'] not in existing or not referenced.issubset(existing) or getsize(self._segmentPath(checkpoint['segment'])) < checkpoint['offset']:
+            return None
+        return checkpoint
+
+    def _writeCheckpoint(self):
+        path = join(self._root, CHECKPOINT)
+        with open(path + '.tmp', 'w') as fp:
+            fp.write(dumps(dict(segment=self._activeSegment, offset=self._activeSize, index=self._index)))
+            fp.flush()
+            fsync(fp.fileno())
+        rename(path + '.tmp', path)
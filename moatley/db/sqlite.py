@@ -0,0 +1,150 @@
+from sqlite3 import connect, PARSE_DECLTYPES
+from .fields import IDField, ReferenceField
+from .instrumentation import instrumented
+
+from contextlib import contextmanager
+
+from mysql import Mysql, Statements, CLASSES, binary_types
+from cursor import Cursor
+
+MAX_VARIABLES = 999
+
+sqlite_binary_types = dict(binary_types)
+sqlite_binary_types.update({
+    IDField: "BLOB",
+    ReferenceField: "BLOB",
+})
+
+class SqliteStatements(Statements):
+    def upsert(self, rowCount):
+        if rowCount not in self._upserts:
+            self._upserts[rowCount] = "{insertInto} VALUES {rows}".format(
+                insertInto=self._insertInto.replace("INSERT INTO", "INSERT OR REPLACE INTO", 1),
+                rows=','.join([self._rowValues] * rowCount))
+        return self._upserts[rowCount]
+
+
+class Sqlite(Mysql):
+    _statementsType = SqliteStatements
+    _registerClass = "INSERT OR IGNORE INTO `{classes}` (`id`, `name`) SELECT COALESCE(MAX(`id`), 0) + 1, %s FROM `{classes}`".format(classes=CLASSES)
+
+    def __init__(self, path, verbose=False, maxConnections=10, connectTimeout=None, busyTimeout=30.0, cachedStatements=256, objectCache=None, lazy=False, instrumentation=None, binaryIds=False):
+        self._busyTimeout = busyTimeout
+        self._cachedStatements = cachedStatements
+        self._prepared = {}
+        super(Sqlite, self).__init__(None, None, path,
+            verbose=verbose,
+            minConnections=1,
+            maxConnections=1 if path == ':memory:' else maxConnections,
+            idleCheckInterval=float('inf'),
+            connectTimeout=connectTimeout,
+            engine=None,
+            objectCache=objectCache,
+            lazy=lazy,
+            instrumentation=instrumentation,
+            binaryIds=binaryIds)
+        if binaryIds:
+            self._types = sqlite_binary_types
+            self._linkColumnType = "BLOB"
+        self._prefetchBatchSize = MAX_VARIABLES
+        self._linkBatchSize = MAX_VARIABLES // 2
+
+    def _connect(self):
+        connection = connect(self._database,
+            timeout=self._busyTimeout,
+            detect_types=PARSE_DECLTYPES,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self._cachedStatements)
+        connection.text_factory = str
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        if getattr(self._transactions, 'active', False):
+            yield
+            return
+
+        with self._pool.connection():
+            self._execute("BEGIN IMMEDIATE")
+            self._transactions.active = True
+            try:
+                yield
+            except:
+                self._execute("ROLLBACK")
+                raise
+            else:
+                self._execute("COMMIT")
+            finally:
+                self._transactions.active = False
+
+    @instrumented('store')
+    def store(self, anObject, storeMembers=True):
+        with self.transaction():
+            super(Sqlite, self).store(anObject, storeMembers=storeMembers)
+
+    @instrumented('storeMany')
+    def storeMany(self, objects, batchSize=1000):
+        with self.transaction():
+            super(Sqlite, self).storeMany(objects, batchSize=min(batchSize, MAX_VARIABLES // 2))
+
+    @instrumented('deleteMany')
+    def deleteMany(self, objectType, identifiers, batchSize=MAX_VARIABLES):
+        return super(Sqlite, self).deleteMany(objectType, identifiers, batchSize=min(batchSize, MAX_VARIABLES))
+
+    def _upsert(self, statements, objects):
+        self._executeMany(statements.upsert(1), [[self._columnValue(anObject, field) for field in statements.fields] for anObject in objects])
+
+    def _tables(self):
+        return [each[0] for each in self._sql("SELECT `name` FROM `sqlite_master` WHERE `type`='table'")]
+
+    def _tableOptions(self, engine):
+        return " WITHOUT ROWID"
+
+    def _existingIndexes(self, tableName):
+        return set(row[0] for row in self._sql("SELECT `name` FROM `sqlite_master` WHERE `type`='index' AND `tbl_name`=%s", [tableName]))
+
+    def _dropIndex(self, tableName, name):
+        self._execute("DROP INDEX `{}`".format(name))
+
+    def _renameTables(self, renames):
+        with self.transaction():
+            for old, new in renames:
+                self._execute("ALTER TABLE `{}` RENAME TO `{}`".format(old, new))
+
+    def _indexColumn(self, name, fields):
+        return '`{}`'.format(name)
+
+    def display(self, objectType):
+        fields = objectType.schema().byName
+        for _, name, dbType, notNull, default, primaryKey in self._sql("PRAGMA table_info(`{}`)".format(objectType.__name__)):
+            yield name, fields[name].__class__
+
+    def _prepare(self, statement):
+        prepared = self._prepared.get(statement)
+        if prepared is None:
+            prepared = self._prepared[statement] = statement.replace('%s', '?')
+        return prepared
+
+    def _execute(self, statement, args=None):
+        with self._instrumentation.measure('sqlite', 'execute', statement) as measurement:
+            with Cursor(self._pool) as cursor:
+                cursor.execute(self._prepare(statement), args or ())
+                measurement.rows = max(cursor.rowcount, 0)
+                return measurement.rows
+
+    def _executeMany(self, statement, argsList):
+        with self._instrumentation.measure('sqlite', 'executemany', statement) as measurement:
+            measurement.rows = len(argsList)
+            with Cursor(self._pool) as cursor:
+                cursor.executemany(self._prepare(statement), argsList)
+
+    def _sql(self, statement, args=None):
+        with self._instrumentation.measure('sqlite', 'select', statement) as measurement:
+            with Cursor(self._pool) as cursor:
+                cursor.execute(self._prepare(statement), args or ())
+                results = cursor.fetchall()
+                measurement.rows = len(results)
+                return results
@@ -0,0 +1,48 @@
+from seecr.test import SeecrTestCase
+
+from threading import Event
+from moatley.db import AsyncDB, Json, DbObject
+from moatley.db.asyncdb import FutureTimeout
+from moatley.db.fields import StrField, IntField
+
+class Mock(DbObject):
+    name = StrField("name")
+    age = IntField("age")
+
+class AsyncDBTest(SeecrTestCase):
+    def setUp(self):
+        super(AsyncDBTest, self).setUp()
+        db = Json(root=self.tempdir)
+        db.define(Mock)
+        self.db = AsyncDB(db, workers=2)
+
+    def tearDown(self):
+        self.db.close()
+        super(AsyncDBTest, self).tearDown()
+
+    def testStoreGetListDelete(self):
+        m = Mock(name="John", age=12)
+        self.assertEqual(m.qualifiedId, self.db.store(m).result(timeout=5))
+        self.assertEqual(m, self.db.get(Mock, m.ID).result(timeout=5))
+        self.assertEqual([m], self.db.list(Mock, name="John").result(timeout=5))
+        self.assertEqual(1, self.db.count(Mock).result(timeout=5))
+        self.assertEqual([m], self.db.all(self.db.db.query(Mock).where(Mock.age > 10)).result(timeout=5))
+        self.db.delete(Mock, m.ID).result(timeout=5)
+        self.assertEqual(None, self.db.get(Mock, m.ID).result(timeout=5))
+
+    def testErrorsAreRaisedFromResult(self):
+        future = self.db.get("NoSuchClass", "id")
+        self.assertRaises(ValueError, lambda: future.result(timeout=5))
+        self.assertTrue(isinstance(future.exception(), ValueError))
+
+    def testCallbacksAndTimeout(self):
+        release = Event()
+        blocked = self.db.submit(release.wait)
+        self.assertRaises(FutureTimeout, lambda: blocked.result(timeout=0.01))
+        done = []
+        blocked.addDoneCallback(done.append)
+        release.set()
+        blocked.result(timeout=5)
+        self.assertEqual([blocked], done)
+        blocked.addDoneCallback(done.append)
+        self.assertEqual([blocked, blocked], done)
@@ -0,0 +1,76 @@
+from seecr.test import SeecrTestCase
+
+from time import sleep
+from moatley.db import DbObject
+from moatley.db.cache import ObjectCache
+from moatley.db.fields import StrField, ReferenceField, CollectionField
+
+class Mock(DbObject):
+    name = StrField("name")
+
+class Book(DbObject):
+    author = ReferenceField("author")
+    pages = CollectionField("pages")
+
+class ObjectCacheTest(SeecrTestCase):
+    def testLeastRecentlyUsedIsEvicted(self):
+        cache = ObjectCache(maxSize=2)
+        m1, m2, m3 = Mock(), Mock(), Mock()
+        cache.put(m1)
+        cache.put(m2)
+        self.assertEqual(m1, cache.get(m1.qualifiedId))
+        cache.put(m3)
+
+        self.assertEqual(None, cache.get(m2.qualifiedId))
+        self.assertEqual(m1, cache.get(m1.qualifiedId))
+        self.assertEqual(m3, cache.get(m3.qualifiedId))
+        self.assertEqual(dict(size=2, maxSize=2, hits=3, misses=1, evictions=1, expirations=0), cache.statistics())
+
+    def testTimeToLive(self):
+        cache = ObjectCache(ttl=0.01)
+        m = Mock()
+        cache.put(m)
+        sleep(0.02)
+        self.assertEqual(None, cache.get(m.qualifiedId))
+        self.assertEqual(1, cache.statistics()['expirations'])
+
+    def testGetReturnsACopy(self):
+        cache = ObjectCache()
+        author = Mock(name="author")
+        book = Book(author=author, pages=[Mock(name="page"), author])
+        book._markClean(None)
+        cache.put(book)
+        book.author.name = "changed before"
+
+        first, second = cache.get(book.qualifiedId), cache.get(book.qualifiedId)
+        self.assertFalse(first is second)
+        self.assertEqual("author", first.author.name)
+        self.assertTrue(first.author is first.pages[1])
+        first.author.name = "changed after"
+        first.pages.append(Mock())
+        self.assertEqual(("author", 2), (second.author.name, len(second.pages)))
+        self.assertFalse(second._isDirty('pages'))
+        self.assertTrue(first._isDirty('pages'))
+
+    def testInvalidatingAMemberInvalidatesItsOwners(self):
+        cache = ObjectCache()
+        author, page = Mock(name="author"), Mock(name="page")
+        book = Book(author=author, pages=[page])
+        shelf = Book(pages=[book])
+        for anObject in [book, shelf, author]:
+            cache.put(anObject)
+
+        cache.invalidate(page.qualifiedId)
+        self.assertEqual([None, None], [cache.get(book.qualifiedId), cache.get(shelf.qualifiedId)])
+        self.assertEqual("author", cache.get(author.qualifiedId).name)
+        cache.put(book)
+        cache.invalidate(author.qualifiedId)
+        self.assertEqual(None, cache.get(book.qualifiedId))
+        self.assertEqual({}, cache._owners)
+
+    def testInvalidate(self):
+        cache = ObjectCache()
+        m = Mock()
+        cache.put(m)
+        cache.invalidate(m.qualifiedId)
+        self.assertEqual(None, cache.get(m.qualifiedId))
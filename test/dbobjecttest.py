@@ -1,11 +1,22 @@
 from seecr.test import SeecrTestCase
 
-from moatley.db import DbObject
-from moatley.db.fields import StrField, IntField, DecimalField, BooleanField, DateField, ReferenceField
+from moatley.db import DbObject, Index
+from moatley.db.fields import StrField, IntField, DecimalField, BooleanField, DateField, ReferenceField, CollectionField
 
 from uuid import UUID
 from decimal import Decimal
 from datetime import datetime
+from pickle import dumps, loads
+from sys import getsizeof
+
+class Plain(DbObject):
+    name = StrField("name")
+    children = CollectionField("children")
+
+class Compact(DbObject):
+    _compact = True
+    name = StrField("name")
+    children = CollectionField("children")
 
 class DbObjectTest(SeecrTestCase):
     def testAccessAsDictionary(self):
@@ -55,6 +66,99 @@ class DbObjectTest(SeecrTestCase):
             age = IntField("age")
         self.assertEqual(set(['age', 'name', 'ID']), set([f.name for f in Mock.fields()]))
 
+    def testSchema(self):
+        class Mock(DbObject):
+            name = StrField("name")
+            age = IntField("age")
+            parent = ReferenceField("parent")
+            children = CollectionField("children")
+        class SubMock(Mock):
+            nickname = StrField("nickname")
+
+        schema = Mock.schema()
+        self.assertTrue(schema is Mock.schema())
+        self.assertEqual(('ID', 'name', 'age', 'parent', 'children'), schema.names)
+        self.assertEqual('ID', schema.idField.name)
+        self.assertEqual(['ID', 'name', 'age', 'parent'], [f.name for f in schema.dbFields])
+        self.assertEqual(['children'], [f.name for f in schema.collectionFields])
+        self.assertEqual(['parent'], [f.name for f in schema.referenceFields])
+        self.assertTrue(schema.field('age') is Mock.__dict__['age'])
+        self.assertEqual(('ID', 'name', 'age', 'parent', 'children', 'nickname'), SubMock.schema().names)
+
+    def testIndexes(self):
+        class Mock(DbObject):
+            _indexes = [Index('name', 'age', unique=True)]
+            name = StrField("name", index=True)
+            age = IntField("age")
+
+        self.assertEqual([Index('name'), Index('name', 'age', unique=True)], list(Mock.schema().indexes))
+        self.assertEqual('Mock_uniq_name_age', Mock.schema().indexes[1].nameFor('Mock'))
+        self.assertEqual(64, len(Index('x' * 100).nameFor('Mock')))
+        def defineBadIndex():
+            class Bad(DbObject):
+                _indexes = [Index('missing')]
+        self.assertRaises(ValueError, defineBadIndex)
+
+    def testDirtyTracking(self):
+        class Mock(DbObject):
+            name = StrField("name")
+            children = CollectionField("children")
+
+        m = Mock(name="Moatley", children=[])
+        self.assertTrue(m._isDirty('name'))
+        m._markClean(None)
+        self.assertFalse(m._isDirty())
+
+        m.name = "Other"
+        self.assertEqual(True, m._isDirty('name'))
+        self.assertEqual(False, m._isDirty('children'))
+        m._markClean(None)
+
+        m.children.append(Mock())
+        self.assertTrue(m._isDirty('children'))
+        m._markClean(None)
+        del m.children[0]
+        self.assertTrue(m._isDirty('children'))
+
+    def testCompact(self):
+        class Mock(DbObject):
+            _compact = True
+            name = StrField("name")
+            children = CollectionField("children")
+        class SubMock(Mock):
+            age = IntField("age")
+
+        m = Mock(name="Moatley")
+        self.assertFalse(hasattr(m, '__dict__'))
+        self.assertFalse(hasattr(SubMock(), '__dict__'))
+        self.assertEqual("Moatley", m.name)
+        self.assertEqual(dict(ID=m.ID, name="Moatley", children=[]), dict(m))
+
+        other = Mock(name="Moatley")
+        other.ID = m.ID
+        self.assertEqual(m, other)
+        self.assertEqual(hash(m), hash(other))
+        other.name = "Changed"
+        self.assertFalse(m == other)
+        self.assertEqual(hash(m), hash(other))
+        self.assertEqual(set([m]), set([m, other]).difference([other]))
+
+        m._markClean(None)
+        self.assertEqual(None, m._dirty)
+        self.assertTrue(getsizeof(m) + getsizeof(m._values) < 200)
+
+    def testPickle(self):
+        for objectType in [Plain, Compact]:
+            m = objectType(name="Moatley", children=[objectType(name="child")])
+            m._markClean(None)
+            m.name = "Changed"
+            for protocol in [0, 2]:
+                copied = loads(dumps(m, protocol))
+                self.assertEqual((m.ID, "Changed", ["child"]), (copied.ID, copied.name, [c.name for c in copied.children]))
+                self.assertEqual((True, False), (copied._isDirty('name'), copied._isDirty('children')))
+                copied.children.append(objectType())
+                self.assertTrue(copied._isDirty('children'))
+
     def testFromWeb(self):
         class Mock(DbObject):
             name=StrField("name")
@@ -3,7 +3,12 @@ from seecr.test import SeecrTestCase, CallTrace
 from uuid import uuid4
 from decimal import Decimal
 from datetime import datetime
+from os import listdir
+from os.path import join
+from copy import deepcopy
+from pickle import dumps, loads
 from moatley.db import Json, DbObject
+from moatley.db.cache import ObjectCache
 from moatley.db.fields import StrField, IntField, DateField, IDField, ReferenceField, CollectionField, ReferenceField, DecimalField, BooleanField, TextField
 
 
@@ -14,6 +19,17 @@ class Mock(DbObject):
     weight = DecimalField("weight")
     description = TextField("description")
 
+class PickledAuthor(DbObject):
+    name = StrField("name")
+
+class PickledPage(DbObject):
+    number = IntField("number")
+
+class PickledBook(DbObject):
+    title = StrField("title")
+    author = ReferenceField("author")
+    pages = CollectionField("pages")
+
 class JsonTest(SeecrTestCase):
     def setUp(self):
         super(JsonTest, self).setUp()
@@ -74,6 +90,196 @@ class JsonTest(SeecrTestCase):
         self.assertEqual(1, len(allMocks))
         self.assertEqual([], list(self.db.list(Mock, name="Jane Doe", age=15)))
 
+    def testObjectCache(self):
+        cache = ObjectCache(maxSize=2)
+        self.db = Json(root=self.tempdir, objectCache=cache)
+        m = Mock(name="cached")
+        self.db.store(m)
+
+        first = self.db.get(Mock, m.ID)
+        second = self.db.get(Mock, m.ID)
+        self.assertFalse(first is second)
+        self.assertEqual(first, second)
+        self.assertEqual(dict(hits=1, misses=1), dict((k, self.db.cacheStatistics()[k]) for k in ['hits', 'misses']))
+
+        second.name = "unsaved"
+        self.assertEqual("cached", self.db.get(Mock, m.ID).name)
+        self.assertFalse(self.db.get(Mock, m.ID)._isDirty())
+
+        first.name = "changed"
+        self.db.store(first)
+        self.assertFalse(first is self.db.get(Mock, m.ID))
+        self.assertEqual("changed", self.db.get(Mock, m.ID).name)
+
+        self.db.delete(Mock, m.ID)
+        self.assertEqual(None, self.db.get(Mock, m.ID))
+
+    def testRecordCache(self):
+        m = Mock(name="John")
+        self.db.store(m)
+        self.assertEqual("John", self.db.get(Mock, m.ID).name)
+        self.assertEqual("John", self.db.get(Mock, m.ID).name)
+        self.assertEqual(dict(hits=1, misses=1), dict((k, self.db.recordCacheStatistics()[k]) for k in ['hits', 'misses']))
+
+        with open(join(self.tempdir, 'Mock', str(m.ID)), 'w') as fp:
+            fp.write('{"name": "Changed elsewhere", "ID": "%s"}' % m.ID)
+        self.assertEqual("Changed elsewhere", self.db.get(Mock, m.ID).name)
+
+        self.db.registerClass(Mock)
+        self.db.delete("Mock", m.ID)
+        self.assertEqual(None, self.db.get(Mock, m.ID))
+        self.assertEqual([], list(self.db.list(Mock)))
+
+        self.db.store(m)
+        self.assertTrue(self.db.exists(Mock, m.ID))
+
+    def testIterate(self):
+        mocks = [Mock(name="Mock {}".format(i), age=i % 2) for i in range(7)]
+        map(self.db.store, mocks)
+        expected = sorted(m.ID for m in mocks)
+
+        pages = self.db.iterate(Mock, pageSize=3)
+        self.assertEqual(expected, [m.ID for m in pages])
+        self.assertEqual(str(expected[-1]), pages.resumeToken)
+
+        pages = self.db.iterate(Mock, pageSize=3)
+        seen = []
+        for m in pages:
+            seen.append(m.ID)
+            if len(seen) == 4:
+                break
+        self.assertEqual(str(expected[2]), pages.resumeToken)
+        self.assertEqual(expected[3:], [m.ID for m in self.db.iterate(Mock, pageSize=3, resumeToken=pages.resumeToken, prefetch=False)])
+        self.assertEqual(sorted(m.ID for m in mocks if m.age == 1), [m.ID for m in self.db.iterate(Mock, pageSize=2, age=1)])
+
+    def testIterateReadsOnlyThePages(self):
+        db = Json(root=self.tempdir, recordCacheSize=0)
+        mocks = [Mock(name="Mock {}".format(i), age=i % 2) for i in range(200)]
+        db.storeMany(mocks)
+        events = []
+        db.addObserver(events.append)
+        self.assertEqual(sorted(m.ID for m in mocks), [m.ID for m in db.iterate(Mock, pageSize=20)])
+        self.assertEqual(200, len([e for e in events if e.operation == 'read']))
+
+        self.assertEqual(sorted(m.ID for m in mocks if m.age == 1)[:5], [m.ID for m in db.query(Mock).where(age=1).orderBy('ID').limit(5)])
+
+    def testQueryLoadsOnlyMatchingObjects(self):
+        class Author(DbObject):
+            name=StrField("name")
+        class Book(DbObject):
+            year=IntField("year")
+            author=ReferenceField("author")
+        db = Json(root=self.tempdir, recordCacheSize=0)
+        db.registerClass(Author, Book)
+        db.define(Author)
+        db.define(Book)
+        books = [Book(year=2000 + i, author=Author(name="Author {}".format(i))) for i in range(10)]
+        for book in books:
+            db.store(book.author)
+            db.store(book)
+        events = []
+        db.addObserver(events.append)
+        def authorsRead():
+            reads = [e for e in events if e.operation == 'read' and '/Author/' in e.statement]
+            del events[:]
+            return len(reads)
+
+        self.assertEqual(["Author 3"], [b.author.name for b in db.query(Book).where(year=2003)])
+        self.assertEqual(1, authorsRead())
+        self.assertEqual(["Author 3", "Author 4"], sorted(b.author.name for b in db.query(Book).where(Book.year.isIn([2003, 2004])).orderBy('ID')))
+        self.assertEqual(2, authorsRead())
+
+    def testCountAndAggregates(self):
+        for name, age, weight in [("A", 10, "1.5"), ("B", 20, "2.5"), ("A", 30, "3.0"), ("C", 40, "4.0")]:
+            self.db.store(Mock(name=name, age=age, weight=Decimal(weight)))
+
+        self.assertEqual(4, self.db.count(Mock))
+        self.assertEqual(2, self.db.count(Mock, name="A"))
+        self.assertEqual(3, self.db.query(Mock).where(Mock.age > 10).count())
+        self.assertTrue(self.db.existsWhere(Mock, name="C"))
+        self.assertFalse(self.db.existsWhere(Mock, name="D"))
+        self.assertEqual(10, self.db.aggregate(Mock, 'min', 'age'))
+        self.assertEqual(40, self.db.aggregate(Mock, 'max', 'age'))
+        self.assertEqual(100, self.db.aggregate(Mock, 'sum', 'age'))
+        self.assertEqual(25.0, self.db.aggregate(Mock, 'avg', 'age'))
+        self.assertEqual(None, self.db.aggregate(Mock, 'sum', 'age', name="D"))
+        for function, expected in [('min', "1.5"), ('max', "4.0"), ('sum', "11.0"), ('avg', "2.75")]:
+            value = self.db.aggregate(Mock, function, 'weight')
+            self.assertEqual((Decimal, Decimal(expected)), (type(value), value))
+        self.assertEqual(dict(A=40, B=20, C=40), self.db.aggregate(Mock, 'sum', 'age', groupBy='name'))
+        self.assertEqual(dict(A=2, C=1), self.db.query(Mock).where(Mock.name.isIn(["A", "C"])).aggregate('count', groupBy='name'))
+        self.assertRaises(ValueError, lambda: self.db.aggregate(Mock, 'sum', 'name'))
+        self.assertRaises(ValueError, lambda: self.db.aggregate(Mock, 'median', 'age'))
+
+    def testQuery(self):
+        class Book(DbObject):
+            title=StrField("title", index=True)
+            year=IntField("year")
+        self.db.define(Book)
+        for title, year in [("A", 1990), ("B", 2005), ("C", 2001), ("D", 2010), ("E", 2001)]:
+            self.db.store(Book(title=title, year=year))
+
+        query = self.db.query(Book)
+        self.assertEqual(["B", "C", "D", "E"], [b.title for b in query.where(Book.year >= 2000).orderBy('title')])
+        self.assertEqual(["D", "B"], [b.title for b in query.where(Book.year > 2001).orderBy('-year').limit(2)])
+        self.assertEqual(["C", "E"], [b.title for b in query.where(year=2001).orderBy('title')])
+        self.assertEqual(["E", "C", "A"], [b.title for b in query.where(Book.title.isIn(["A", "C", "E", "X"])).orderBy('-title')])
+        self.assertEqual(["C", "E", "B"], [b.title for b in query.where(Book.year.ne(1990), Book.year < 2010).orderBy('year', 'title')])
+        self.assertEqual("D", query.orderBy('-year').first().title)
+        self.assertEqual(2, len(query.limit(2).all()))
+        self.assertEqual([], query.where(Book.title.isIn([])).all())
+        self.assertRaises(ValueError, lambda: query.where(Mock.name.eq("A")))
+
+    def testInstrumentation(self):
+        events = []
+        self.db.addObserver(events.append)
+        m = Mock(name="John")
+        self.db.store(m)
+        self.db.get(Mock, m.ID)
+        self.db.get(Mock, m.ID)
+        self.db.delete(Mock, m.ID)
+        self.assertEqual([('Mock', 'store', 'write'), ('Mock', 'get', 'read'), ('Mock', 'delete', 'remove')],
+            [(e.objectType, e.api, e.operation) for e in events])
+        self.assertEqual(join(self.tempdir, 'Mock', str(m.ID)), events[0].statement)
+
+    def testIndexedList(self):
+        class Person(DbObject):
+            name = StrField("name", index=True)
+            age = IntField("age", index=True)
+            city = StrField("city")
+        self.db.define(Person)
+        john = Person(name="John", age=30, city="Amsterdam")
+        jane = Person(name="Jane", age=30, city="Utrecht")
+        self.db.store(john)
+        self.db.store(jane)
+
+        self.assertEqual([john], list(self.db.list(Person, name="John")))
+        self.assertEqual(set([john, jane]), set(self.db.list(Person, age=30)))
+        self.assertEqual([jane], list(self.db.list(Person, age=30, city="Utrecht")))
+        self.assertEqual([], list(self.db.list(Person, name="Nobody")))
+
+        john.name = "Johnny"
+        self.db.store(john)
+        self.assertEqual([], list(self.db.list(Person, name="John")))
+        self.assertEqual([john], list(self.db.list(Person, name="Johnny")))
+        self.assertEqual([], listdir(join(self.tempdir, '_indexes', 'Person', 'name', self.db._indexKey("John"))))
+
+        self.db.delete(Person, jane.ID)
+        self.assertEqual([john], list(self.db.list(Person, age=30)))
+
+    def testReindex(self):
+        class Person(DbObject):
+            name = StrField("name")
+        self.db.define(Person)
+        john = Person(name="John")
+        self.db.store(john)
+
+        class Person(DbObject):
+            name = StrField("name", index=True)
+        self.db.reindex(Person)
+        self.assertEqual(['name'], listdir(join(self.tempdir, '_indexes', 'Person')))
+        self.assertEqual([john.ID], [p.ID for p in self.db.list(Person, name="John")])
+
     def testCollectionAdd(self):
         class Page(DbObject):
             number=IntField("number")
@@ -106,6 +312,100 @@ class JsonTest(SeecrTestCase):
 
         self.assertEqual(3, len(list(self.db.list(Page))))
 
+    def testStoreMany(self):
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            title=StrField("title")
+            pages=CollectionField("pages")
+        self.db.registerClass(Book, Page)
+        self.db.define(Page, dropIfExists=True)
+        self.db.define(Book, dropIfExists=True)
+
+        books = [Book(title="Book {}".format(i), pages=[Page(number=n) for n in range(3)]) for i in range(5)]
+        self.db.storeMany(books, batchSize=2)
+        self.assertEqual(5, len(list(self.db.list(Book))))
+        self.assertEqual(15, len(list(self.db.list(Page))))
+
+        books[0].title = "Changed"
+        del books[0].pages[0]
+        books[1].pages.append(Page(number=3))
+        self.db.storeMany(books[:2], batchSize=2)
+        self.assertEqual("Changed", self.db.get(Book, books[0].ID).title)
+        self.assertEqual([1, 2], sorted(p.number for p in self.db.get(Book, books[0].ID).pages))
+        self.assertEqual([0, 1, 2, 3], sorted(p.number for p in self.db.get(Book, books[1].ID).pages))
+        self.assertEqual(15, len(list(self.db.list(Page))))
+
+    def testLazy(self):
+        class Author(DbObject):
+            name=StrField("name")
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            title=StrField("title")
+            author=ReferenceField("author")
+            pages=CollectionField("pages")
+        self.db = Json(root=self.tempdir, lazy=True)
+        self.db.registerClass(Author, Page, Book)
+        for objectType in [Author, Page, Book]:
+            self.db.define(objectType, dropIfExists=True)
+        book = Book(title="Lazy", author=Author(name="Moatley"), pages=[Page(number=1), Page(number=2)])
+        self.db.store(book)
+
+        loaded = self.db.get(Book, book.ID)
+        self.assertNotEqual(None, Book.author.deferred(loaded))
+        self.assertNotEqual(None, Book.pages.deferred(loaded))
+
+        loaded.title = "Still lazy"
+        self.db.storeMany([loaded])
+        self.assertNotEqual(None, Book.pages.deferred(loaded))
+        self.assertEqual(2, len(list(self.db.list(Page))))
+
+        loaded = self.db.get(Book, book.ID)
+        self.assertEqual("Still lazy", loaded.title)
+        self.assertEqual("Moatley", loaded.author.name)
+        del loaded.pages[0]
+        self.db.store(loaded)
+        self.assertEqual([2], [p.number for p in self.db.get(Book, book.ID).pages])
+        self.assertEqual(1, len(list(self.db.list(Page))))
+
+    def testPickleAndDeepcopyLoadedObjects(self):
+        Author, Page, Book = PickledAuthor, PickledPage, PickledBook
+        for db in [Json(root=join(self.tempdir, 'eager')), Json(root=join(self.tempdir, 'lazy'), lazy=True)]:
+            db.registerClass(Author, Page, Book)
+            for objectType in [Author, Page, Book]:
+                db.define(objectType)
+            book = Book(title="Copied", author=Author(name="Moatley"), pages=[Page(number=1), Page(number=2)])
+            db.store(book)
+            loaded = db.get(Book, book.ID)
+
+            for copied in [loads(dumps(loaded, 2)), deepcopy(loaded)]:
+                self.assertEqual(("Copied", "Moatley", [1, 2]), (copied.title, copied.author.name, [p.number for p in copied.pages]))
+                self.assertFalse(copied._isStoredIn(db))
+                self.assertFalse(copied._isDirty())
+                copied.pages.append(Page(number=3))
+                self.assertTrue(copied._isDirty('pages'))
+            self.assertEqual(2, len(loaded.pages))
+
+    def testCompactLazyEquality(self):
+        class Author(DbObject):
+            _compact = True
+            name=StrField("name")
+        class Book(DbObject):
+            _compact = True
+            title=StrField("title")
+            author=ReferenceField("author")
+        self.db = Json(root=self.tempdir, lazy=True)
+        self.db.registerClass(Author, Book)
+        for objectType in [Author, Book]:
+            self.db.define(objectType, dropIfExists=True)
+        book = Book(title="Compact", author=Author(name="Moatley"))
+        self.db.store(book)
+
+        self.assertEqual(self.db.get(Book, book.ID), self.db.get(Book, book.ID))
+        self.assertEqual(book, self.db.get(Book, book.ID))
+        self.assertEqual(self.db.get(Book, book.ID), book)
+
     def testCollectionContained(self):
         class Page(DbObject):
             book=StrField("book")
@@ -129,6 +429,26 @@ class JsonTest(SeecrTestCase):
         self.db.store(b)
         self.assertEqual(0, len(list(self.db.list(Page))))
 
+    def testDeleteManyAndDeleteWhere(self):
+        class Page(DbObject):
+            number=IntField("number", index=True)
+        class Book(DbObject):
+            title=StrField("title")
+            pages=CollectionField("pages")
+        self.db.registerClass(Page, Book)
+        self.db.define(Page)
+        self.db.define(Book)
+        books = [Book(title="Book {}".format(i % 2), pages=[Page(number=n) for n in range(2)]) for i in range(4)]
+        self.db.storeMany(books)
+
+        self.assertEqual(1, self.db.deleteMany(Book, [books[0].ID, uuid4()]))
+        self.assertEqual([3, 6], [self.db.count(Book), self.db.count(Page)])
+        self.assertEqual(2, self.db.deleteWhere(Book, title="Book 1"))
+        self.assertEqual([1, 2], [self.db.count(Book), self.db.count(Page)])
+        self.assertEqual(1, self.db.query(Page).where(number=0).delete())
+        self.assertEqual([1], [p.number for p in self.db.list(Page, number=1)])
+        self.assertEqual([], list(self.db.list(Page, number=0)))
+
     def testCollectionNotContained(self):
         class Page(DbObject):
             number=IntField("number")
@@ -1,9 +1,15 @@
 from seecr.test import SeecrTestCase, CallTrace
 
 from uuid import uuid4
+from StringIO import StringIO
+from weakref import ref
+from gc import collect
 from datetime import datetime
 from decimal import Decimal
-from moatley.db import Mysql, DbObject
+from moatley.db import Mysql, DbObject, Index
+from moatley.db.cache import ObjectCache
+from moatley.db.instrumentation import Instrumentation
+from moatley.db.migration import BinaryIdMigration
 from moatley.db.fields import StrField, IntField, DateField, IDField, ReferenceField, CollectionField, DecimalField, BooleanField, TextField
 
 class Mock(DbObject):
@@ -29,6 +35,87 @@ class MysqlTest(SeecrTestCase):
             ('weight', DecimalField),
             ('description', TextField)]), set(self.db.display(Mock)))
 
+    def testIndexes(self):
+        class Book(DbObject):
+            _indexes = [Index('author', 'year'), Index('isbn', unique=True)]
+            title = StrField("title", index=True)
+            author = ReferenceField("author")
+            year = IntField("year")
+            isbn = StrField("isbn")
+            pages = CollectionField("pages")
+        self.db.define(Book, dropIfExists=True)
+        self.assertTrue(set(['Book_title', 'Book_author_year', 'Book_uniq_isbn']).issubset(self.db._existingIndexes('Book')))
+        self.assertTrue('Book_pages_item' in self.db._existingIndexes('Book_pages'))
+        self.assertEqual([], self.db.sync(Book))
+
+    def testSyncAddsMissingIndexes(self):
+        class Book(DbObject):
+            title = StrField("title")
+        self.db.define(Book, dropIfExists=True)
+        self.db._execute("ALTER TABLE `Book` ADD COLUMN `year` INT(11)")
+
+        class Book(DbObject):
+            _indexes = [Index('title', 'year')]
+            title = StrField("title", index=True)
+            year = IntField("year")
+            pages = CollectionField("pages")
+        self.assertEqual(['Book_title', 'Book_title_year'], self.db.sync(Book))
+        self.assertTrue('Book_pages_item' in self.db._existingIndexes('Book_pages'))
+
+    def testBinaryIdsDeleteWhere(self):
+        class Page(DbObject):
+            number = IntField("number")
+        class Book(DbObject):
+            title = StrField("title")
+            pages = CollectionField("pages")
+        db = Mysql(username="test", password="test", database="test", binaryIds=True)
+        db.registerClass(Mock, Page, Book)
+        for objectType in [Mock, Page, Book]:
+            db.define(objectType, dropIfExists=True)
+        db.storeMany([Book(title="a", pages=[Page(number=1)]), Book(title="b"), Mock(name="B"), Mock(name="A")])
+
+        self.assertEqual(1, db.deleteWhere(Book, title="a"))
+        self.assertEqual((["b"], 0), ([b.title for b in db.list(Book)], db.count(Page)))
+        self.assertEqual(1, db.query(Mock).orderBy('name').limit(1).delete())
+        self.assertEqual(["B"], [m.name for m in db.list(Mock)])
+
+    def testBinaryIdMigration(self):
+        class Page(DbObject):
+            number = IntField("number")
+        class Book(DbObject):
+            title = StrField("title", index=True)
+            author = ReferenceField("author")
+            pages = CollectionField("pages")
+        self.db.registerClass(Mock, Page, Book)
+        for objectType in [Page, Book]:
+            self.db.define(objectType, dropIfExists=True)
+        author = Mock(name="Moatley")
+        books = [Book(title="Book {}".format(i), author=author, pages=[Page(number=n) for n in range(2)]) for i in range(5)]
+        self.db.storeMany([author] + books)
+
+        binary = Mysql(username="test", password="test", database="test", binaryIds=True)
+        binary.registerClass(Mock, Page, Book)
+        migration = BinaryIdMigration(binary, batchSize=2)
+        self.assertEqual([1, 0], migration.copy(Mock))
+        self.assertEqual([10, 0], migration.copy(Page))
+        self.assertEqual([10, 0], migration.copy(Book))
+        books[0].title = "Changed"
+        del books[1].pages[0]
+        self.db.storeMany(books[:2])
+        self.assertEqual([2, 0], migration.copy(Book))
+
+        for objectType in [Mock, Page, Book]:
+            migration.swap(objectType, keepSource=False)
+        self.assertEqual(16, len(binary._sql("SELECT `ID` FROM `Book`")[0][0]))
+        self.assertEqual(18, len(binary._sql("SELECT `author` FROM `Book`")[0][0]))
+        loaded = binary.get(Book, books[0].ID)
+        self.assertEqual(("Changed", "Moatley", [0, 1]), (loaded.title, loaded.author.name, sorted(p.number for p in loaded.pages)))
+        self.assertEqual(1, len(binary.get(Book, books[1].ID).pages))
+        self.assertEqual(5, binary.count(Book, author=author))
+        self.assertTrue('Book_title' in binary._existingIndexes('Book'))
+        self.assertFalse('Book__text' in binary._tables())
+        self.assertEqual([], self.db.sync(Book))
+
     def testSetOnCreate(self):
         m = Mock(name="John", age=12)
         self.assertEqual("John", m.name)
@@ -59,6 +146,15 @@ class MysqlTest(SeecrTestCase):
         n = self.db.get(Mock, m.ID)
         self.assertEqual("Jane Smith", n.name)
 
+    def testValuesAreBoundAsParameters(self):
+        m = Mock(name='O\'Brien "quoted" \\ %s', description="100% sure")
+        self.db.store(m)
+
+        n = self.db.get(Mock, m.ID)
+        self.assertEqual('O\'Brien "quoted" \\ %s', n.name)
+        self.assertEqual("100% sure", n.description)
+        self.assertEqual([m.ID], [each.ID for each in self.db.list(Mock, name='O\'Brien "quoted" \\ %s')])
+
     def testList(self):
         m1 = Mock(name="John Smith")
         self.db.store(m1)
@@ -74,6 +170,279 @@ class MysqlTest(SeecrTestCase):
         self.assertEqual([], list(self.db.list(Mock, name="Jane Doe", age=15)))
 
 
+    def testIterate(self):
+        mocks = [Mock(name="Mock {}".format(i), age=i % 2) for i in range(7)]
+        map(self.db.store, mocks)
+        expected = sorted(m.ID for m in mocks)
+
+        pages = self.db.iterate(Mock, pageSize=3)
+        self.assertEqual(expected, [m.ID for m in pages])
+        self.assertEqual(str(expected[-1]), pages.resumeToken)
+
+        pages = self.db.iterate(Mock, pageSize=3)
+        seen = []
+        for m in pages:
+            seen.append(m.ID)
+            if len(seen) == 4:
+                break
+        self.assertEqual(str(expected[2]), pages.resumeToken)
+        self.assertEqual(expected[3:], [m.ID for m in self.db.iterate(Mock, pageSize=3, resumeToken=pages.resumeToken, prefetch=False)])
+        self.assertEqual(sorted(m.ID for m in mocks if m.age == 1), [m.ID for m in self.db.iterate(Mock, pageSize=2, age=1)])
+
+    def testCountAndAggregates(self):
+        for name, age, weight in [("A", 10, "1.5"), ("B", 20, "2.5"), ("A", 30, "3.0"), ("C", 40, "4.0")]:
+            self.db.store(Mock(name=name, age=age, weight=Decimal(weight)))
+
+        self.assertEqual(4, self.db.count(Mock))
+        self.assertEqual(2, self.db.count(Mock, name="A"))
+        self.assertEqual(3, self.db.query(Mock).where(Mock.age > 10).count())
+        self.assertTrue(self.db.existsWhere(Mock, name="C"))
+        self.assertFalse(self.db.existsWhere(Mock, name="D"))
+        self.assertEqual(10, self.db.aggregate(Mock, 'min', 'age'))
+        self.assertEqual(40, self.db.aggregate(Mock, 'max', 'age'))
+        self.assertEqual(100, self.db.aggregate(Mock, 'sum', 'age'))
+        self.assertEqual(25.0, self.db.aggregate(Mock, 'avg', 'age'))
+        self.assertEqual(None, self.db.aggregate(Mock, 'sum', 'age', name="D"))
+        for function, expected in [('min', "1.5"), ('max', "4.0"), ('sum', "11.0"), ('avg', "2.75")]:
+            value = self.db.aggregate(Mock, function, 'weight')
+            self.assertEqual((Decimal, Decimal(expected)), (type(value), value))
+        self.assertEqual(dict(A=40, B=20, C=40), self.db.aggregate(Mock, 'sum', 'age', groupBy='name'))
+        self.assertEqual(dict(A=2, C=1), self.db.query(Mock).where(Mock.name.isIn(["A", "C"])).aggregate('count', groupBy='name'))
+        self.assertRaises(ValueError, lambda: self.db.aggregate(Mock, 'sum', 'name'))
+        self.assertRaises(ValueError, lambda: self.db.aggregate(Mock, 'median', 'age'))
+
+    def testQuery(self):
+        class Book(DbObject):
+            title=StrField("title")
+            year=IntField("year")
+        self.db.define(Book, dropIfExists=True)
+        for title, year in [("A", 1990), ("B", 2005), ("C", 2001), ("D", 2010), ("E", 2001)]:
+            self.db.store(Book(title=title, year=year))
+
+        query = self.db.query(Book)
+        self.assertEqual(["B", "C", "D", "E"], [b.title for b in query.where(Book.year >= 2000).orderBy('title')])
+        self.assertEqual(["D", "B"], [b.title for b in query.where(Book.year > 2001).orderBy('-year').limit(2)])
+        self.assertEqual(["C", "E"], [b.title for b in query.where(year=2001).orderBy('title')])
+        self.assertEqual(["E", "C", "A"], [b.title for b in query.where(Book.title.isIn(["A", "C", "E", "X"])).orderBy('-title')])
+        self.assertEqual(["C", "E", "B"], [b.title for b in query.where(Book.year.ne(1990), Book.year < 2010).orderBy('year', 'title')])
+        self.assertEqual("D", query.orderBy('-year').first().title)
+        self.assertEqual(2, len(query.limit(2).all()))
+        self.assertEqual([], query.where(Book.title.isIn([])).all())
+        self.assertRaises(ValueError, lambda: query.where(Mock.name.eq("A")))
+
+    def testCollectionSyncIsSetBased(self):
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            title=StrField("title")
+            pages=CollectionField("pages")
+        self.db.registerClass(Page, Book)
+        self.db.define(Page, dropIfExists=True)
+        self.db.define(Book, dropIfExists=True)
+        events = []
+        self.db.addObserver(events.append)
+        def linkStatements():
+            statements = [e.statement.split()[0] for e in events if '`Book_pages`' in e.statement]
+            del events[:]
+            return statements
+
+        book = Book(title="Book", pages=[Page(number=n) for n in range(50)])
+        self.db.store(book)
+        self.assertEqual(['SELECT', 'INSERT'], linkStatements())
+
+        removed = book.pages[:10]
+        del book.pages[:10]
+        book.pages.extend(Page(number=n) for n in range(50, 55))
+        self.db.store(book)
+        self.assertEqual(['SELECT', 'INSERT', 'DELETE'], linkStatements())
+        self.assertEqual(45, len(self.db.get(Book, book.ID).pages))
+        self.assertFalse(any(self.db.exists(Page, page.ID) for page in removed))
+
+        del events[:]
+        book.title = "Renamed"
+        self.db.store(book)
+        self.assertEqual([], [e for e in events if e.objectType == 'Page'])
+        del events[:]
+
+        book.pages[0].number = 100
+        self.db.store(book, storeMembers=False)
+        self.assertEqual(10, self.db.get(Page, book.pages[0].ID).number)
+        self.db.store(book)
+        self.assertEqual(100, self.db.get(Page, book.pages[0].ID).number)
+
+        def pageStatements(count):
+            book.pages.extend(Page(number=n) for n in range(count))
+            del events[:]
+            self.db.store(book)
+            return len([e for e in events if '`Page`' in e.statement])
+        self.assertEqual(pageStatements(5), pageStatements(1000))
+        self.assertEqual(1050, len(self.db.get(Book, book.ID).pages))
+
+    def testDeleteManyAndDeleteWhere(self):
+        class Page(DbObject):
+            number=IntField("number")
+        class Chapter(DbObject):
+            number=IntField("number")
+            pages=CollectionField("pages")
+        class Book(DbObject):
+            title=StrField("title")
+            chapters=CollectionField("chapters")
+            related=CollectionField("related", contained=False)
+        self.db.registerClass(Page, Chapter, Book)
+        for objectType in [Page, Chapter, Book]:
+            self.db.define(objectType, dropIfExists=True)
+        other = Book(title="Other")
+        books = [Book(title="Book {}".format(i % 2), related=[other], chapters=[Chapter(number=c, pages=[Page(number=p) for p in range(2)]) for c in range(2)]) for i in range(4)]
+        self.db.storeMany(books + [other])
+
+        self.assertEqual(2, self.db.deleteMany(Book, [books[0].ID, books[1].ID]))
+        self.assertEqual([3, 4, 8], [self.db.count(objectType) for objectType in [Book, Chapter, Page]])
+        self.assertEqual(1, self.db.deleteWhere(Book, title="Book 0"))
+        self.assertEqual([2, 2, 4], [self.db.count(objectType) for objectType in [Book, Chapter, Page]])
+        self.assertEqual(2, len(self.db._sql("SELECT * FROM `Book_chapters`")))
+        self.assertEqual([books[3].qualifiedId], [owner for owner, _ in self.db._sql("SELECT * FROM `Book_related`")])
+        self.assertEqual(0, self.db.deleteMany(Book, [books[0].ID]))
+
+        for age in range(5):
+            self.db.store(Mock(name="Mock", age=age))
+        self.assertEqual(2, self.db.query(Mock).where(Mock.age >= 3).delete())
+        self.assertEqual(1, self.db.deleteWhere(Mock, age=0))
+        self.assertEqual([1, 2], sorted(m.age for m in self.db.list(Mock)))
+
+    def testInstrumentation(self):
+        slowLog = StringIO()
+        events = []
+        self.db = Mysql(username="test", password="test", database="test", instrumentation=Instrumentation(slowQueryThreshold=0.0, slowQueryLog=slowLog))
+        self.db.addObserver(events.append)
+        m = Mock(name="John")
+        self.db.store(m)
+        list(self.db.list(Mock, name="John"))
+
+        self.assertEqual([('Mock', 'exists', 'select'), ('Mock', 'store', 'execute'), ('Mock', 'list', 'select')],
+            [(e.objectType, e.api, e.operation) for e in events])
+        self.assertTrue(events[1].statement.startswith("INSERT INTO `Mock`"))
+        self.assertEqual(1, events[1].rows)
+        self.assertEqual(1, events[2].rows)
+        self.assertTrue(all(e.duration >= 0 for e in events))
+
+        statistics = dict(((s['objectType'], s['api'], s['operation']), s) for s in self.db.instrumentation.statistics())
+        self.assertEqual(1, statistics[('Mock', 'list', 'select')]['count'])
+        self.assertEqual(1, sum(count for _, count in statistics[('Mock', 'list', 'select')]['histogram']))
+        self.assertEqual(3, len(self.db.instrumentation.slowQueries()))
+        self.assertEqual(3, len(slowLog.getvalue().splitlines()))
+
+    def testObjectCacheInvalidatesOwners(self):
+        class Publisher(DbObject):
+            name=StrField("name")
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            publisher=ReferenceField("publisher")
+            pages=CollectionField("pages")
+        self.db = Mysql(username="test", password="test", database="test", objectCache=ObjectCache())
+        self.db.registerClass(Publisher, Page, Book)
+        for objectType in [Publisher, Page, Book]:
+            self.db.define(objectType, dropIfExists=True)
+        publisher, page = Publisher(name="Old"), Page(number=1)
+        book = Book(publisher=publisher, pages=[page])
+        self.db.storeMany([publisher, book])
+        self.assertEqual("Old", self.db.get(Book, book.ID).publisher.name)
+
+        publisher.name = "New"
+        self.db.store(publisher)
+        self.assertEqual("New", self.db.get(Book, book.ID).publisher.name)
+
+        page.number = 2
+        self.db.store(page)
+        self.assertEqual([2], [p.number for p in self.db.get(Book, book.ID).pages])
+
+    def testObjectCacheCopiesLazyReferences(self):
+        class Author(DbObject):
+            name=StrField("name")
+        class Book(DbObject):
+            author=ReferenceField("author")
+            editor=ReferenceField("editor")
+        self.db = Mysql(username="test", password="test", database="test", objectCache=ObjectCache(), lazy=True)
+        self.db.registerClass(Author, Book)
+        for objectType in [Author, Book]:
+            self.db.define(objectType, dropIfExists=True)
+        author = Author(name="Moatley")
+        book = Book(author=author, editor=author)
+        self.db.storeMany([author, book])
+
+        x, y = self.db.get(Book, book.ID), self.db.get(Book, book.ID)
+        self.assertFalse(x.author is y.author)
+        self.assertTrue(x.author is x.editor)
+        x.author.name = "Changed"
+        self.assertEqual(("Moatley", "Moatley"), (y.author.name, self.db.get(Book, book.ID).author.name))
+
+    def testUnixSocket(self):
+        from moatley.db import mysql
+        connections = []
+        def connect(**kwargs):
+            connections.append(kwargs)
+            return CallTrace("Connection")
+        originalConnect, mysql.Connect = mysql.Connect, connect
+        try:
+            Mysql(username="test", password="test", database="test", minConnections=0, unixSocket="/tmp/mysqld.sock")._connect()
+            Mysql(username="test", password="test", database="test", minConnections=0)._connect()
+        finally:
+            mysql.Connect = originalConnect
+        self.assertEqual("/tmp/mysqld.sock", connections[0]['unix_socket'])
+        self.assertFalse('unix_socket' in connections[1])
+        self.assertEqual([2, 2], [c['client_flag'] for c in connections])
+
+    def testStreamingList(self):
+        db = Mysql(username="test", password="test", database="test", streaming=True, fetchSize=2)
+        for i in range(5):
+            db.store(Mock(name="Mock {}".format(i), age=i))
+
+        results = db.list(Mock)
+        self.assertEqual(Mock, type(next(results)))
+        self.assertEqual(["Mock {}".format(i) for i in range(5)], sorted(m.name for m in db.list(Mock)))
+        self.assertEqual(["Mock 3"], [m.name for m in db.list(Mock, age=3)])
+        self.assertRaises(ValueError, lambda: Mysql(username="test", password="test", database="test", streaming=True, maxConnections=1))
+
+    def testTransaction(self):
+        self.db.define(Mock, dropIfExists=True, engine="InnoDB")
+        with self.db.transaction():
+            self.db.store(Mock(name="first"))
+            with self.db.transaction():
+                self.db.store(Mock(name="second"))
+        self.assertEqual(["first", "second"], sorted(m.name for m in self.db.list(Mock)))
+
+        try:
+            with self.db.transaction():
+                self.db.store(Mock(name="third"))
+                raise ValueError("abort")
+        except ValueError:
+            pass
+        self.assertEqual(["first", "second"], sorted(m.name for m in self.db.list(Mock)))
+
+    def testObjectCache(self):
+        cache = ObjectCache(maxSize=2)
+        self.db = Mysql(username="test", password="test", database="test", objectCache=cache)
+        m = Mock(name="cached")
+        self.db.store(m)
+
+        first = self.db.get(Mock, m.ID)
+        second = self.db.get(Mock, m.ID)
+        self.assertFalse(first is second)
+        self.assertEqual(first, second)
+        self.assertEqual(dict(hits=1, misses=1), dict((k, self.db.cacheStatistics()[k]) for k in ['hits', 'misses']))
+
+        second.name = "unsaved"
+        self.assertEqual("cached", self.db.get(Mock, m.ID).name)
+        self.assertFalse(self.db.get(Mock, m.ID)._isDirty())
+
+        first.name = "changed"
+        self.db.store(first)
+        self.assertFalse(first is self.db.get(Mock, m.ID))
+        self.assertEqual("changed", self.db.get(Mock, m.ID).name)
+
+        self.db.delete(Mock, m.ID)
+        self.assertEqual(None, self.db.get(Mock, m.ID))
+
     def testCollectionAdd(self):
         class Page(DbObject):
             number=IntField("number")
@@ -107,6 +476,214 @@ class MysqlTest(SeecrTestCase):
 
         self.assertEqual(3, len(list(self.db.list(Page))))
 
+    def testStoreMany(self):
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            title=StrField("title")
+            pages=CollectionField("pages")
+        self.db.registerClass(Book, Page)
+        self.db.define(Page, dropIfExists=True)
+        self.db.define(Book, dropIfExists=True)
+
+        books = [Book(title="Book {}".format(i), pages=[Page(number=n) for n in range(3)]) for i in range(5)]
+        self.db.storeMany(books, batchSize=2)
+        self.assertEqual(5, len(list(self.db.list(Book))))
+        self.assertEqual(15, len(list(self.db.list(Page))))
+
+        books[0].title = "Changed"
+        del books[0].pages[0]
+        books[1].pages.append(Page(number=3))
+        self.db.storeMany(books[:2], batchSize=2)
+        self.assertEqual("Changed", self.db.get(Book, books[0].ID).title)
+        self.assertEqual([1, 2], sorted(p.number for p in self.db.get(Book, books[0].ID).pages))
+        self.assertEqual([0, 1, 2, 3], sorted(p.number for p in self.db.get(Book, books[1].ID).pages))
+        self.assertEqual(15, len(list(self.db.list(Page))))
+
+    def testPrefetch(self):
+        class Publisher(DbObject):
+            name=StrField("name")
+        class Author(DbObject):
+            name=StrField("name")
+            publisher=ReferenceField("publisher")
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            title=StrField("title")
+            author=ReferenceField("author")
+            pages=CollectionField("pages")
+        self.db.registerClass(Publisher, Author, Page, Book)
+        for objectType in [Publisher, Author, Page, Book]:
+            self.db.define(objectType, dropIfExists=True)
+
+        publisher = Publisher(name="Moatley Press")
+        authors = [Author(name="Author {}".format(i), publisher=publisher) for i in range(2)]
+        books = [Book(title="Book {}".format(i), author=authors[i % 2], pages=[Page(number=n) for n in range(3)]) for i in range(4)]
+        self.db.store(publisher)
+        map(self.db.store, authors)
+        map(self.db.store, books)
+
+        events = []
+        self.db.addObserver(events.append)
+        def tablesQueried():
+            tables = [e.statement.split(' FROM ')[1].split()[0] for e in events]
+            del events[:]
+            return tables
+
+        loaded = sorted(self.db.list(Book, prefetch=['pages', 'author.publisher']), key=lambda b: b.title)
+        self.assertEqual(['`Book`', '`Author`', '`Publisher`', '`Book_pages`', '`Page`'], tablesQueried())
+        self.assertEqual(["Book 0", "Book 1", "Book 2", "Book 3"], [b.title for b in loaded])
+        self.assertEqual(["Author 0", "Author 1", "Author 0", "Author 1"], [b.author.name for b in loaded])
+        self.assertTrue(loaded[0].author is loaded[2].author)
+        self.assertEqual("Moatley Press", loaded[3].author.publisher.name)
+        self.assertEqual([[0, 1, 2]] * 4, [sorted(p.number for p in b.pages) for b in loaded])
+
+        del events[:]
+        book = self.db.get(Book, books[1].ID, prefetch=['pages', 'author'])
+        self.assertEqual(['`Book`', '`Author`', '`Publisher`', '`Book_pages`', '`Page`'], tablesQueried())
+        self.assertEqual(authors[1], book.author)
+        self.assertEqual(set(books[1].pages), set(book.pages))
+        self.assertRaises(ValueError, lambda: list(self.db.list(Book, prefetch=['title'])))
+
+    def testStreamingPrefetchKeepsCacheBounded(self):
+        class Author(DbObject):
+            name=StrField("name")
+        class Book(DbObject):
+            title=StrField("title")
+            author=ReferenceField("author")
+        db = Mysql(username="test", password="test", database="test", streaming=True, fetchSize=2)
+        db._prefetchBatchSize = 2
+        db.registerClass(Author, Book)
+        for objectType in [Author, Book]:
+            db.define(objectType, dropIfExists=True)
+        for i in range(6):
+            author = Author(name="Author {}".format(i))
+            db.storeMany([author, Book(title="Book {}".format(i), author=author)])
+
+        results = db.list(Book, prefetch=['author'])
+        loaded = []
+        for _ in range(4):
+            book = next(results)
+            loaded.extend([ref(book), ref(book.author)])
+        del book
+        collect()
+        self.assertEqual([None] * 4, [r() for r in loaded[:4]])
+        self.assertEqual(2, len(list(results)))
+
+    def testStoreWritesOnlyChanges(self):
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            title=StrField("title")
+            author=StrField("author")
+            pages=CollectionField("pages")
+        self.db.registerClass(Page, Book)
+        self.db.define(Page, dropIfExists=True)
+        self.db.define(Book, dropIfExists=True)
+        self.db.store(Book(title="Dirty", pages=[Page(number=n) for n in range(3)]))
+
+        executed = []
+        def _trace(method):
+            def traced(statement, args=None):
+                executed.append(statement.split(' WHERE')[0])
+                return method(statement, args)
+            return traced
+        self.db._execute, self.db._executeMany, self.db._sql = map(_trace, [self.db._execute, self.db._executeMany, self.db._sql])
+
+        book = list(self.db.list(Book))[0]
+        del executed[:]
+        book.title = "Tracked"
+        self.db.store(book)
+        self.assertEqual(["UPDATE `Book` SET `title`=%s"], executed)
+
+        del executed[:]
+        self.db.store(book)
+        self.assertEqual([], executed)
+
+        changed = book.pages[0]
+        changed.number = 10
+        book.pages.append(Page(number=3))
+        self.db.store(book)
+        pageStatements = [statement for statement in executed if '`Page`' in statement]
+        self.assertEqual(1, len(pageStatements))
+        self.assertTrue(pageStatements[0].startswith("INSERT INTO `Page`"))
+        self.assertEqual(10, self.db.get(Page, changed.ID).number)
+        self.assertEqual(4, len(self.db.get(Book, book.ID).pages))
+
+    def testStoreInsertsAfterIdChangeOrDelete(self):
+        m = Mock(name="John")
+        self.db.store(m)
+        oldID, m.ID = m.ID, uuid4()
+        self.db.store(m)
+        self.assertTrue(self.db.exists(Mock, m.ID))
+        self.assertTrue(self.db.exists(Mock, oldID))
+
+        self.db.delete(Mock, m.ID)
+        m.name = "Jane"
+        self.db.store(m)
+        self.assertEqual("Jane", self.db.get(Mock, m.ID).name)
+
+        self.db.delete(Mock, m.ID)
+        self.db.store(m)
+        self.assertTrue(self.db.exists(Mock, m.ID))
+        self.db.deleteMany(Mock, [m.ID])
+        self.db.storeMany([m])
+        self.assertTrue(self.db.exists(Mock, m.ID))
+
+    def testStoreRestoresARemovedContainedItem(self):
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            pages=CollectionField("pages")
+        self.db.registerClass(Page, Book)
+        self.db.define(Page, dropIfExists=True)
+        self.db.define(Book, dropIfExists=True)
+        book = Book(pages=[Page(number=1), Page(number=2)])
+        self.db.store(book)
+
+        page = book.pages.pop()
+        self.db.store(book)
+        self.assertFalse(self.db.exists(Page, page.ID))
+        book.pages.append(page)
+        self.db.store(book)
+        self.assertEqual([1, 2], sorted(p.number for p in self.db.get(Book, book.ID).pages))
+
+    def testLazy(self):
+        class Author(DbObject):
+            name=StrField("name")
+        class Page(DbObject):
+            number=IntField("number")
+        class Book(DbObject):
+            title=StrField("title")
+            author=ReferenceField("author")
+            pages=CollectionField("pages")
+        self.db = Mysql(username="test", password="test", database="test", lazy=True)
+        self.db.registerClass(Author, Page, Book)
+        for objectType in [Author, Page, Book]:
+            self.db.define(objectType, dropIfExists=True)
+        author = Author(name="Moatley")
+        book = Book(title="Lazy", author=author, pages=[Page(number=1), Page(number=2)])
+        self.db.store(author)
+        self.db.store(book)
+
+        loaded = self.db.get(Book, book.ID)
+        self.assertNotEqual(None, Book.author.deferred(loaded))
+        self.assertNotEqual(None, Book.pages.deferred(loaded))
+        self.assertEqual("Lazy", loaded.title)
+
+        loaded.title = "Still lazy"
+        self.db.store(loaded)
+        self.assertNotEqual(None, Book.pages.deferred(loaded))
+        self.assertEqual(2, len(list(self.db.list(Page))))
+
+        loaded = self.db.get(Book, book.ID)
+        self.assertEqual("Still lazy", loaded.title)
+        self.assertEqual("Moatley", loaded.author.name)
+        self.assertEqual(None, Book.author.deferred(loaded))
+        loaded.pages.append(Page(number=3))
+        self.db.store(loaded)
+        self.assertEqual([1, 2, 3], sorted(p.number for p in self.db.get(Book, book.ID).pages))
+
     def testCollectionContained(self):
         class Page(DbObject):
             number=IntField("number")
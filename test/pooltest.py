@@ -0,0 +1,86 @@
+from seecr.test import SeecrTestCase, CallTrace
+
+from threading import Thread, Event
+from moatley.db.pool import ConnectionPool, PoolExhausted
+
+class PoolTest(SeecrTestCase):
+    def setUp(self):
+        super(PoolTest, self).setUp()
+        self.connections = []
+        def connect():
+            connection = CallTrace("Connection")
+            self.connections.append(connection)
+            return connection
+        self.connect = connect
+
+    def testMinimumConnectionsCreatedUpFront(self):
+        pool = ConnectionPool(self.connect, minSize=2, maxSize=4)
+        self.assertEqual(2, len(self.connections))
+        self.assertEqual(2, pool.statistics()['idle'])
+
+    def testConnectionIsReusedWithinAThread(self):
+        pool = ConnectionPool(self.connect, minSize=0, maxSize=4)
+        with pool.connection() as outer:
+            with pool.connection() as inner:
+                self.assertTrue(outer is inner)
+            with pool.connection(exclusive=True) as exclusive:
+                self.assertFalse(outer is exclusive)
+        self.assertEqual(2, len(self.connections))
+        with pool.connection() as again:
+            self.assertTrue(again in (outer, exclusive))
+        self.assertEqual(dict(size=2, idle=2, inUse=0), dict((k, pool.statistics()[k]) for k in ['size', 'idle', 'inUse']))
+
+    def testWaitsForAFreeConnection(self):
+        pool = ConnectionPool(self.connect, minSize=0, maxSize=1)
+        checkedOut, release = Event(), Event()
+        def holdConnection():
+            with pool.connection():
+                checkedOut.set()
+                release.wait()
+        thread = Thread(target=holdConnection)
+        thread.start()
+        checkedOut.wait()
+
+        waiter = Thread(target=lambda: pool.connection().__enter__())
+        waiter.start()
+        release.set()
+        thread.join()
+        waiter.join()
+
+        statistics = pool.statistics()
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual(2, statistics['checkouts'])
+        self.assertTrue(statistics['waits'] <= 1)
+
+    def testTimeout(self):
+        pool = ConnectionPool(self.connect, minSize=0, maxSize=1, timeout=0.01)
+        with pool.connection(exclusive=True):
+            self.assertRaises(PoolExhausted, lambda: pool.connection(exclusive=True).__enter__())
+        self.assertEqual(1, pool.statistics()['waits'])
+        self.assertEqual(1, pool.statistics()['timeouts'])
+
+    def testHealthCheckOnlyForIdleConnections(self):
+        pool = ConnectionPool(self.connect, minSize=1, maxSize=1, idleCheckInterval=0)
+        with pool.connection() as connection:
+            self.assertEqual(['ping'], [m.name for m in connection.calledMethods])
+
+        def ping():
+            raise IOError("gone")
+        connection.methods['ping'] = ping
+        with pool.connection() as replacement:
+            self.assertFalse(replacement is connection)
+        self.assertEqual(1, pool.statistics()['replaced'])
+
+        pool = ConnectionPool(self.connect, minSize=1, maxSize=1, idleCheckInterval=60)
+        with pool.connection() as connection:
+            self.assertEqual([], [m.name for m in connection.calledMethods])
+
+    def testBrokenConnectionsAreDiscarded(self):
+        pool = ConnectionPool(self.connect, minSize=0, maxSize=2, discardOn=(IOError,))
+        try:
+            with pool.connection() as connection:
+                raise IOError("broken")
+        except IOError:
+            pass
+        self.assertEqual(['close'], [m.name for m in connection.calledMethods])
+        self.assertEqual(0, pool.statistics()['size'])
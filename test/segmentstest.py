@@ -0,0 +1,147 @@
+from seecr.test import SeecrTestCase
+
+from os import listdir
+from os.path import join, getsize
+from decimal import Decimal
+from datetime import datetime
+from moatley.db import DbObject
+from moatley.db.segments import Segments, CorruptSegment
+from moatley.db.fields import StrField, IntField, DateField, ReferenceField, CollectionField, DecimalField
+
+class Mock(DbObject):
+    name = StrField("name")
+    age = IntField("age")
+    dob = DateField("dob")
+    weight = DecimalField("weight")
+
+class Page(DbObject):
+    number = IntField("number")
+
+class Book(DbObject):
+    title = StrField("title")
+    author = ReferenceField("author")
+    pages = CollectionField("pages")
+
+class SegmentsTest(SeecrTestCase):
+    def setUp(self):
+        super(SegmentsTest, self).setUp()
+        self.db = self.openDb()
+
+    def openDb(self, **kwargs):
+        db = Segments(root=self.tempdir, **kwargs)
+        db.registerClass(Mock, Page, Book)
+        return db
+
+    def testStoreGetAndList(self):
+        m = Mock(name="John", age=12, weight=Decimal("80.5"))
+        self.db.store(m)
+        self.db.store(Mock(name="Jane", age=13))
+
+        n = self.db.get(Mock, m.ID)
+        self.assertEqual(m.ID, n.ID)
+        self.assertEqual("John", n.name)
+        self.assertEqual(datetime.now().date(), n.dob)
+        self.assertEqual(["Jane", "John"], sorted(each.name for each in self.db.list(Mock)))
+        self.assertEqual(["Jane"], [each.name for each in self.db.list(Mock, age=13)])
+
+        m.name = "Johnny"
+        self.db.store(m)
+        self.assertEqual("Johnny", self.db.get(Mock, m.ID).name)
+
+        self.db.delete(Mock, m.ID)
+        self.assertEqual(None, self.db.get(Mock, m.ID))
+        self.assertFalse(self.db.exists(Mock, m.ID))
+
+    def testCountAndAggregates(self):
+        for name, age in [("A", 10), ("B", 20), ("A", 30)]:
+            self.db.store(Mock(name=name, age=age))
+        self.assertEqual(2, self.db.count(Mock, name="A"))
+        self.assertTrue(self.db.existsWhere(Mock, age=20))
+        self.assertEqual(dict(A=40, B=20), self.db.aggregate(Mock, 'sum', 'age', groupBy='name'))
+
+    def testCollectionsAndReferences(self):
+        author = Mock(name="Author")
+        b = Book(title="My book", author=author, pages=[Page(number=1), Page(number=2)])
+        self.db.store(author)
+        self.db.store(b)
+
+        b1 = self.db.get(Book, b.ID)
+        self.assertEqual(author, b1.author)
+        self.assertEqual([1, 2], [p.number for p in b1.pages])
+
+        b1.pages.pop()
+        self.db.store(b1)
+        self.assertEqual([1], [p.number for p in self.db.list(Page)])
+
+    def testDeleteManyAndDeleteWhere(self):
+        books = [Book(title="Book {}".format(i % 2), pages=[Page(number=n) for n in range(2)]) for i in range(4)]
+        self.db.storeMany(books)
+
+        self.assertEqual(1, self.db.deleteMany(Book, [books[0].ID]))
+        self.assertEqual([3, 6], [self.db.count(Book), self.db.count(Page)])
+        self.assertEqual(2, self.db.deleteWhere(Book, title="Book 1"))
+        self.assertEqual([1, 2], [self.db.count(Book), self.db.count(Page)])
+
+        db = self.openDb()
+        self.assertEqual([books[2].ID], [book.ID for book in db.list(Book)])
+
+    def testRecoversWithoutCheckpoint(self):
+        m1, m2 = Mock(name="one"), Mock(name="two")
+        self.db.store(m1)
+        self.db.store(m2)
+        self.db.delete(Mock, m1.ID)
+
+        db = self.openDb()
+        self.assertEqual(["two"], [m.name for m in db.list(Mock)])
+
+    def testRecoversTailAfterCheckpoint(self):
+        m1, m2 = Mock(name="one"), Mock(name="two")
+        self.db.store(m1)
+        self.db.checkpoint()
+        self.db.store(m2)
+
+        db = self.openDb()
+        self.assertEqual(["one", "two"], sorted(m.name for m in db.list(Mock)))
+
+    def testTornRecordAtTheEndIsTruncated(self):
+        m = Mock(name="one")
+        self.db.store(m)
+        self.db.close()
+        segment = join(self.tempdir, [name for name in listdir(self.tempdir) if name.startswith('segment-')][0])
+        size = getsize(segment)
+        with open(segment, 'ab') as fp:
+            fp.write('\x00\x00\x01\x00garbage')
+
+        db = self.openDb()
+        self.assertEqual(["one"], [m.name for m in db.list(Mock)])
+        self.assertEqual(size, getsize(segment))
+
+    def testCorruptRecordInSealedSegment(self):
+        db = self.openDb(segmentSize=1)
+        db.store(Mock(name="one"))
+        db.store(Mock(name="two"))
+        with open(join(self.tempdir, 'segment-00000001.log'), 'r+b') as fp:
+            fp.seek(10)
+            fp.write('X')
+        self.assertRaises(CorruptSegment, self.openDb)
+
+    def testCompaction(self):
+        db = self.openDb(segmentSize=512)
+        m = Mock(name="version 0")
+        others = [Mock(name="other {}".format(i)) for i in range(3)]
+        map(db.store, others)
+        for i in range(20):
+            m.name = "version {}".format(i)
+            db.store(m)
+        db.delete(Mock, others[0].ID)
+        self.assertTrue(db.garbage() > 0.5)
+        segmentsBefore = len([name for name in listdir(self.tempdir) if name.startswith('segment-')])
+
+        db.compact()
+        self.assertEqual(0.0, db.garbage())
+        self.assertTrue(len([name for name in listdir(self.tempdir) if name.startswith('segment-')]) < segmentsBefore)
+        self.assertEqual(["other 1", "other 2", "version 19"], sorted(each.name for each in db.list(Mock)))
+        db.close()
+
+        db = self.openDb()
+        self.assertEqual(["other 1", "other 2", "version 19"], sorted(each.name for each in db.list(Mock)))
@@ -0,0 +1,185 @@
+from seecr.test import SeecrTestCase
+
+from os.path import join
+from uuid import uuid4
+from datetime import date
+from decimal import Decimal
+from moatley.db import Sqlite, DbObject, Index
+from moatley.db.migration import BinaryIdMigration
+from moatley.db.fields import StrField, IntField, DateField, IDField, ReferenceField, CollectionField, DecimalField, BooleanField, TextField
+
+class Mock(DbObject):
+    name = StrField("name")
+    age = IntField("age")
+    dob = DateField("dob")
+    weight = DecimalField("weight", fractionLength=2)
+    alive = BooleanField("alive")
+    description = TextField("description")
+
+class Page(DbObject):
+    number = IntField("number")
+
+class Book(DbObject):
+    _indexes = [Index('title', 'year')]
+    title = StrField("title", index=True)
+    year = IntField("year")
+    author = ReferenceField("author")
+    pages = CollectionField("pages")
+
+class SqliteTest(SeecrTestCase):
+    def setUp(self):
+        super(SqliteTest, self).setUp()
+        self.db = Sqlite(join(self.tempdir, 'test.sqlite'))
+        self.db.registerClass(Mock, Page, Book)
+        for objectType in [Mock, Page, Book]:
+            self.db.define(objectType)
+
+    def testCreatedTable(self):
+        self.assertEqual(set([
+            ('ID', IDField),
+            ('name', StrField),
+            ('age', IntField),
+            ('dob', DateField),
+            ('weight', DecimalField),
+            ('alive', BooleanField),
+            ('description', TextField)]), set(self.db.display(Mock)))
+        self.assertEqual('wal', self.db._sql("PRAGMA journal_mode")[0][0])
+        self.assertTrue(set(['Book_title', 'Book_title_year']).issubset(self.db._existingIndexes('Book')))
+        self.assertEqual(['Book_pages_item'], sorted(name for name in self.db._existingIndexes('Book_pages') if not name.startswith('sqlite_')))
+        self.assertEqual([], self.db.sync(Book))
+
+    def testStoreAndGet(self):
+        m = Mock(name="John %s", age=42, dob=date(1975, 5, 4), weight=Decimal("81.25"), alive=True, description="100% sure")
+        self.db.store(m)
+
+        n = self.db.get(Mock, m.ID)
+        self.assertEqual(m.ID, n.ID)
+        self.assertEqual("John %s", n.name)
+        self.assertEqual(str, type(n.name))
+        self.assertEqual(42, n.age)
+        self.assertEqual(date(1975, 5, 4), n.dob)
+        self.assertEqual(Decimal("81.25"), n.weight)
+        self.assertEqual(True, n.alive)
+        self.assertEqual("100% sure", n.description)
+
+        n.name = "Jane"
+        self.db.store(n)
+        self.assertEqual(["Jane"], [each.name for each in self.db.list(Mock, age=42)])
+        self.db.delete(Mock, m.ID)
+        self.assertEqual(None, self.db.get(Mock, m.ID))
+
+        n.age = 43
+        self.db.store(n)
+        self.assertEqual(43, self.db.get(Mock, m.ID).age)
+        n.ID = uuid4()
+        self.db.store(n)
+        self.assertEqual(2, self.db.count(Mock))
+
+    def testCollectionsAndReferences(self):
+        author = Mock(name="Moatley")
+        book = Book(title="My book", author=author, pages=[Page(number=1), Page(number=2)])
+        self.db.storeMany([author, book])
+
+        loaded = self.db.get(Book, book.ID)
+        self.assertEqual("Moatley", loaded.author.name)
+        self.assertEqual([1, 2], sorted(p.number for p in loaded.pages))
+
+        del loaded.pages[0]
+        self.db.store(loaded)
+        self.assertEqual(1, len(self.db.get(Book, book.ID).pages))
+        self.assertEqual(1, self.db.count(Page))
+
+    def testStoreMany(self):
+        books = [Book(title="Book {}".format(i), year=2000 + i, pages=[Page(number=n) for n in range(3)]) for i in range(600)]
+        self.db.storeMany(books)
+        self.assertEqual(600, self.db.count(Book))
+        self.assertEqual(1800, self.db.count(Page))
+
+        books[0].title = "Changed"
+        books[1].pages.append(Page(number=3))
+        self.db.storeMany(books[:2])
+        self.assertEqual("Changed", self.db.get(Book, books[0].ID).title)
+        self.assertEqual(1801, self.db.count(Page))
+        self.assertEqual(600, len(list(self.db.list(Book, prefetch=['pages']))))
+
+    def testDeleteManyAndDeleteWhere(self):
+        books = [Book(title="Book {}".format(i % 2), pages=[Page(number=n) for n in range(3)]) for i in range(1200)]
+        self.db.storeMany(books)
+
+        self.assertEqual(1000, self.db.deleteMany(Book, (book.ID for book in books[:1000])))
+        self.assertEqual(600, self.db.count(Page))
+        self.assertEqual(100, self.db.deleteWhere(Book, title="Book 1"))
+        self.assertEqual([100, 300, 300], [self.db.count(Book), self.db.count(Page), len(self.db._sql("SELECT * FROM `Book_pages`"))])
+
+    def testTransaction(self):
+        with self.db.transaction():
+            self.db.store(Mock(name="first"))
+            with self.db.transaction():
+                self.db.store(Mock(name="second"))
+        try:
+            with self.db.transaction():
+                self.db.store(Mock(name="third"))
+                raise ValueError("abort")
+        except ValueError:
+            pass
+        self.assertEqual(["first", "second"], sorted(m.name for m in self.db.list(Mock)))
+
+    def testQueryAndAggregates(self):
+        for name, age, weight in [("A", 10, "1.5"), ("B", 20, "2.5"), ("A", 30, "3.0"), ("C", 40, "4.0")]:
+            self.db.store(Mock(name=name, age=age, weight=Decimal(weight)))
+
+        self.assertEqual(["C", "A"], [m.name for m in self.db.query(Mock).where(Mock.age > 20).orderBy('-age')])
+        self.assertEqual(["A", "A"], [m.name for m in self.db.query(Mock).where(Mock.weight.isIn([Decimal("1.5"), Decimal("3.0")]))])
+        self.assertEqual(2, self.db.count(Mock, name="A"))
+        self.assertEqual(25.0, self.db.aggregate(Mock, 'avg', 'age'))
+        self.assertEqual(Decimal("11.0"), self.db.aggregate(Mock, 'sum', 'weight'))
+        self.assertEqual(dict(A=40, B=20, C=40), self.db.aggregate(Mock, 'sum', 'age', groupBy='name'))
+
+    def testBinaryIds(self):
+        db = Sqlite(join(self.tempdir, 'binary.sqlite'), binaryIds=True)
+        db.registerClass(Mock, Page, Book)
+        for objectType in [Mock, Page, Book]:
+            db.define(objectType)
+        author = Mock(name="Moatley")
+        book = Book(title="My book", author=author, pages=[Page(number=1), Page(number=2)])
+        db.storeMany([author, book])
+
+        self.assertEqual((16, 18), tuple(len(value) for value in db._sql("SELECT `ID`, `author` FROM `Book`")[0]))
+        loaded = db.get(Book, book.ID)
+        self.assertEqual(("Moatley", [1, 2]), (loaded.author.name, sorted(p.number for p in loaded.pages)))
+        self.assertEqual({author.qualifiedId: 1}, db.aggregate(Book, 'count', groupBy='author'))
+        self.assertEqual(1, db.deleteMany(Book, [book.ID]))
+        self.assertEqual(0, db.count(Page))
+
+        db.storeMany([Book(title="a", pages=[Page(number=1)]), Book(title="b"), Mock(name="Other")])
+        self.assertEqual(1, db.deleteWhere(Book, title="a"))
+        self.assertEqual((["b"], 0), ([b.title for b in db.list(Book)], db.count(Page)))
+        self.assertEqual(1, db.query(Mock).orderBy('name').limit(1).delete())
+        self.assertEqual(["Other"], [m.name for m in db.list(Mock)])
+
+    def testMigrateToBinaryIds(self):
+        author = Mock(name="Moatley")
+        books = [Book(title="Book {}".format(i), author=author, pages=[Page(number=n) for n in range(2)]) for i in range(5)]
+        self.db.storeMany([author] + books)
+
+        binary = Sqlite(join(self.tempdir, 'test.sqlite'), binaryIds=True)
+        binary.registerClass(Mock, Page, Book)
+        migration = BinaryIdMigration(binary, batchSize=2)
+        self.assertEqual([10, 0], migration.copy(Book))
+        self.db.delete(Book, books[0].ID)
+        for objectType in [Mock, Page, Book]:
+            migration.migrate(objectType)
+
+        self.assertEqual(4, binary.count(Book, author=author))
+        self.assertEqual([0, 1], sorted(p.number for p in binary.get(Book, books[1].ID).pages))
+        self.assertEqual(4, len(binary._sql("SELECT * FROM `Book__text`")))
+        self.assertEqual([], [name for name in binary._existingIndexes('Book__text') if not name.startswith('sqlite_')])
+        self.assertEqual([], binary.sync(Book))
+        self.assertRaises(ValueError, lambda: BinaryIdMigration(self.db))
+
+    def testInMemory(self):
+        db = Sqlite(':memory:')
+        db.define(Mock)
+        m = Mock(name="volatile")
+        db.storeMany([m])
+        self.assertEqual("volatile", db.get(Mock, m.ID).name)